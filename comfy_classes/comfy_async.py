@@ -0,0 +1,557 @@
+import asyncio
+import concurrent.futures
+import json
+import threading
+import uuid
+from typing import Optional
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QImage
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_AsyncComfyClient = DEBUG
+DEBUG_AsyncComfyClient_FULL = DEBUG_FULL
+DEBUG_AsyncImageGeneratorAPIWrapper = DEBUG
+from constant import (
+    COMFY_HTTP_TIMEOUT, COMFY_HTTP_POOL_SIZE, COMFY_WS_CONNECT_TIMEOUT, COMFY_FAILOVER_GRACE,
+    COMFY_RETRIEVAL_MODE, COMFY_UPLOAD_SUBFOLDER, GENERATION_TIMEOUT
+)
+from prompts import dico_styles
+from comfy_classes.comfy_scheduler import ComfyScheduler, ComfyBackend, BackendUnavailableError
+from comfy_classes.workflow_registry import WorkflowRegistry, WorkflowTemplate
+from comfy_classes.generation_job import GenerationJob
+from comfy_classes.generation_deadline import (
+    Deadline, GenerationTimeoutError, STAGE_UPLOAD, STAGE_QUEUE, STAGE_RETRIEVAL
+)
+from comfy_classes.job_protocol import JobProtocol, InputUpload, fail_over, FINISHED, DISCONNECTED, RECONNECTED
+
+
+def is_available() -> bool:
+    """
+    True if aiohttp is installed and the asyncio client can be used.
+    """
+    return aiohttp is not None
+
+
+class AsyncLoopThread:
+    """
+    One background thread running the asyncio event loop shared by every async job.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "AsyncLoopThread":
+        """
+        Return the shared loop thread, starting it on first use.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def close_instance(cls) -> None:
+        """
+        Close every client and stop the loop (called when the application quits).
+        """
+        with cls._instance_lock:
+            loop_thread, cls._instance = cls._instance, None
+        if loop_thread is not None:
+            loop_thread.close()
+
+    def __init__(self) -> None:
+        """
+        Create the event loop and start its thread.
+        """
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="AsyncComfy-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        """
+        Thread body: run the loop until stop() is called.
+        """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """
+        Schedule a coroutine on the loop from any thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self) -> None:
+        """
+        Close the clients, then stop the loop and join its thread.
+        """
+        try:
+            self.submit(AsyncComfyClient.close_all()).result(timeout=5.0)
+        except Exception as e:
+            logger.info(f"[AsyncLoopThread] Error closing clients: {e!r}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=2.0)
+
+
+class LoopEvents:
+    """
+    Receiver of a job's events for ComfySession.register(): the session's
+    reader thread hands each event over to an asyncio queue on the loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Create an empty queue on the loop.
+        """
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def put(self, event: dict) -> None:
+        """
+        Queue an event from any thread.
+        """
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            pass
+
+
+class AsyncComfyClient:
+    """
+    Asyncio HTTP front of one ComfyBackend of the ComfyScheduler. Prompts are
+    queued under the client_id of the backend's ComfySession, whose websocket
+    routes their events to per-job asyncio queues: blocking and asyncio jobs
+    share one websocket and one load count per server. Must be used from the
+    AsyncLoopThread loop.
+    """
+    _clients: dict = {}
+
+    @classmethod
+    def for_backend(cls, backend: ComfyBackend) -> "AsyncComfyClient":
+        """
+        Return the client of a backend, opening its HTTP pool on first use.
+        """
+        client = cls._clients.get(backend.name)
+        if client is None:
+            client = cls(backend)
+            cls._clients[backend.name] = client
+        return client
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """
+        Close the HTTP pool of every client.
+        """
+        clients = list(cls._clients.values())
+        cls._clients.clear()
+        for client in clients:
+            await client.close()
+
+    def __init__(self, backend: ComfyBackend) -> None:
+        """
+        Open the HTTP pool of a backend (on the running loop).
+        """
+        self.backend = backend
+        self.session = backend.session
+        self.http_base_url = self.session.http_base_url
+        self._jobs: dict[str, LoopEvents] = {}
+        timeout = aiohttp.ClientTimeout(sock_connect=COMFY_HTTP_TIMEOUT[0], sock_read=COMFY_HTTP_TIMEOUT[1])
+        self._http = aiohttp.ClientSession(
+            timeout=timeout, connector=aiohttp.TCPConnector(limit=COMFY_HTTP_POOL_SIZE)
+        )
+
+    async def close(self) -> None:
+        """
+        Close the HTTP pool.
+        """
+        await self._http.close()
+
+    async def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the websocket of the session is connected; return False on timeout.
+        """
+        if self.session.connected:
+            return True
+        return await asyncio.get_running_loop().run_in_executor(None, self.session.wait_connected, timeout)
+
+    def url(self, path: str) -> str:
+        """
+        Return the absolute HTTP URL for a server path.
+        """
+        return self.session.url(path)
+
+    async def get_json(self, path: str, **kwargs) -> dict:
+        """
+        GET a server path and decode the JSON answer.
+        """
+        async with self._http.get(self.url(path), **kwargs) as resp:
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
+
+    async def post_json(self, path: str, **kwargs) -> dict:
+        """
+        POST to a server path and decode the JSON answer, if any.
+        """
+        async with self._http.post(self.url(path), **kwargs) as resp:
+            resp.raise_for_status()
+            body = await resp.read()
+        if not body:
+            return {}
+        try:
+            return json.loads(body)
+        except ValueError:
+            return {}
+
+    async def fetch_view(self, filename: str, subfolder: str = '', folder_type: str = 'output') -> bytes:
+        """
+        Download the bytes of a server-side image through /view.
+        """
+        params = {'filename': filename, 'subfolder': subfolder, 'type': folder_type}
+        async with self._http.get(self.url('/view'), params=params) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+    async def upload_image(self, data: bytes, filename: str, subfolder: str = '', mime: str = 'image/jpeg') -> str:
+        """
+        Upload encoded image bytes to /upload/image and return the name LoadImage expects.
+        """
+        form = aiohttp.FormData()
+        form.add_field('image', data, filename=filename, content_type=mime)
+        form.add_field('type', 'input')
+        form.add_field('subfolder', subfolder)
+        form.add_field('overwrite', 'true')
+        info = await self.post_json('/upload/image', data=form)
+        name = info.get('name', filename)
+        sub = info.get('subfolder', subfolder)
+        return f"{sub}/{name}" if sub else name
+
+    async def queue_prompt(self, prompt: dict, front: bool = False) -> str:
+        """
+        Register a job with the session, submit the prompt and return its prompt_id.
+        """
+        prompt_id = str(uuid.uuid4())
+        self._jobs[prompt_id] = self.session.register(prompt_id, LoopEvents(asyncio.get_running_loop()))
+        payload = {'client_id': self.session.client_id, 'prompt': prompt, 'prompt_id': prompt_id}
+        if front:
+            payload['front'] = True
+        try:
+            info = await self.post_json('/prompt', json=payload)
+        except Exception:
+            self.release(prompt_id)
+            raise
+        server_id = info.get('prompt_id') or prompt_id
+        if server_id != prompt_id:
+            self.session.rename(prompt_id, server_id)
+            self._jobs[server_id] = self._jobs.pop(prompt_id)
+        if DEBUG_AsyncComfyClient:
+            logger.info(f"[DEBUG][AsyncComfyClient] Prompt queued on {self.http_base_url}: prompt_id={server_id}")
+        return server_id
+
+    async def cancel_prompt(self, prompt_id: str) -> None:
+        """
+        Remove a prompt from the server queue, interrupt it if it is running,
+        and wake up the job waiting on its events.
+        """
+        try:
+            await self.post_json('/queue', json={'delete': [prompt_id]})
+            if self.session.is_executing(prompt_id):
+                await self.post_json('/interrupt', json={'prompt_id': prompt_id})
+        except Exception as e:
+            logger.info(f"[AsyncComfyClient] Failed to cancel prompt {prompt_id}: {e!r}")
+        events = self._jobs.get(prompt_id)
+        if events is not None:
+            events.queue.put_nowait({'type': 'execution_interrupted', 'data': {'prompt_id': prompt_id, 'cancelled': True}})
+
+    def is_executing(self, prompt_id: str) -> bool:
+        """
+        True if the server reported that this prompt is currently running.
+        """
+        return self.session.is_executing(prompt_id)
+
+    async def get_event(self, prompt_id: str) -> dict:
+        """
+        Wait for the next event routed to a job.
+        """
+        return await self._jobs[prompt_id].queue.get()
+
+    def release(self, prompt_id: str) -> None:
+        """
+        Stop routing events to a finished job.
+        """
+        self._jobs.pop(prompt_id, None)
+        self.session.release(prompt_id)
+
+
+class AsyncImageGeneratorAPIWrapper(QObject):
+    """
+    Non-blocking counterpart of ImageGeneratorAPIWrapper. generate() schedules the
+    job on the shared asyncio loop and returns at once; progress(), result() and
+    the Qt signals report on it. Many wrappers share one thread; backends are
+    chosen and failed over by the ComfyScheduler and events read from the
+    ComfySession websocket, as for the blocking wrapper, so both count in the
+    same load. Results are always read from memory (/view or websocket frames).
+    The events of a job are handled by the JobProtocol the blocking wrapper uses too.
+    """
+    progress_changed = Signal(float)
+    preview_ready = Signal(QImage)
+    finished = Signal(object)
+
+    def __init__(self, style: Optional[str] = None, qimg: Optional[QImage] = None, scheduler: Optional[ComfyScheduler] = None) -> None:
+        """
+        Initialize the wrapper with an optional style and input QImage.
+        Generations go through the shared ComfyScheduler unless another one is given.
+        """
+        super().__init__()
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for the asyncio ComfyUI client")
+        self._styles_prompts = dico_styles
+        self._style = style if style in self._styles_prompts else next(iter(self._styles_prompts))
+        self._template = WorkflowRegistry.get_instance().get(self._style)
+        self._quality_tier = 0
+        self._retrieval_mode = 'websocket' if COMFY_RETRIEVAL_MODE == 'websocket' else 'view'
+        self._input = InputUpload(qimg)
+        self._scheduler = scheduler or ComfyScheduler.get_instance()
+        self._client: Optional[AsyncComfyClient] = None
+        self._job: Optional[GenerationJob] = None
+        self._future: Optional[concurrent.futures.Future] = None
+        self._cancelled = False
+        self._loop_thread = AsyncLoopThread.get_instance()
+
+    @property
+    def job(self) -> Optional[GenerationJob]:
+        """
+        Return the job of the last generate() call.
+        """
+        return self._job
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        True once cancel() has been called.
+        """
+        return self._cancelled
+
+    def set_style(self, style: str) -> None:
+        """
+        Set a new style for the next generation.
+        """
+        if style not in self._styles_prompts:
+            raise ValueError(f"Style '{style}' not found.")
+        self._style = style
+        self._template = WorkflowRegistry.get_instance().get(style)
+
+    def set_template(self, template: WorkflowTemplate) -> None:
+        """
+        Run another workflow than the style's one (the deferred upscale stage).
+        """
+        self._template = template
+
+    def set_quality_tier(self, tier: int) -> None:
+        """
+        Generate at a reduced quality tier (see WorkflowRegistry.quality_tier()).
+        """
+        self._quality_tier = tier
+
+    def set_img(self, qimg: QImage) -> None:
+        """
+        Set the input image for the next generation.
+        """
+        if qimg is None or qimg.isNull():
+            raise ValueError("QImage is empty, cannot use it as input.")
+        self._input.set_image(qimg)
+
+    def generate(self, custom_prompt: Optional[dict] = None, front: bool = False, seed: Optional[int] = None, timeout: Optional[int] = None, draft: float = 0.0) -> concurrent.futures.Future:
+        """
+        Start a generation on the shared loop and return its future.
+        A given seed makes the result reproducible (see ResultCache).
+        A draft ratio generates the quick draft of the style (see WorkflowRegistry.sized()).
+        The future resolves to the generated QImage, or None if cancelled; it
+        fails with GenerationTimeoutError when the job misses its deadline
+        (timeout in ms, default GENERATION_TIMEOUT) or stalls.
+        """
+        if DEBUG_AsyncImageGeneratorAPIWrapper:
+            logger.info(f"[DEBUG][AsyncImageGeneratorAPIWrapper] Scheduling generation of {self._style}")
+        if custom_prompt:
+            template, divisor = WorkflowTemplate('custom', custom_prompt), None
+        else:
+            height = self._input.image.height() if self._input.image else 0
+            template, divisor = WorkflowRegistry.get_instance().sized(self._template, height, draft, self._quality_tier)
+        self._job = GenerationJob(self._style, template, seed, divisor)
+        deadline = Deadline(timeout / 1000 if timeout else GENERATION_TIMEOUT)
+        self._future = self._loop_thread.submit(self._generate(self._job, front, deadline))
+        self._future.add_done_callback(self._on_done)
+        return self._future
+
+    def progress(self) -> float:
+        """
+        Return the progress percentage of the current job.
+        """
+        return self._job.progress_percentage() if self._job else 0.0
+
+    def result(self, timeout: Optional[float] = None) -> Optional[QImage]:
+        """
+        Block until the current job finishes and return its image.
+        """
+        if self._future is None:
+            raise RuntimeError("No generation has been run, call generate() first.")
+        return self._future.result(timeout)
+
+    def is_executing(self) -> bool:
+        """
+        True while the server is running the prompt of the current job.
+        """
+        job, client = self._job, self._client
+        return job is not None and client is not None and job.prompt_id is not None and client.is_executing(job.prompt_id)
+
+    def cancel(self) -> None:
+        """
+        Cancel the generation on the server; the future then resolves to None.
+        """
+        self._cancelled = True
+        job, client = self._job, self._client
+        if job is not None and client is not None and job.prompt_id is not None:
+            self._loop_thread.submit(client.cancel_prompt(job.prompt_id))
+
+    def _on_done(self, future: concurrent.futures.Future) -> None:
+        """
+        Emit finished with the image, or None on failure or cancellation.
+        """
+        try:
+            qimg = future.result()
+        except Exception as e:
+            logger.info(f"[AsyncImageGeneratorAPIWrapper] Generation failed: {e!r}")
+            qimg = None
+        self.finished.emit(qimg)
+
+    async def _generate(self, job: GenerationJob, front: bool, deadline: Deadline) -> Optional[QImage]:
+        """
+        Run a job within its deadline; on timeout the prompt is cancelled on
+        the server and GenerationTimeoutError names the stage that stalled.
+        """
+        try:
+            return await asyncio.wait_for(self._generate_with_failover(job, front, deadline), deadline.remaining())
+        except (GenerationTimeoutError, asyncio.TimeoutError) as e:
+            error = e if isinstance(e, GenerationTimeoutError) else deadline.error(job.stage or STAGE_UPLOAD)
+            client = self._client
+            if client is not None and job.prompt_id is not None:
+                asyncio.ensure_future(client.cancel_prompt(job.prompt_id))
+            if client is not None and error.backend_at_fault:
+                self._scheduler.mark_failed(client.backend, error)
+            logger.info(f"[AsyncImageGeneratorAPIWrapper] Job {job.job_id}: {error}")
+            raise error
+
+    async def _generate_with_failover(self, job: GenerationJob, front: bool, deadline: Deadline) -> Optional[QImage]:
+        """
+        Run a job, failing over to another backend if its server drops.
+        """
+        scheduler = self._scheduler
+        tried = []
+        while not self._cancelled:
+            backend = scheduler.acquire(exclude=tried, prefer=self._preferred_backend())
+            client = AsyncComfyClient.for_backend(backend)
+            try:
+                await self._run_job(job, client, front, deadline)
+                if self._cancelled:
+                    return None
+                job.set_stage(STAGE_RETRIEVAL)
+                return await self._load_result(job, client)
+            except GenerationTimeoutError:
+                raise
+            except (BackendUnavailableError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if self._cancelled:
+                    return None
+                fail_over(scheduler, backend, backend.name, job, e, tried, 'AsyncImageGeneratorAPIWrapper')
+            finally:
+                scheduler.release(backend)
+        return None
+
+    def _preferred_backend(self) -> Optional[ComfyBackend]:
+        """
+        Return the backend the input image was already uploaded to (see InputUpload.preferred()).
+        """
+        backends = self._scheduler.backends
+        index = self._input.preferred([b.session for b in backends])
+        return None if index is None else backends[index]
+
+    async def _upload_input(self, job: GenerationJob, client: AsyncComfyClient) -> None:
+        """
+        Upload the input image once per server, encoding it off the loop.
+        The name is shared with the other wrappers working on the same image.
+        """
+        if self._input.image is None:
+            return
+        name = self._input.name_on(client.session)
+        if name is None:
+            loop = asyncio.get_running_loop()
+            data, filename, mime = await loop.run_in_executor(None, self._input.encode, client.session)
+            name = await client.upload_image(data, filename, COMFY_UPLOAD_SUBFOLDER, mime)
+            self._input.uploaded(client.session, name)
+        job.input_name = name
+
+    async def _run_job(self, job: GenerationJob, client: AsyncComfyClient, front: bool, deadline: Deadline) -> None:
+        """
+        Run a job on one server until it finishes, its events handled by a JobProtocol.
+        Raises GenerationTimeoutError if the prompt goes COMFY_STALL_TIMEOUT
+        seconds without any event while executing.
+        """
+        self._client = client
+        job.backend = client.http_base_url
+        job.set_stage(STAGE_UPLOAD)
+        if not await client.wait_connected(COMFY_WS_CONNECT_TIMEOUT):
+            raise BackendUnavailableError(f"ComfyUI websocket not connected ({client.session.ws_url})")
+        await self._upload_input(job, client)
+        prompt = job.build_prompt(self._styles_prompts[job.style], websocket_output=self._retrieval_mode == 'websocket')
+        job.set_stage(STAGE_QUEUE)
+        prompt_id = await client.queue_prompt(prompt, front=front)
+        protocol = JobProtocol(job, prompt, self)
+        job.prompt_id = prompt_id
+        queued = client.session.queue_remaining
+        job.progress_model.on_queued(min(queued, 1) if front else queued)
+        if self._cancelled:
+            await client.cancel_prompt(prompt_id)
+        try:
+            while True:
+                timeout, stalled = protocol.next_timeout(deadline)
+                try:
+                    event = await asyncio.wait_for(client.get_event(prompt_id), timeout)
+                except asyncio.TimeoutError:
+                    raise deadline.error(job.stage, stalled=stalled) from None
+                action = protocol.handle(event)
+                if action == FINISHED:
+                    break
+                if action == DISCONNECTED and not await client.wait_connected(COMFY_FAILOVER_GRACE):
+                    raise BackendUnavailableError(f"ComfyUI at {client.http_base_url} dropped during the job")
+                if action == RECONNECTED:
+                    if protocol.record_history(await client.get_json(f"/history/{prompt_id}")):
+                        break
+                    if not protocol.is_queued(await client.get_json('/queue')):
+                        raise BackendUnavailableError(f"ComfyUI at {client.http_base_url} lost prompt {prompt_id}")
+        finally:
+            client.release(prompt_id)
+        protocol.finish('AsyncImageGeneratorAPIWrapper')
+
+    async def _load_result(self, job: GenerationJob, client: AsyncComfyClient) -> Optional[QImage]:
+        """
+        Decode the result from the websocket bytes or download it through /view.
+        """
+        loop = asyncio.get_running_loop()
+        data = job.result_bytes
+        if not data:
+            for info in reversed(job.result_images):
+                try:
+                    data = await client.fetch_view(info.get('filename', ''), info.get('subfolder', ''), info.get('type', 'output'))
+                    break
+                except aiohttp.ClientError as e:
+                    logger.info(f"[AsyncImageGeneratorAPIWrapper] /view fetch failed for {info}: {e!r}")
+        if not data:
+            return None
+        qimg = await loop.run_in_executor(None, QImage.fromData, data)
+        return None if qimg.isNull() else qimg
@@ -0,0 +1,224 @@
+"""
+End-to-end benchmark of the client side of the generation pipeline.
+
+Drives the asyncio client GenerationQueue runs (AsyncImageGeneratorAPIWrapper),
+or the blocking ImageGeneratorAPIWrapper with --client blocking, from a
+synthetic capture to the decoded result and reports latency percentiles per
+stage. With --mock it starts comfy_mock_server in-process, so it runs on any
+machine without a GPU.
+
+    python -m comfy_classes.comfy_benchmark --mock --runs 50 --step-latency 0.02
+    python -m comfy_classes.comfy_benchmark --url http://127.0.0.1:8188 --runs 10 --style clay
+    python -m comfy_classes.comfy_benchmark --mock --runs 50 --client blocking
+
+With --regenerate N every capture is then regenerated N times with a new
+seed, and the two kinds of runs are reported apart with the share of nodes
+ComfyUI served from its execution cache. With --draft RATIO every run
+first generates a draft with that share of the sampler steps, then the final
+image with the same seed; the 'draft' row is the time to the first image.
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+from typing import Optional
+
+from aiohttp import web
+from PySide6.QtGui import QImage, QColor
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import HTTP_BASE_URL
+from comfy_classes.comfy_class_API import ImageGeneratorAPIWrapper
+from comfy_classes.comfy_async import AsyncImageGeneratorAPIWrapper, AsyncLoopThread
+from comfy_classes.comfy_session import ComfySession
+from comfy_classes.comfy_scheduler import ComfyScheduler
+from comfy_classes.comfy_mock_server import MockComfyServer, build_parser as mock_parser, config_from_args
+from comfy_classes.quality_governor import percentile
+from comfy_classes.generation_deadline import STAGE_UPLOAD, STAGE_QUEUE, STAGE_EXECUTION, STAGE_RETRIEVAL
+
+STAGES = ('prepare', STAGE_UPLOAD, STAGE_QUEUE, STAGE_EXECUTION, STAGE_RETRIEVAL)
+
+
+def start_mock(args: argparse.Namespace) -> tuple:
+    """
+    Serve a MockComfyServer on a background event loop and return (server, stop function).
+    """
+    server = MockComfyServer(config_from_args(args))
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(server.app())
+    ready = threading.Event()
+
+    def run() -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, args.host, args.port).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="MockComfyServer", daemon=True).start()
+    ready.wait(10)
+
+    def stop() -> None:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+    return server, stop
+
+
+def synthetic_capture(width: int, height: int, index: int) -> QImage:
+    """
+    Return a camera-sized frame, different for every run so that nothing is cached.
+    """
+    qimg = QImage(width, height, QImage.Format_RGB888)
+    qimg.fill(QColor.fromHsv((index * 37) % 360, 160, 200))
+    return qimg
+
+
+def run_once(scheduler: ComfyScheduler, style: str, capture: QImage, timeout_ms: int, seed: Optional[int] = None,
+             draft: float = 0.0, client: str = 'async') -> dict:
+    """
+    Generate one image with the asyncio or the blocking client and return its
+    total latency, per-stage durations and cache hit rate, and the time to the
+    draft when draft is set.
+    """
+    start = time.monotonic()
+    if client == 'async':
+        api = AsyncImageGeneratorAPIWrapper(style=style, qimg=capture, scheduler=scheduler)
+
+        def generate(seed: Optional[int], draft: float = 0.0) -> Optional[QImage]:
+            return api.generate(timeout=timeout_ms, seed=seed, draft=draft).result()
+    else:
+        api = ImageGeneratorAPIWrapper(style=style, qimg=capture, scheduler=scheduler)
+
+        def generate(seed: Optional[int], draft: float = 0.0) -> Optional[QImage]:
+            api.generate_image(timeout=timeout_ms, seed=seed, draft=draft)
+            qimg = api.load_result_image(timeout=timeout_ms / 1000)
+            api.delete_input_and_output_images()
+            return qimg
+    first = None
+    refine_start = start
+    if draft:
+        qimg = generate(seed, draft)
+        if qimg is None or qimg.isNull():
+            raise RuntimeError("empty draft")
+        first = time.monotonic() - start
+        seed = api.job.seed
+        refine_start = time.monotonic()
+    qimg = generate(seed)
+    end = time.monotonic()
+    if qimg is None or qimg.isNull():
+        raise RuntimeError("empty result")
+    job = api.job
+    stages = job.stage_durations(end)
+    stages['prepare'] = job.stage_times[0][1] - refine_start if job.stage_times else 0.0
+    sample = {'total': end - start, 'stages': stages, 'cached': job.cache_hit_rate()}
+    if first is not None:
+        sample['draft'] = first
+    return sample
+
+
+def report(samples: list, failures: dict, wall: float) -> None:
+    """
+    Print the latency percentiles of the successful runs and the failure counts.
+    """
+    runs = len(samples) + sum(failures.values())
+    print(f"{len(samples)}/{runs} runs succeeded in {wall:.1f}s ({runs / wall:.2f} runs/s)")
+    for kind in ('first', 'regenerate'):
+        kind_samples = [s for s in samples if s['kind'] == kind]
+        if kind_samples:
+            cached = sum(s['cached'] for s in kind_samples) / len(kind_samples)
+            print(f"\n{kind} runs: {len(kind_samples)}, nodes from the ComfyUI cache: {cached:.0%}")
+            report_table(kind_samples)
+    for kind, count in sorted(failures.items()):
+        print(f"failed: {kind} x{count}")
+
+
+def report_table(samples: list) -> None:
+    """
+    Print p50, p90, p99, max and mean of the total, of each stage and of the client overhead.
+    """
+    header = f"{'stage':<12}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'mean':>9}"
+    print(header)
+    print('-' * len(header))
+    rows = [('total', [s['total'] for s in samples])]
+    if all('draft' in s for s in samples):
+        rows.append(('draft', [s['draft'] for s in samples]))
+    rows += [(stage, [s['stages'].get(stage, 0.0) for s in samples]) for stage in STAGES]
+    rows.append(('overhead', [s['total'] - s['stages'].get(STAGE_EXECUTION, 0.0) for s in samples]))
+    for name, values in rows:
+        if not values:
+            continue
+        mean = sum(values) / len(values)
+        print(f"{name:<12}" + ''.join(f"{v * 1000:>7.1f}ms" for v in (
+            percentile(values, 50), percentile(values, 90), percentile(values, 99), max(values), mean)))
+
+
+def main(argv: Optional[list] = None) -> None:
+    """
+    Parse the options, run the benchmark and print the report.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark capture-to-result latency through the ComfyUI client.",
+        parents=[mock_parser(add_help=False)],
+    )
+    parser.add_argument('--mock', action='store_true', help="start a mock ComfyUI server in-process (uses --host/--port)")
+    parser.add_argument('--url', default=None, help=f"ComfyUI base URL (default {HTTP_BASE_URL}, or the mock)")
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2, help="runs excluded from the statistics")
+    parser.add_argument('--style', default='clay')
+    parser.add_argument('--capture-size', default='1920x1080', help="WIDTHxHEIGHT of the synthetic capture")
+    parser.add_argument('--timeout', type=int, default=60000, help="per-run deadline in ms")
+    parser.add_argument('--regenerate', type=int, default=0, help="regenerations of every capture with a new seed")
+    parser.add_argument('--draft', type=float, default=0.0, help="share of the sampler steps of a draft generated first")
+    parser.add_argument('--client', choices=('async', 'blocking'), default='async',
+                        help="AsyncImageGeneratorAPIWrapper (what GenerationQueue runs) or ImageGeneratorAPIWrapper")
+    args = parser.parse_args(argv)
+
+    stop_mock = None
+    mock = None
+    if args.mock:
+        mock, stop_mock = start_mock(args)
+    url = (args.url or (f"http://{args.host}:{args.port}" if args.mock else HTTP_BASE_URL)).rstrip('/')
+    ws_url = url.replace('http', 'ws', 1) + '/ws'
+    scheduler = ComfyScheduler([(url, ws_url)])
+    scheduler.start()
+    if not scheduler.backends[0].session.wait_connected(10):
+        raise SystemExit(f"Cannot connect to {ws_url}")
+
+    width, _, height = args.capture_size.partition('x')
+    samples, failures = [], {}
+    wall_start = None
+    for index in range(args.warmup + args.runs):
+        if index == args.warmup:
+            wall_start = time.monotonic()
+        capture = synthetic_capture(int(width), int(height or width), index)
+        for attempt in range(1 + args.regenerate):
+            seed = random.randint(0, 2**32 - 1) if attempt else None
+            try:
+                sample = run_once(scheduler, args.style, capture, args.timeout, seed, args.draft, args.client)
+            except Exception as e:
+                if index >= args.warmup:
+                    kind = type(e).__name__
+                    failures[kind] = failures.get(kind, 0) + 1
+                logger.info(f"[Benchmark] Run {index}.{attempt} failed: {e!r}")
+                continue
+            if index >= args.warmup:
+                sample['kind'] = 'regenerate' if attempt else 'first'
+                samples.append(sample)
+    print(f"client: {args.client}")
+    report(samples, failures, time.monotonic() - (wall_start or time.monotonic()) or 1e-9)
+    if mock is not None:
+        print(f"mock server: {mock.stats}")
+    AsyncLoopThread.close_instance()
+    scheduler.close()
+    ComfySession.close_all()
+    if stop_mock is not None:
+        stop_mock()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
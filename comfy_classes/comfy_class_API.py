@@ -1,17 +1,14 @@
-import glob
 import json
 import os
-import random
+import queue
+import threading
 import time
 from typing import List, Optional
 
-import requests
-from websocket import WebSocketConnectionClosedException, WebSocketTimeoutException, create_connection
 from PySide6.QtCore import QObject, Signal
 from PySide6.QtGui import QImage
 
-import traceback
-from websocket import WebSocketConnectionClosedException, WebSocketTimeoutException, create_connection
+import requests
 
 import logging
 logger = logging.getLogger(__name__)
@@ -19,57 +16,123 @@ logger = logging.getLogger(__name__)
 from constant import DEBUG, DEBUG_FULL
 DEBUG_ImageGeneratorAPIWrapper = DEBUG
 from constant import (
-    WS_URL, HTTP_BASE_URL, BASE_DIR, COMFY_OUTPUT_FOLDER, INPUT_IMAGE_PATH, COMFY_WORKFLOW_DIR
+    HTTP_BASE_URL, BASE_DIR, COMFY_OUTPUT_FOLDER, INPUT_IMAGE_PATH,
+    COMFY_WS_CONNECT_TIMEOUT, COMFY_RETRIEVAL_MODE, COMFY_INPUT_MODE,
+    COMFY_UPLOAD_SUBFOLDER, COMFY_FAILOVER_GRACE, GENERATION_TIMEOUT
 )
 from prompts import dico_styles
-
-TOTAL_STEPS: dict[str, float] = {}
-TOTAL_STEPS_SUM: float = 0
-PROGRESS_ACCUM: dict[str, float] = {}
+from comfy_classes.comfy_session import ComfySession
+from comfy_classes.comfy_scheduler import ComfyScheduler, ComfyBackend, BackendUnavailableError
+from comfy_classes.workflow_registry import WorkflowRegistry, WorkflowTemplate
+from comfy_classes.generation_job import GenerationJob
+from comfy_classes.generation_deadline import (
+    Deadline, GenerationTimeoutError, STAGE_UPLOAD, STAGE_QUEUE, STAGE_RETRIEVAL
+)
+from comfy_classes.job_protocol import JobProtocol, InputUpload, fail_over, FINISHED, DISCONNECTED, RECONNECTED
 
 class ImageGeneratorAPIWrapper(QObject):
     progress_changed = Signal(float)
+    preview_ready = Signal(QImage)
 
-    def __init__(self, style: Optional[str] = None, qimg: Optional[QImage] = None) -> None:
+    def __init__(self, style: Optional[str] = None, qimg: Optional[QImage] = None, session: Optional[ComfySession] = None, scheduler: Optional[ComfyScheduler] = None) -> None:
         """
         Initialize the ImageGeneratorAPIWrapper with an optional style and input QImage.
+        Generations go through the shared ComfyScheduler unless a session pins one server.
         """
         super().__init__()
         if DEBUG_ImageGeneratorAPIWrapper:
             logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Initializing with style={style}")
-        self.server_url = HTTP_BASE_URL
+        self._scheduler = None if session is not None else (scheduler or ComfyScheduler.get_instance())
+        self._session = session or self._scheduler.backends[0].session
+        self.server_url = self._session.http_base_url
+        self._job: Optional[GenerationJob] = None
+        self._deadline: Optional[Deadline] = None
+        self._cancelled = threading.Event()
+        self._retrieval_mode = COMFY_RETRIEVAL_MODE
+        self._input_mode = COMFY_INPUT_MODE
+        self._input = InputUpload()
         self._styles_prompts = dico_styles
         self._output_folder = COMFY_OUTPUT_FOLDER
-        self._workflow_dir = COMFY_WORKFLOW_DIR
         self._style = style if style in self._styles_prompts else next(iter(self._styles_prompts))
 
-        path = self.find_json_by_name(self._workflow_dir, self._style)
-        with open(path, encoding='utf-8') as f:
-            self._base_prompt = json.load(f)
-
-        global TOTAL_STEPS, TOTAL_STEPS_SUM
-        TOTAL_STEPS = {
-            nid: node['inputs']['steps']
-            for nid, node in self._base_prompt.items()
-            if isinstance(node.get('inputs', {}).get('steps'), (int, float))
-        }
-        TOTAL_STEPS_SUM = sum(TOTAL_STEPS.values())
+        self._registry = WorkflowRegistry.get_instance()
+        self._template = self._registry.get(self._style)
+        self._quality_tier = 0
 
         self._negative_prompt = 'watermark, text'
         if qimg is not None:
             self.set_img(qimg)
         if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Initialized. Total steps sum = {TOTAL_STEPS_SUM}")
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Initialized. Total steps sum = {self._template.total_steps_sum}")
             
     def set_img(self, qimg: QImage) -> None:
         """
-        Set the input image for the workflow by saving the provided QImage.
+        Set the input image for the workflow. In upload mode the image is kept in
+        memory and sent by generate_image(); in disk mode it is saved to INPUT_IMAGE_PATH.
         """
         if DEBUG_ImageGeneratorAPIWrapper:
             logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Setting input image.")
-        self.save_qimage(os.path.dirname(INPUT_IMAGE_PATH), qimg)
+        if qimg is None or qimg.isNull():
+            raise ValueError("QImage is empty, cannot use it as input.")
+        if self._input.image is qimg:
+            return
+        self._input.set_image(qimg)
+        if self._input_mode == 'disk':
+            self.save_qimage(os.path.dirname(INPUT_IMAGE_PATH), qimg)
+        if DEBUG_ImageGeneratorAPIWrapper:
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Input image set ({self._input_mode} mode).")
+
+    @property
+    def job(self) -> Optional[GenerationJob]:
+        """
+        Return the job of the last generate_image() call.
+        """
+        return self._job
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        True once cancel() has been called.
+        """
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """
+        Cancel the generation: the prompt is removed from the server queue or
+        interrupted, and generate_image() returns without a result.
+        """
+        if DEBUG_ImageGeneratorAPIWrapper:
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Cancelling generation.")
+        self._cancelled.set()
+        job = self._job
+        if job is not None and job.prompt_id is not None:
+            self._session.cancel_prompt(job.prompt_id)
+
+    def is_executing(self) -> bool:
+        """
+        True while the server is running the prompt of the current job.
+        """
+        job = self._job
+        return job is not None and job.prompt_id is not None and self._session.is_executing(job.prompt_id)
+
+    def upload_input(self, job: GenerationJob) -> str:
+        """
+        Upload the input image under its slot name on the server and return that
+        name. The name is reused by later jobs on the same image and server, this
+        wrapper's or another one's (see InputUpload).
+        """
+        if self._input.image is None:
+            raise ValueError("No input image set, call set_img() first.")
+        name = self._input.name_on(self._session)
+        if name is not None:
+            return name
+        data, filename, mime = self._input.encode(self._session)
+        limit = self._deadline.cap() if self._deadline else None
+        name = self._session.upload_image(data, filename, COMFY_UPLOAD_SUBFOLDER, mime, timeout=limit)
+        self._input.uploaded(self._session, name)
         if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Input image set at {INPUT_IMAGE_PATH}")
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Input uploaded as {name} ({len(data)} bytes)")
+        return name
 
     def set_style(self, style: str) -> None:
         """
@@ -80,94 +143,36 @@ class ImageGeneratorAPIWrapper(QObject):
         if style not in self._styles_prompts:
             raise ValueError(f"Style '{style}' not found.")
         self._style = style
-        path = self.find_json_by_name(self._workflow_dir, self._style)
-        with open(path, encoding='utf-8') as f:
-            self._base_prompt = json.load(f)
-
-        global TOTAL_STEPS, TOTAL_STEPS_SUM
-        TOTAL_STEPS = {
-            nid: node['inputs']['steps']
-            for nid, node in self._base_prompt.items()
-            if isinstance(node.get('inputs', {}).get('steps'), (int, float))
-        }
-        TOTAL_STEPS_SUM = sum(TOTAL_STEPS.values())
+        self._template = self._registry.get(self._style)
         if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Style set to {style}. Total steps = {TOTAL_STEPS_SUM}")
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Style set to {style}. Total steps = {self._template.total_steps_sum}")
         
         if DEBUG_ImageGeneratorAPIWrapper:
             logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Workflow reloaded for style {style}.")
 
-    @staticmethod
-    def find_json_by_name(directory: str, name: str) -> str:
+    def set_template(self, template: WorkflowTemplate) -> None:
         """
-        Find and return the path to the workflow JSON file by style name.
+        Run another workflow than the style's one (the deferred upscale stage).
         """
         if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Searching for JSON file for style '{name}' in {directory}")
-        target = f"{name}.json"
-        default = "default.json"
-        found_default = None
-        for fname in os.listdir(directory):
-            if fname.endswith('.json'):
-                if fname == target:
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Found JSON: {fname}")
-                    return os.path.join(directory, fname)
-                if fname == default:
-                    found_default = os.path.join(directory, fname)
-        if found_default:
-            if DEBUG_ImageGeneratorAPIWrapper:
-                logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Using default JSON: {found_default}")
-            return found_default
-        if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] No JSON found for style '{name}', raising FileNotFoundError")
-        raise FileNotFoundError(f"No JSON found for {name}")
-    
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Setting workflow to {template.name}.")
+        self._template = template
 
-    def _clear_output_folder(self) -> None:
+    def set_quality_tier(self, tier: int) -> None:
         """
-        Remove existing PNG files in the output folder.
+        Generate at a reduced quality tier (see WorkflowRegistry.quality_tier()).
         """
         if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Clearing output folder: {self._output_folder}")
-        for fpath in glob.glob(os.path.join(self._output_folder, '*.png')):
-            try:
-                os.remove(fpath)
-            except OSError:
-                pass
-        if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Output folder cleared.")
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Setting quality tier to {tier}.")
+        self._quality_tier = tier
 
-    def _prepare_prompt(self, custom_prompt: Optional[dict]) -> dict:
+    def _prepare_prompt(self, job: GenerationJob) -> dict:
         """
-        Prepare the full prompt dictionary with all required inputs set.
+        Prepare the full prompt dictionary of a job with all required inputs set.
         """
         if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Preparing prompt with custom_prompt={custom_prompt}")
-        prompt = json.loads(json.dumps(custom_prompt or self._base_prompt))
-        for nid, node in prompt.items():
-            ctype = node.get('class_type', '')
-            inputs = node.setdefault('inputs', {})
-            if DEBUG_ImageGeneratorAPIWrapper:
-                logger.info(f"[DEBUG][DEBUG_ImageGeneratorAPIWrapper] Treatment node {nid} ({ctype})")
-                
-            if ctype.lower().replace(' ', '') in ('textmultiline', 'textmultilinewidget', 'textmultilineprompt') or ctype in ('Text Multiline', 'TextMultiLine'):
-                if DEBUG_ImageGeneratorAPIWrapper:
-                    logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Remplacement inputs['text'] pour node {nid} (Text Multiline)")
-
-                inputs['text'] = self._styles_prompts[self._style]
-            elif ctype in ('KSampler', 'KSampler (Efficient)'):
-                inputs['seed'] = random.randint(0, 2**32 - 1)
-                
-                if 'preview_method' in inputs:
-                    old_preview = inputs['preview_method']
-                    inputs['preview_method'] = 'auto'
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Changed preview_method for node {nid} from {old_preview} to 'auto'")
-            elif ctype == 'LoadImage':
-                inputs['image'] = INPUT_IMAGE_PATH
-            elif ctype == 'SaveImage':
-                inputs['filename_prefix'] = 'output'
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Preparing prompt for job {job.job_id} ({job.template.name})")
+        prompt = job.build_prompt(self._styles_prompts[job.style], websocket_output=self._retrieval_mode == 'websocket')
         if DEBUG_ImageGeneratorAPIWrapper:
             logger.info("[DEBUG_ImageGeneratorAPIWrapper] Prompt sent:")
             logger.info(json.dumps(prompt, indent=2, ensure_ascii=False))
@@ -176,155 +181,157 @@ class ImageGeneratorAPIWrapper(QObject):
         return prompt
 
 
-    def generate_image(self, custom_prompt: Optional[dict] = None, timeout: int = 30000) -> None:
+    def generate_image(self, custom_prompt: Optional[dict] = None, timeout: Optional[int] = None, front: bool = False, seed: Optional[int] = None, draft: float = 0.0) -> None:
         """
         Generate an image synchronously, blocking until completion.
+        timeout (ms, default GENERATION_TIMEOUT) bounds the whole job, result
+        retrieval included; when it is missed or the prompt stalls, the prompt
+        is cancelled on the server and GenerationTimeoutError is raised.
+        With front=True the prompt is queued ahead of pending ones (interactive jobs).
+        A given seed makes the result reproducible (see ResultCache).
+        A draft ratio generates the quick draft of the style (see WorkflowRegistry.sized()).
+        With a scheduler the job is retried on another backend if its server drops.
         """
         if DEBUG_ImageGeneratorAPIWrapper:
             logger.info(f"[DEBUG] Starting image generation…")
-        self._clear_output_folder()
-        prompt = self._prepare_prompt(custom_prompt)
-
-
-        ws = create_connection(WS_URL, timeout=None)
-        ws.settimeout(None)
-
-
-        import threading
-        def _keep_alive():
-            while True:
-                try:
-                    ws.ping()
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info("[DEBUG][KEEPALIVE] ping sent successfully.")
-                except Exception as e:
-                    logger.info(f"[DEBUG][KEEPALIVE] Exception ping: {e!r}")
-                    break
-                time.sleep(15)
-        threading.Thread(target=_keep_alive, daemon=True).start()
-
+        if custom_prompt:
+            template, divisor = WorkflowTemplate('custom', custom_prompt), None
+        else:
+            template, divisor = self._registry.sized(self._template, self._input.image.height() if self._input.image else 0, draft, self._quality_tier)
+        job = GenerationJob(self._style, template, seed, divisor)
+        self._job = job
+        self._deadline = Deadline(timeout / 1000 if timeout else GENERATION_TIMEOUT)
+        if self.cancelled:
+            return
+        if self._scheduler is None:
+            self._run_job(job, self._session, front)
+            return
+        tried = []
+        while not self.cancelled:
+            backend = self._scheduler.acquire(exclude=tried, prefer=self._preferred_backend())
+            try:
+                self._run_job(job, backend.session, front)
+                return
+            except GenerationTimeoutError as e:
+                if e.backend_at_fault:
+                    self._scheduler.mark_failed(backend, e)
+                raise
+            except BackendUnavailableError as e:
+                if self.cancelled:
+                    return
+                fail_over(self._scheduler, backend, backend.name, job, e, tried, 'ImageGeneratorAPIWrapper')
+            finally:
+                self._scheduler.release(backend)
+
+    def _preferred_backend(self) -> Optional[ComfyBackend]:
+        """
+        Return the backend the input image was already uploaded to (see InputUpload.preferred()).
+        """
+        if self._input_mode != 'upload':
+            return None
+        index = self._input.preferred([b.session for b in self._scheduler.backends])
+        return None if index is None else self._scheduler.backends[index]
 
-        welcome = ws.recv()
+    def _run_job(self, job: GenerationJob, session: ComfySession, front: bool = False) -> None:
+        """
+        Run a job on one server until it finishes, its events handled by a JobProtocol.
+        Raises BackendUnavailableError if the server cannot take or finish it,
+        GenerationTimeoutError if the job misses its deadline or stalls.
+        """
+        deadline = self._deadline or Deadline(GENERATION_TIMEOUT)
+        self._session = session
+        self.server_url = session.http_base_url
+        job.backend = session.http_base_url
+        job.set_stage(STAGE_UPLOAD)
+        if not session.wait_connected(deadline.cap(COMFY_WS_CONNECT_TIMEOUT)):
+            deadline.check(job.stage)
+            raise BackendUnavailableError(f"ComfyUI websocket not connected ({session.ws_url})")
         try:
-            welcome_data = json.loads(welcome)
-        except Exception:
-            welcome_data = {}
-        client_id = welcome_data.get('data', {}).get('sid') or welcome_data.get('data', {}).get('client_id')
+            if self._input_mode == 'upload' and self._input.image is not None:
+                job.input_name = self.upload_input(job)
+            prompt = self._prepare_prompt(job)
+            job.set_stage(STAGE_QUEUE)
+            deadline.check(job.stage)
+            prompt_id = session.queue_prompt(prompt, front=front, timeout=deadline.cap())
+        except (requests.ConnectionError, requests.Timeout) as e:
+            deadline.check(job.stage)
+            raise BackendUnavailableError(f"ComfyUI at {session.http_base_url} unreachable: {e}") from e
+        protocol = JobProtocol(job, prompt, self)
+        job.prompt_id = prompt_id
+        job.progress_model.on_queued(min(session.queue_remaining, 1) if front else session.queue_remaining)
+        if self.cancelled:
+            session.cancel_prompt(prompt_id)
         if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG] Received welcome, client_id={client_id!r}")
-
+            logger.info(f"[DEBUG] Prompt sent via HTTP, prompt_id={prompt_id!r}")
 
-        payload = {'client_id': client_id, 'prompt': prompt, 'outputs': [['8', 0]], 'force': True}
-        resp = requests.post(f"{self.server_url}/prompt", json=payload)
-        resp.raise_for_status()
-        if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info("[DEBUG] Prompt sent via HTTP.")
-
-
-        MAX_LOG_LEN = 500
         try:
             while True:
-                if DEBUG_ImageGeneratorAPIWrapper:
-                    logger.info(f"[DEBUG] Before ws.recv() — connected={ws.connected}")
-                try:
-                    msg = ws.recv()
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG] After ws.recv() — connected={ws.connected}, raw type: {type(msg).__name__}")
-                except WebSocketTimeoutException:
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info("[DEBUG] WebSocketTimeoutException: no message, we continue.")
-                    continue
-                except WebSocketConnectionClosedException as e:
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG] WebSocketConnectionClosedException: {e!r}")
-                        traceback.logger.info_exc()
-                    break
-                except Exception as e:
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG] Unexpected exception on ws.recv(): {type(e).__name__}: {e!r}")
-                        traceback.logger.info_exc()
-                    traceback.logger.info_exc()
-                    break
-
-
-                if isinstance(msg, (bytes, bytearray)):
-                    continue
-                
-                if len(msg) > MAX_LOG_LEN:
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        snippet = msg[:MAX_LOG_LEN].replace('\n', '\\n')
-                        logger.info(f"[DEBUG] msg too long, snippet:\n{snippet}…")
-                else:
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG] Message text received ({len(msg)} chars.)")
-
-
+                timeout, stalled = protocol.next_timeout(deadline)
                 try:
-                    data = json.loads(msg)
-                except json.JSONDecodeError:
-                    continue
-
-                t = data.get('type', '')
-                d = data.get('data', {})
-                node = d.get('node')
-
-                if t == 'progress' and node in TOTAL_STEPS:
-                    raw = d.get('value', 0)
-                    max_steps = TOTAL_STEPS[node]
-                    PROGRESS_ACCUM[node] = raw
-                    done = sum(PROGRESS_ACCUM.values())
-                    pct = done / TOTAL_STEPS_SUM * 100 if TOTAL_STEPS_SUM else 0
-                    self.progress_changed.emit(pct)
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG][PROG] {pct:.2f}% — node {node}: {raw}/{max_steps}")
-                elif t == 'progress':
-
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG] Ignored progress for unknown node {node!r}")
-                    continue
-
-                elif t.lower() in ('done', 'execution_success', 'execution_complete', 'execution_end'):
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG][EVENT] GGeneration terminated (type={t})")
+                    event = session.get_event(prompt_id, timeout=timeout)
+                except queue.Empty:
+                    error = deadline.error(job.stage, stalled=stalled)
+                    self._abandon(session, prompt_id)
+                    logger.info(f"[ImageGeneratorAPIWrapper] Job {job.job_id} on {session.http_base_url}: {error}")
+                    raise error
+                action = protocol.handle(event)
+                if action == FINISHED:
                     break
+                if action == DISCONNECTED and not session.wait_connected(deadline.cap(COMFY_FAILOVER_GRACE)):
+                    deadline.check(job.stage)
+                    raise BackendUnavailableError(f"ComfyUI at {session.http_base_url} dropped during the job")
+                if action == RECONNECTED:
+                    state = self._prompt_state(protocol, session)
+                    if state == 'done':
+                        break
+                    if state == 'lost':
+                        raise BackendUnavailableError(f"ComfyUI at {session.http_base_url} lost prompt {prompt_id}")
+        finally:
+            session.release(prompt_id)
+        protocol.finish('ImageGeneratorAPIWrapper')
 
-                elif t == 'execution_error':
-                    self.progress_changed.emit(100.0)
-                    if DEBUG_ImageGeneratorAPIWrapper:
-                        logger.info(f"[DEBUG] Failed to generate image: Face not detected")
-                    break
+    @staticmethod
+    def _abandon(session: ComfySession, prompt_id: str) -> None:
+        """
+        Cancel a timed-out prompt on the server without waiting for it to answer.
+        """
+        threading.Thread(
+            target=session.cancel_prompt, args=(prompt_id,),
+            name="ImageGeneratorAPIWrapper-cancel", daemon=True
+        ).start()
 
-        finally:
-            code = getattr(getattr(ws, 'sock', None), 'close_code', None)
-            reason = getattr(getattr(ws, 'sock', None), 'close_reason', None)
-            if DEBUG_ImageGeneratorAPIWrapper:
-                logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Before closing ws — connected={ws.connected}, close_code={code}, close_reason={reason!r}")
-            ws.close()
+    def _prompt_state(self, protocol: JobProtocol, session: ComfySession) -> str:
+        """
+        Ask a server what became of a job's prompt after a reconnect:
+        'done' (outputs recorded from /history), 'queued', 'lost' or 'unknown'.
+        """
+        try:
+            if protocol.record_history(session.get(f"/history/{protocol.job.prompt_id}").json()):
+                return 'done'
+            info = session.get('/queue').json()
+        except Exception as e:
             if DEBUG_ImageGeneratorAPIWrapper:
-                logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] After ws.close() — connected={ws.connected}")
-
+                logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Prompt state lookup failed: {e!r}")
+            return 'unknown'
+        return 'queued' if protocol.is_queued(info) else 'lost'
 
     def get_progress_percentage(self) -> float:
         """
-        Get the current global progress percentage.
+        Get the progress percentage of the current job.
         """
         if DEBUG_ImageGeneratorAPIWrapper:
             logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Getting progress percentage.")
-        done = sum(PROGRESS_ACCUM.values())
-        if DEBUG_ImageGeneratorAPIWrapper:
-            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Progress done: {done}, Total steps sum: {TOTAL_STEPS_SUM}")
-        return (done / TOTAL_STEPS_SUM * 100) if TOTAL_STEPS_SUM else 0.0
+        return self._job.progress_percentage() if self._job else 0.0
 
     def get_image_paths(self) -> List[str]:
         """
-        Get a sorted list of generated image file paths.
+        Get a sorted list of the image file paths written by the current job.
         """
         if DEBUG_ImageGeneratorAPIWrapper:
             logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Getting image paths from output folder: {self._output_folder}")
-        return sorted(
-            glob.glob(os.path.join(self._output_folder, '*.png')),
-            key=os.path.getmtime
-        )
+        if self._job is None:
+            return []
+        return self._job.output_paths(self._output_folder)
 
     def save_qimage(self, directory: str, image: QImage) -> None:
         """
@@ -373,13 +380,56 @@ class ImageGeneratorAPIWrapper(QObject):
             logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Timeout reached, no image file found.")
         raise TimeoutError("Failed to load image within timeout period.")
     
+    def load_result_image(self, timeout: float = 10.0) -> QImage:
+        """
+        Return the generated image decoded in memory, falling back to the output
+        folder in disk mode or when that folder is local. Otherwise a failed
+        fetch raises BackendUnavailableError at once instead of polling a
+        folder ComfyUI does not write to.
+        A workflow without SaveImage (the preprocess stage) gives a null image.
+        """
+        job = self._job
+        if job is None:
+            raise RuntimeError("No generation has been run, call generate_image() first.")
+        if not job.template.save_images:
+            return QImage()
+        deadline = self._deadline
+        job.set_stage(STAGE_RETRIEVAL)
+        if deadline is not None:
+            timeout = deadline.cap(timeout)
+        if job.result_bytes:
+            qimg = QImage.fromData(job.result_bytes)
+            if not qimg.isNull():
+                if DEBUG_ImageGeneratorAPIWrapper:
+                    logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Image decoded from websocket frame.")
+                return qimg
+        for info in reversed(job.result_images):
+            try:
+                if deadline is not None:
+                    deadline.check(job.stage)
+                data = self._session.fetch_view(info.get('filename', ''), info.get('subfolder', ''), info.get('type', 'output'), timeout=timeout)
+            except Exception as e:
+                if DEBUG_ImageGeneratorAPIWrapper:
+                    logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] /view fetch failed for {info}: {e!r}")
+                continue
+            qimg = QImage.fromData(data)
+            if not qimg.isNull():
+                if DEBUG_ImageGeneratorAPIWrapper:
+                    logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Image fetched from /view: {info.get('filename')}")
+                return qimg
+        if self._retrieval_mode != 'disk' and not os.path.isdir(self._output_folder):
+            raise BackendUnavailableError(f"No result could be fetched from ComfyUI at {self._session.http_base_url}")
+        if DEBUG_ImageGeneratorAPIWrapper:
+            logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] No in-memory result, falling back to output folder.")
+        return self.wait_for_and_load_image(timeout=timeout)
+
     def delete_input_and_output_images(self) -> None:
         """
-        Delete the input image and all output images from disk.
+        Delete the input image and the output images of the current job from disk.
         """
         if DEBUG_ImageGeneratorAPIWrapper:
             logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Deleting input and output images.")
-        if os.path.exists(INPUT_IMAGE_PATH):
+        if self._input_mode == 'disk' and os.path.exists(INPUT_IMAGE_PATH):
             try:
                 os.remove(INPUT_IMAGE_PATH)
                 if DEBUG_ImageGeneratorAPIWrapper:
@@ -388,22 +438,15 @@ class ImageGeneratorAPIWrapper(QObject):
                 if DEBUG_ImageGeneratorAPIWrapper:
                     logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Failed to delete input image: {e}")
 
-    
-        for fpath in glob.glob(os.path.join(self._output_folder, '*.png')):
-            try:
-                os.remove(fpath)
-                if DEBUG_ImageGeneratorAPIWrapper:
-                    logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Deleted output image: {fpath}")
-            except OSError as e:
-                if DEBUG_ImageGeneratorAPIWrapper:
-                    logger.info(f"[DEBUG_ImageGeneratorAPIWrapper] Failed to delete output image {fpath}: {e}")
+        if self._job is not None:
+            self._job.clear_outputs(self._output_folder)
 
 
 
 if __name__ == '__main__':
     wrapper = ImageGeneratorAPIWrapper(style='oil paint')
     wrapper.generate_image()
-    img = wrapper.wait_for_and_load_image()
+    img = wrapper.load_result_image()
     wrapper.delete_input_and_output_images()
 
     logger.info(f"Loaded QImage: {img.isNull() and 'Failed' or 'Success'}")
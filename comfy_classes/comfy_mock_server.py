@@ -0,0 +1,472 @@
+"""
+Local stand-in for a ComfyUI server, for offline end-to-end benchmarking.
+
+Speaks the subset of the ComfyUI protocol the booth uses (/ws, /prompt,
+/upload/image, /view, /queue, /interrupt, /history, /system_stats, /free)
+and executes prompts by walking their node graph with configurable latency
+and failure injection. Output images are synthesized with Pillow.
+
+    python -m comfy_classes.comfy_mock_server --port 8189 --step-latency 0.05 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import random
+import struct
+import time
+import uuid
+from collections import deque
+from typing import Optional
+
+from aiohttp import web
+from PIL import Image, ImageDraw
+
+import logging
+logger = logging.getLogger(__name__)
+
+OUTPUT_NODE_TYPES = ('SaveImage', 'PreviewImage', 'SaveImageWebsocket')
+BINARY_PREVIEW_IMAGE = 1
+PNG_FORMAT = 2
+
+
+class MockConfig:
+    """
+    Latency and failure injection settings of the mock server.
+    """
+
+    def __init__(self, node_latency: float = 0.01, step_latency: float = 0.05,
+                 class_latency: Optional[dict] = None, error_rate: float = 0.0,
+                 hang_rate: float = 0.0, http_error_rate: float = 0.0,
+                 disconnect_rate: float = 0.0, image_size: tuple = (1024, 1024),
+                 previews: bool = True, seed: Optional[int] = None) -> None:
+        """
+        Store the settings; rates are probabilities per prompt.
+        """
+        self.node_latency = node_latency
+        self.step_latency = step_latency
+        self.class_latency = dict(class_latency or {})
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.http_error_rate = http_error_rate
+        self.disconnect_rate = disconnect_rate
+        self.image_size = image_size
+        self.previews = previews
+        self.rng = random.Random(seed)
+
+
+def execution_order(prompt: dict) -> list:
+    """
+    Return the ids of the nodes an output depends on, dependencies first,
+    like ComfyUI which never runs nodes that no output needs.
+    """
+    order, seen = [], set()
+
+    def visit(nid: str) -> None:
+        if nid in seen or nid not in prompt:
+            return
+        seen.add(nid)
+        for value in prompt[nid].get('inputs', {}).values():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                visit(value[0])
+        order.append(nid)
+
+    for nid, node in prompt.items():
+        if node.get('class_type') in OUTPUT_NODE_TYPES:
+            visit(nid)
+    return order
+
+
+def node_signature(prompt: dict, nid: str, memo: dict) -> str:
+    """
+    Return a hash of a node's class, inputs and upstream signatures,
+    used to emulate ComfyUI's execution cache.
+    """
+    if nid in memo:
+        return memo[nid]
+    node = prompt[nid]
+    parts = [node.get('class_type', '')]
+    for key, value in sorted(node.get('inputs', {}).items()):
+        if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and value[0] in prompt:
+            parts.append(f"{key}={node_signature(prompt, value[0], memo)}:{value[1]}")
+        else:
+            parts.append(f"{key}={json.dumps(value, sort_keys=True)}")
+    memo[nid] = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+    return memo[nid]
+
+
+def synth_image(size: tuple, key: str, fmt: str = 'PNG') -> bytes:
+    """
+    Draw a deterministic image for a key and return it encoded.
+    """
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    img = Image.new('RGB', size, tuple(digest[:3]))
+    draw = ImageDraw.Draw(img)
+    w, h = size
+    draw.ellipse((w // 4, h // 6, 3 * w // 4, 5 * h // 6), fill=tuple(digest[3:6]))
+    buf = io.BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
+
+
+class MockComfyServer:
+    """
+    Single-worker prompt executor behind an aiohttp application.
+    """
+
+    def __init__(self, config: Optional[MockConfig] = None) -> None:
+        """
+        Create the server state; call app() to get the aiohttp application.
+        """
+        self.config = config or MockConfig()
+        self.clients: dict[str, web.WebSocketResponse] = {}
+        self.pending: deque = deque()
+        self.running: Optional[dict] = None
+        self.history: dict[str, dict] = {}
+        self.files: dict[tuple, bytes] = {}
+        self.cache: set = set()
+        self.counter = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._interrupt = False
+        self.stats = {'prompts': 0, 'errors': 0, 'hangs': 0, 'disconnects': 0, 'cached_nodes': 0, 'executed_nodes': 0}
+
+    def app(self) -> web.Application:
+        """
+        Return the aiohttp application serving the ComfyUI routes.
+        """
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.get('/ws', self.handle_ws),
+            web.post('/prompt', self.handle_prompt),
+            web.post('/upload/image', self.handle_upload),
+            web.get('/view', self.handle_view),
+            web.get('/queue', self.handle_get_queue),
+            web.post('/queue', self.handle_post_queue),
+            web.post('/interrupt', self.handle_interrupt),
+            web.get('/history/{prompt_id}', self.handle_history),
+            web.get('/system_stats', self.handle_system_stats),
+            web.post('/free', self.handle_free),
+        ])
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    async def _on_startup(self, app: web.Application) -> None:
+        """
+        Start the prompt worker.
+        """
+        self._wake = asyncio.Event()
+        self._worker = asyncio.create_task(self._work())
+
+    async def _on_shutdown(self, app: web.Application) -> None:
+        """
+        Stop the worker and close the websockets.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+        for ws in list(self.clients.values()):
+            await ws.close()
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        """
+        Accept a websocket and greet it with a status carrying its sid.
+        """
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        sid = request.query.get('clientId') or uuid.uuid4().hex
+        self.clients[sid] = ws
+        await ws.send_str(json.dumps({'type': 'status', 'data': {'status': self._status(), 'sid': sid}}))
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            if self.clients.get(sid) is ws:
+                del self.clients[sid]
+        return ws
+
+    async def handle_prompt(self, request: web.Request) -> web.Response:
+        """
+        Queue a prompt, or fail it with HTTP 500 at http_error_rate.
+        """
+        body = await request.json()
+        if self.config.rng.random() < self.config.http_error_rate:
+            return web.json_response({'error': 'injected failure'}, status=500)
+        prompt = body.get('prompt') or {}
+        if not execution_order(prompt):
+            return web.json_response({'error': {'type': 'prompt_no_outputs'}, 'node_errors': {}}, status=400)
+        self.counter += 1
+        entry = {
+            'prompt_id': body.get('prompt_id') or str(uuid.uuid4()), 'number': self.counter,
+            'prompt': prompt, 'client_id': body.get('client_id'),
+        }
+        if body.get('front'):
+            self.pending.appendleft(entry)
+        else:
+            self.pending.append(entry)
+        self.stats['prompts'] += 1
+        self._wake.set()
+        await self._broadcast_status()
+        return web.json_response({'prompt_id': entry['prompt_id'], 'number': entry['number'], 'node_errors': {}})
+
+    async def handle_upload(self, request: web.Request) -> web.Response:
+        """
+        Store an uploaded input image.
+        """
+        form = await request.post()
+        field = form['image']
+        subfolder = form.get('subfolder', '')
+        self.files[('input', subfolder, field.filename)] = field.file.read()
+        return web.json_response({'name': field.filename, 'subfolder': subfolder, 'type': 'input'})
+
+    async def handle_view(self, request: web.Request) -> web.Response:
+        """
+        Serve a stored image.
+        """
+        q = request.query
+        data = self.files.get((q.get('type', 'output'), q.get('subfolder', ''), q.get('filename', '')))
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data, content_type='image/png')
+
+    async def handle_get_queue(self, request: web.Request) -> web.Response:
+        """
+        List the running and pending prompts like ComfyUI.
+        """
+        def row(e: dict) -> list:
+            return [e['number'], e['prompt_id'], e['prompt'], {'client_id': e['client_id']}, []]
+        return web.json_response({
+            'queue_running': [row(self.running)] if self.running else [],
+            'queue_pending': [row(e) for e in self.pending],
+        })
+
+    async def handle_post_queue(self, request: web.Request) -> web.Response:
+        """
+        Delete pending prompts, or clear the queue.
+        """
+        body = await request.json()
+        if body.get('clear'):
+            self.pending.clear()
+        ids = set(body.get('delete') or [])
+        if ids:
+            self.pending = deque(e for e in self.pending if e['prompt_id'] not in ids)
+        await self._broadcast_status()
+        return web.json_response({})
+
+    async def handle_interrupt(self, request: web.Request) -> web.Response:
+        """
+        Interrupt the running prompt (only the given one, if a prompt_id is sent).
+        """
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        target = body.get('prompt_id')
+        if self.running and (target is None or target == self.running['prompt_id']):
+            self._interrupt = True
+        return web.json_response({})
+
+    async def handle_history(self, request: web.Request) -> web.Response:
+        """
+        Return the outputs of a finished prompt.
+        """
+        pid = request.match_info['prompt_id']
+        return web.json_response({pid: self.history[pid]} if pid in self.history else {})
+
+    async def handle_system_stats(self, request: web.Request) -> web.Response:
+        """
+        Report a fake GPU whose VRAM use grows with the cached loaders.
+        """
+        total = 8 * 1024 ** 3
+        used = min(total, 512 * 1024 ** 2 * (1 + len(self.cache) // 8))
+        return web.json_response({
+            'system': {'os': 'mock', 'comfyui_version': 'mock'},
+            'devices': [{'name': 'mock', 'type': 'cuda', 'index': 0, 'vram_total': total,
+                         'vram_free': total - used, 'torch_vram_total': total, 'torch_vram_free': total - used}],
+        })
+
+    async def handle_free(self, request: web.Request) -> web.Response:
+        """
+        Forget the execution cache, like unloading the models.
+        """
+        self.cache.clear()
+        return web.json_response({})
+
+    def _status(self) -> dict:
+        """
+        Return the status block broadcast to the clients.
+        """
+        remaining = len(self.pending) + (1 if self.running else 0)
+        return {'exec_info': {'queue_remaining': remaining}}
+
+    async def _broadcast_status(self) -> None:
+        """
+        Send the queue depth to every client.
+        """
+        for ws in list(self.clients.values()):
+            await self._send(ws, {'type': 'status', 'data': {'status': self._status()}})
+
+    @staticmethod
+    async def _send(ws: Optional[web.WebSocketResponse], msg, binary: bool = False) -> None:
+        """
+        Send a message to a client, ignoring closed sockets.
+        """
+        if ws is None or ws.closed:
+            return
+        try:
+            if binary:
+                await ws.send_bytes(msg)
+            else:
+                await ws.send_str(json.dumps(msg))
+        except (ConnectionError, RuntimeError):
+            pass
+
+    async def _work(self) -> None:
+        """
+        Run the queued prompts one at a time.
+        """
+        while True:
+            if not self.pending:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            self.running = self.pending.popleft()
+            self._interrupt = False
+            try:
+                await self._execute(self.running)
+            except Exception as e:
+                logger.info(f"[MockComfyServer] Prompt {self.running['prompt_id']} crashed: {e!r}")
+            self.running = None
+            await self._broadcast_status()
+
+    async def _execute(self, entry: dict) -> None:
+        """
+        Walk the node graph of a prompt, emitting ComfyUI's websocket events.
+        """
+        cfg = self.config
+        pid, prompt = entry['prompt_id'], entry['prompt']
+        ws = self.clients.get(entry['client_id'])
+        order = execution_order(prompt)
+        memo: dict = {}
+        cached = [nid for nid in order if node_signature(prompt, nid, memo) in self.cache
+                  and prompt[nid].get('class_type') not in OUTPUT_NODE_TYPES]
+        fail_at = cfg.rng.randrange(len(order)) if cfg.rng.random() < cfg.error_rate else None
+        hang = cfg.rng.random() < cfg.hang_rate
+        disconnect = cfg.rng.random() < cfg.disconnect_rate
+        await self._send(ws, {'type': 'execution_start', 'data': {'prompt_id': pid, 'timestamp': int(time.time() * 1000)}})
+        await self._send(ws, {'type': 'execution_cached', 'data': {'nodes': cached, 'prompt_id': pid}})
+        self.stats['cached_nodes'] += len(cached)
+        if hang:
+            self.stats['hangs'] += 1
+            while not self._interrupt:
+                await asyncio.sleep(0.05)
+        outputs = {}
+        for index, nid in enumerate(order):
+            if self._interrupt:
+                await self._send(ws, {'type': 'execution_interrupted', 'data': {'prompt_id': pid, 'node_id': nid}})
+                return
+            if nid in cached:
+                continue
+            node = prompt[nid]
+            class_type = node.get('class_type', '')
+            await self._send(ws, {'type': 'executing', 'data': {'node': nid, 'display_node': nid, 'prompt_id': pid}})
+            await asyncio.sleep(cfg.class_latency.get(class_type, cfg.node_latency))
+            steps = node.get('inputs', {}).get('steps')
+            if isinstance(steps, int):
+                for step in range(1, steps + 1):
+                    if self._interrupt:
+                        break
+                    await asyncio.sleep(cfg.step_latency)
+                    await self._send(ws, {'type': 'progress', 'data': {'value': step, 'max': steps, 'prompt_id': pid, 'node': nid}})
+                    if cfg.previews and node['inputs'].get('preview_method', 'none') != 'none':
+                        preview = synth_image((64, 64), f"{pid}:{step}", 'JPEG')
+                        await self._send(ws, struct.pack('>II', BINARY_PREVIEW_IMAGE, 1) + preview, binary=True)
+            if disconnect and index == len(order) // 2 and ws is not None:
+                self.stats['disconnects'] += 1
+                await ws.close()
+            if index == fail_at:
+                self.stats['errors'] += 1
+                await self._send(ws, {'type': 'execution_error', 'data': {
+                    'prompt_id': pid, 'node_id': nid, 'node_type': class_type,
+                    'exception_message': 'injected failure', 'exception_type': 'RuntimeError', 'traceback': [],
+                }})
+                return
+            self.cache.add(node_signature(prompt, nid, memo))
+            self.stats['executed_nodes'] += 1
+            if class_type in OUTPUT_NODE_TYPES:
+                outputs[nid] = await self._output(ws, pid, nid, node)
+        self.history[pid] = {'outputs': outputs, 'status': {'status_str': 'success', 'completed': True}}
+        await self._send(ws, {'type': 'executing', 'data': {'node': None, 'prompt_id': pid}})
+        await self._send(ws, {'type': 'execution_success', 'data': {'prompt_id': pid, 'timestamp': int(time.time() * 1000)}})
+
+    async def _output(self, ws: Optional[web.WebSocketResponse], pid: str, nid: str, node: dict) -> dict:
+        """
+        Synthesize the image of an output node and announce it.
+        """
+        class_type = node['class_type']
+        data = synth_image(self.config.image_size, f"{pid}:{nid}")
+        if class_type == 'SaveImageWebsocket':
+            await self._send(ws, struct.pack('>II', BINARY_PREVIEW_IMAGE, PNG_FORMAT) + data, binary=True)
+            return {}
+        folder = 'output' if class_type == 'SaveImage' else 'temp'
+        prefix = node.get('inputs', {}).get('filename_prefix', 'ComfyUI') if folder == 'output' else 'ComfyUI_temp'
+        filename = f"{prefix}_{self.counter:05d}_.png"
+        self.files[(folder, '', filename)] = data
+        images = [{'filename': filename, 'subfolder': '', 'type': folder}]
+        await self._send(ws, {'type': 'executed', 'data': {'node': nid, 'display_node': nid, 'output': {'images': images}, 'prompt_id': pid}})
+        return {'images': images}
+
+
+def parse_class_latency(values: list) -> dict:
+    """
+    Parse repeated CLASS=SECONDS options.
+    """
+    latency = {}
+    for item in values or []:
+        name, _, seconds = item.rpartition('=')
+        latency[name] = float(seconds)
+    return latency
+
+
+def build_parser(add_help: bool = True) -> argparse.ArgumentParser:
+    """
+    Return the command line options of the mock server
+    (reused by comfy_benchmark with add_help=False).
+    """
+    parser = argparse.ArgumentParser(description="Mock ComfyUI server for offline benchmarking.", add_help=add_help)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8189)
+    parser.add_argument('--node-latency', type=float, default=0.01, help="seconds per executed node")
+    parser.add_argument('--step-latency', type=float, default=0.05, help="seconds per sampler step")
+    parser.add_argument('--latency', action='append', metavar='CLASS=SECONDS', help="latency of one node class")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="probability of an execution_error")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="probability that a prompt never finishes")
+    parser.add_argument('--http-error-rate', type=float, default=0.0, help="probability that /prompt answers 500")
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help="probability of dropping the websocket mid-prompt")
+    parser.add_argument('--image-size', default='1024x1024', help="WIDTHxHEIGHT of the synthesized outputs")
+    parser.add_argument('--no-previews', action='store_true', help="do not send sampler previews")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the failure injection")
+    return parser
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    """
+    Build a MockConfig from parsed options.
+    """
+    width, _, height = args.image_size.partition('x')
+    return MockConfig(
+        node_latency=args.node_latency, step_latency=args.step_latency,
+        class_latency=parse_class_latency(args.latency), error_rate=args.error_rate,
+        hang_rate=args.hang_rate, http_error_rate=args.http_error_rate,
+        disconnect_rate=args.disconnect_rate, image_size=(int(width), int(height or width)),
+        previews=not args.no_previews, seed=args.seed,
+    )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    options = build_parser().parse_args()
+    server = MockComfyServer(config_from_args(options))
+    logger.info(f"[MockComfyServer] Listening on http://{options.host}:{options.port}")
+    web.run_app(server.app(), host=options.host, port=options.port, print=None)
@@ -0,0 +1,221 @@
+import threading
+import time
+from typing import Iterable, Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_ComfyScheduler = DEBUG
+DEBUG_ComfyScheduler_FULL = DEBUG_FULL
+from constant import COMFY_BACKENDS, COMFY_SCHEDULER_POLL_INTERVAL, COMFY_BACKEND_RETRY_DELAY
+from comfy_classes.comfy_session import ComfySession
+
+
+class BackendUnavailableError(ConnectionError):
+    """
+    Raised when a ComfyUI backend cannot take or finish a generation.
+    """
+
+
+class ComfyBackend:
+    """
+    One ComfyUI server known to the scheduler, with its load and health.
+    """
+
+    def __init__(self, session: ComfySession) -> None:
+        """
+        Wrap the shared session of a server.
+        """
+        self.session = session
+        self.queue_depth = 0
+        self.inflight = 0
+        self.failures = 0
+        self.down_until = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        """
+        Return the HTTP base URL identifying the backend.
+        """
+        return self.session.http_base_url
+
+    @property
+    def healthy(self) -> bool:
+        """
+        True if the websocket is up and the backend is not in its retry delay.
+        """
+        return self.session.connected and time.monotonic() >= self.down_until
+
+    @property
+    def load(self) -> int:
+        """
+        Return the number of prompts the backend still has to run.
+        Local dispatches count until the server reports them in its queue.
+        """
+        return max(self.queue_depth, self.inflight)
+
+    def on_status(self, data: dict) -> None:
+        """
+        Update the queue depth from a websocket 'status' event.
+        """
+        exec_info = (data.get('status') or {}).get('exec_info') or {}
+        if 'queue_remaining' in exec_info:
+            self.queue_depth = int(exec_info['queue_remaining'] or 0)
+
+    def poll(self) -> None:
+        """
+        Read the queue depth from /queue, recording the error if it does not answer.
+        """
+        try:
+            info = self.session.get('/queue').json()
+        except Exception as e:
+            self.last_error = repr(e)
+            return
+        self.queue_depth = len(info.get('queue_running', [])) + len(info.get('queue_pending', []))
+
+
+class ComfyScheduler:
+    """
+    Dispatches generations over every ComfyUI backend in COMFY_BACKENDS.
+    Each job goes to the least-loaded healthy backend; a backend that fails
+    is skipped for COMFY_BACKEND_RETRY_DELAY seconds.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "ComfyScheduler":
+        """
+        Return the shared scheduler, connecting to every configured backend on first use.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(COMFY_BACKENDS)
+                cls._instance.start()
+        return cls._instance
+
+    @classmethod
+    def close_instance(cls) -> None:
+        """
+        Stop the shared scheduler (called when the application quits).
+        """
+        with cls._instance_lock:
+            scheduler, cls._instance = cls._instance, None
+        if scheduler is not None:
+            scheduler.close()
+
+    def __init__(self, endpoints: Iterable[tuple], poll_interval: float = COMFY_SCHEDULER_POLL_INTERVAL) -> None:
+        """
+        Create one backend per (HTTP base URL, websocket URL) pair.
+        """
+        if DEBUG_ComfyScheduler:
+            logger.info(f"[DEBUG][ComfyScheduler] Entering __init__: endpoints={endpoints!r}")
+        self.backends: list[ComfyBackend] = []
+        for http_base_url, ws_url in endpoints:
+            backend = ComfyBackend(ComfySession.get_instance(http_base_url, ws_url))
+            backend.session.add_status_listener(backend.on_status)
+            self.backends.append(backend)
+        if not self.backends:
+            raise ValueError("ComfyScheduler needs at least one backend")
+        self._poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start polling the queue depth of every backend.
+        """
+        if self._monitor and self._monitor.is_alive():
+            return
+        self._stop.clear()
+        self._monitor = threading.Thread(target=self._monitor_loop, name="ComfyScheduler-monitor", daemon=True)
+        self._monitor.start()
+
+    def close(self) -> None:
+        """
+        Stop the monitor thread and detach from the backend sessions.
+        """
+        self._stop.set()
+        if self._monitor and self._monitor.is_alive():
+            self._monitor.join(timeout=2.0)
+        self._monitor = None
+        for backend in self.backends:
+            backend.session.remove_status_listener(backend.on_status)
+
+    def acquire(self, exclude: Iterable[ComfyBackend] = (), prefer: Optional[ComfyBackend] = None) -> ComfyBackend:
+        """
+        Reserve the least-loaded healthy backend for a job.
+        A preferred backend (the one holding the photo and its cached nodes) is
+        kept if healthy and at most one job busier than the least-loaded one.
+        When none is healthy, the least recently failed one is tried anyway.
+        Raises BackendUnavailableError when every backend is excluded.
+        """
+        excluded = set(exclude)
+        with self._lock:
+            candidates = [b for b in self.backends if b not in excluded]
+            if not candidates:
+                raise BackendUnavailableError("No ComfyUI backend available")
+            healthy = [b for b in candidates if b.healthy]
+            if healthy:
+                backend = min(healthy, key=lambda b: (b.load, self.backends.index(b)))
+                if prefer in healthy and prefer.load <= backend.load + 1:
+                    backend = prefer
+            else:
+                backend = min(candidates, key=lambda b: b.down_until)
+            backend.inflight += 1
+        if DEBUG_ComfyScheduler:
+            logger.info(f"[DEBUG][ComfyScheduler] Dispatching to {backend.name} (load={backend.load}, healthy={backend.healthy})")
+        return backend
+
+    def release(self, backend: ComfyBackend) -> None:
+        """
+        Give back a backend reserved with acquire().
+        """
+        with self._lock:
+            backend.inflight = max(0, backend.inflight - 1)
+
+    def mark_failed(self, backend: ComfyBackend, error: Exception) -> None:
+        """
+        Skip a backend for a while after it failed a job.
+        """
+        with self._lock:
+            backend.failures += 1
+            backend.last_error = repr(error)
+            backend.down_until = time.monotonic() + COMFY_BACKEND_RETRY_DELAY
+        logger.info(f"[ComfyScheduler] Backend {backend.name} failed: {error!r}")
+
+    def snapshot(self) -> list[dict]:
+        """
+        Return the state of every backend, for logging and diagnostics.
+        """
+        return [
+            {'name': b.name, 'healthy': b.healthy, 'load': b.load, 'inflight': b.inflight,
+             'queue_depth': b.queue_depth, 'failures': b.failures, 'last_error': b.last_error}
+            for b in self.backends
+        ]
+
+    def _monitor_loop(self) -> None:
+        """
+        Poll /queue on every backend until the scheduler is closed.
+        """
+        while not self._stop.wait(self._poll_interval):
+            for backend in self.backends:
+                backend.poll()
+            if DEBUG_ComfyScheduler_FULL:
+                logger.info(f"[DEBUG][ComfyScheduler] Backends: {self.snapshot()}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    scheduler = ComfyScheduler.get_instance()
+    try:
+        while True:
+            time.sleep(COMFY_SCHEDULER_POLL_INTERVAL)
+            for state in scheduler.snapshot():
+                logger.info(state)
+    except KeyboardInterrupt:
+        ComfyScheduler.close_instance()
+        ComfySession.close_all()
@@ -0,0 +1,557 @@
+import json
+import os
+import queue
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from websocket import WebSocketConnectionClosedException, create_connection
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_ComfySession = DEBUG
+DEBUG_ComfySession_FULL = DEBUG_FULL
+from constant import (
+    WS_URL, HTTP_BASE_URL, INPUT_IMAGE_PATH, COMFY_HTTP_TIMEOUT, COMFY_HTTP_POOL_SIZE,
+    COMFY_WS_CONNECT_TIMEOUT, COMFY_WS_PING_INTERVAL, COMFY_WS_RECONNECT_DELAY_MAX
+)
+
+MAX_ORPHAN_PROMPTS = 32
+MAX_REMEMBERED_INPUTS = 16
+
+BINARY_PREVIEW_IMAGE = 1
+BINARY_PREVIEW_IMAGE_WITH_METADATA = 4
+
+
+def http_timeout(limit: Optional[float]) -> tuple:
+    """
+    Return the (connect, read) timeout of an HTTP call that must end within limit seconds.
+    """
+    if limit is None:
+        return COMFY_HTTP_TIMEOUT
+    limit = max(limit, 0.1)
+    return (min(COMFY_HTTP_TIMEOUT[0], limit), min(COMFY_HTTP_TIMEOUT[1], limit))
+
+
+def parse_binary_frame(frame: bytes) -> tuple[int, bytes, dict]:
+    """
+    Split a ComfyUI binary websocket frame into (event type, image bytes, metadata).
+    """
+    if len(frame) < 8:
+        return 0, b"", {}
+    event_type = struct.unpack('>I', frame[:4])[0]
+    if event_type == BINARY_PREVIEW_IMAGE:
+        return event_type, frame[8:], {}
+    if event_type == BINARY_PREVIEW_IMAGE_WITH_METADATA:
+        meta_len = struct.unpack('>I', frame[4:8])[0]
+        try:
+            metadata = json.loads(frame[8:8 + meta_len].decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            metadata = {}
+        return event_type, frame[8 + meta_len:], metadata
+    return event_type, frame[4:], {}
+
+
+def decode_message(msg: object, executing_prompt_id: Optional[str]) -> tuple[Optional[dict], Optional[str], Optional[str]]:
+    """
+    Decode one websocket frame into (event, owning prompt_id, executing prompt_id).
+    Binary frames without metadata belong to the prompt being executed; the
+    executing prompt_id is updated from execution_start/executing/end events.
+    """
+    if isinstance(msg, (bytes, bytearray)):
+        event_type, image, metadata = parse_binary_frame(bytes(msg))
+        prompt_id = metadata.get('prompt_id') or executing_prompt_id
+        event = {'type': 'binary', 'data': {
+            'prompt_id': prompt_id, 'event_type': event_type,
+            'node': metadata.get('node_id'), 'bytes': image
+        }}
+        return event, prompt_id, executing_prompt_id
+    try:
+        event = json.loads(msg)
+    except (TypeError, json.JSONDecodeError):
+        return None, None, executing_prompt_id
+    t = event.get('type', '')
+    d = event.get('data') or {}
+    prompt_id = d.get('prompt_id')
+    if t == 'execution_start':
+        executing_prompt_id = prompt_id
+    elif t == 'executing':
+        executing_prompt_id = prompt_id if d.get('node') is not None else None
+    elif t in ('execution_success', 'execution_error', 'execution_interrupted'):
+        if executing_prompt_id == prompt_id:
+            executing_prompt_id = None
+    return event, prompt_id, executing_prompt_id
+
+
+def queue_depth_from_status(data: dict, default: int = 0) -> int:
+    """
+    Return the queue_remaining value of a 'status' event.
+    """
+    exec_info = (data.get('status') or {}).get('exec_info') or {}
+    return int(exec_info.get('queue_remaining', default) or 0)
+
+
+class ComfySession:
+    """
+    Long-lived connection to one ComfyUI server, shared by every generation.
+    Owns a pooled HTTP session, a single reconnecting websocket bound to one
+    client_id and one keep-alive thread. Websocket events are routed to the
+    job that owns their prompt_id.
+    """
+    _instances: dict = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, http_base_url: str = HTTP_BASE_URL, ws_url: str = WS_URL) -> "ComfySession":
+        """
+        Return the shared session for the given server, starting it on first use.
+        """
+        with cls._instances_lock:
+            session = cls._instances.get(http_base_url)
+            if session is None:
+                session = cls(http_base_url, ws_url)
+                cls._instances[http_base_url] = session
+        session.start()
+        return session
+
+    @classmethod
+    def close_all(cls) -> None:
+        """
+        Close every shared session (called when the application quits).
+        """
+        with cls._instances_lock:
+            sessions = list(cls._instances.values())
+            cls._instances.clear()
+        for session in sessions:
+            session.close()
+
+    def __init__(self, http_base_url: str = HTTP_BASE_URL, ws_url: str = WS_URL) -> None:
+        """
+        Initialize the session for a ComfyUI server without connecting yet.
+        """
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Entering __init__: args={(http_base_url, ws_url)}")
+        self.http_base_url = http_base_url.rstrip('/')
+        self.ws_url = ws_url
+        self.client_id = uuid.uuid4().hex
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=COMFY_HTTP_POOL_SIZE)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        self.queue_remaining = 0
+        self.connect_count = 0
+
+        self._ws = None
+        self._ws_lock = threading.Lock()
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._jobs: dict[str, queue.Queue] = {}
+        self._orphans: "OrderedDict[str, list]" = OrderedDict()
+        self._inputs: "OrderedDict[object, tuple]" = OrderedDict()
+        self._input_slots: "OrderedDict[object, int]" = OrderedDict()
+        self._uploaded: set = set()
+        self._jobs_lock = threading.Lock()
+        self._executing_prompt_id: Optional[str] = None
+        self._status_listeners: list[Callable[[dict], None]] = []
+        self._reader: Optional[threading.Thread] = None
+        self._keepalive: Optional[threading.Thread] = None
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Exiting __init__: client_id={self.client_id}")
+
+    def start(self) -> None:
+        """
+        Start the reader and keep-alive threads if they are not running.
+        """
+        if self._reader and self._reader.is_alive():
+            return
+        self._stop.clear()
+        self._reader = threading.Thread(target=self._reader_loop, name="ComfySession-reader", daemon=True)
+        self._keepalive = threading.Thread(target=self._keepalive_loop, name="ComfySession-keepalive", daemon=True)
+        self._reader.start()
+        self._keepalive.start()
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Started for {self.http_base_url}")
+
+    def close(self) -> None:
+        """
+        Stop the background threads, close the websocket and the HTTP pool,
+        and delete the uploaded inputs if the ComfyUI input folder is local.
+        """
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Entering close: args=()")
+        self._stop.set()
+        self._drop_ws()
+        for thread in (self._reader, self._keepalive):
+            if thread and thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout=2.0)
+        self._reader = None
+        self._keepalive = None
+        self.http.close()
+        self._delete_local_inputs()
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Exiting close: return=None")
+
+    def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the websocket is connected; return False on timeout.
+        """
+        return self._connected.wait(timeout)
+
+    @property
+    def connected(self) -> bool:
+        """
+        True while the websocket is connected.
+        """
+        return self._connected.is_set()
+
+    def url(self, path: str) -> str:
+        """
+        Return the absolute HTTP URL for a server path.
+        """
+        return f"{self.http_base_url}/{path.lstrip('/')}"
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """
+        GET a server path through the pooled HTTP session.
+        """
+        kwargs.setdefault('timeout', COMFY_HTTP_TIMEOUT)
+        resp = self.http.get(self.url(path), **kwargs)
+        resp.raise_for_status()
+        return resp
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """
+        POST to a server path through the pooled HTTP session.
+        """
+        kwargs.setdefault('timeout', COMFY_HTTP_TIMEOUT)
+        resp = self.http.post(self.url(path), **kwargs)
+        resp.raise_for_status()
+        return resp
+
+    def fetch_view(self, filename: str, subfolder: str = '', folder_type: str = 'output', timeout: Optional[float] = None) -> bytes:
+        """
+        Download the bytes of a server-side image through /view.
+        """
+        params = {'filename': filename, 'subfolder': subfolder, 'type': folder_type}
+        return self.get('/view', params=params, timeout=http_timeout(timeout)).content
+
+    def upload_image(self, data: bytes, filename: str, subfolder: str = '', mime: str = 'image/jpeg', timeout: Optional[float] = None) -> str:
+        """
+        Upload encoded image bytes to /upload/image and return the name LoadImage expects.
+        """
+        files = {'image': (filename, data, mime)}
+        form = {'type': 'input', 'subfolder': subfolder, 'overwrite': 'true'}
+        info = self.post('/upload/image', files=files, data=form, timeout=http_timeout(timeout)).json()
+        name = info.get('name', filename)
+        sub = info.get('subfolder', subfolder)
+        return f"{sub}/{name}" if sub else name
+
+    def input_name(self, key: object) -> Optional[str]:
+        """
+        Return the server name of an input image remembered with remember_input()
+        on the current connection, or None.
+        """
+        with self._jobs_lock:
+            entry = self._inputs.get(key)
+        if entry is None or entry[0] != self.connect_count:
+            return None
+        return entry[1]
+
+    def input_filename(self, key: object, ext: str) -> str:
+        """
+        Return the file name to upload an input image under. Each image keeps
+        one of MAX_REMEMBERED_INPUTS slots on the server; a new image takes a
+        free slot or the least recently used one, whose image is forgotten.
+        Uploads overwrite their slot, so the ComfyUI input folder never holds
+        more than MAX_REMEMBERED_INPUTS photos of the booth.
+        """
+        with self._jobs_lock:
+            slot = self._input_slots.get(key)
+            if slot is None:
+                taken = set(self._input_slots.values())
+                slot = next((i for i in range(MAX_REMEMBERED_INPUTS) if i not in taken), None)
+                if slot is None:
+                    old, slot = self._input_slots.popitem(last=False)
+                    self._inputs.pop(old, None)
+                self._input_slots[key] = slot
+            self._input_slots.move_to_end(key)
+        return f"input_{slot}.{ext}"
+
+    def remember_input(self, key: object, name: str) -> None:
+        """
+        Record the server name of an uploaded input image. Later jobs on the same
+        photo reuse it, so their LoadImage input is identical and ComfyUI serves
+        every node that does not depend on the seed from its execution cache.
+        """
+        with self._jobs_lock:
+            self._uploaded.add(name)
+            self._inputs[key] = (self.connect_count, name)
+            self._inputs.move_to_end(key)
+            while len(self._inputs) > MAX_REMEMBERED_INPUTS:
+                self._inputs.popitem(last=False)
+
+    def queue_prompt(self, prompt: dict, front: bool = False, timeout: Optional[float] = None) -> str:
+        """
+        Register a job, submit the prompt and return its prompt_id.
+        With front=True the prompt is queued ahead of the pending ones.
+        Events for the job are then read with get_event().
+        """
+        prompt_id = str(uuid.uuid4())
+        self.register(prompt_id)
+        payload = {'client_id': self.client_id, 'prompt': prompt, 'prompt_id': prompt_id}
+        if front:
+            payload['front'] = True
+        try:
+            resp = self.post('/prompt', json=payload, timeout=http_timeout(timeout))
+        except Exception:
+            self.release(prompt_id)
+            raise
+        server_id = resp.json().get('prompt_id') or prompt_id
+        if server_id != prompt_id:
+            self.rename(prompt_id, server_id)
+            prompt_id = server_id
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Prompt queued: prompt_id={prompt_id}")
+        return prompt_id
+
+    def cancel_prompt(self, prompt_id: str) -> None:
+        """
+        Remove a prompt from the server queue, interrupt it if it is running,
+        and wake up the job waiting on its events.
+        """
+        try:
+            self.post('/queue', json={'delete': [prompt_id]})
+        except Exception as e:
+            logger.info(f"[ComfySession] Failed to delete prompt {prompt_id} from the queue: {e!r}")
+        if self._executing_prompt_id == prompt_id:
+            try:
+                self.post('/interrupt', json={'prompt_id': prompt_id})
+            except Exception as e:
+                logger.info(f"[ComfySession] Failed to interrupt prompt {prompt_id}: {e!r}")
+        with self._jobs_lock:
+            events = self._jobs.get(prompt_id)
+        if events is not None:
+            events.put({'type': 'execution_interrupted', 'data': {'prompt_id': prompt_id, 'cancelled': True}})
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Prompt cancelled: prompt_id={prompt_id}")
+
+    def is_executing(self, prompt_id: str) -> bool:
+        """
+        True if the server reported that this prompt is currently running.
+        """
+        return self._executing_prompt_id == prompt_id
+
+    def get_event(self, prompt_id: str, timeout: Optional[float] = None) -> dict:
+        """
+        Return the next event routed to a job. Raises queue.Empty on timeout.
+        """
+        with self._jobs_lock:
+            events = self._jobs.get(prompt_id)
+        if events is None:
+            raise KeyError(f"Unknown prompt_id {prompt_id}")
+        return events.get(timeout=timeout)
+
+    def release(self, prompt_id: str) -> None:
+        """
+        Stop routing events to a finished job.
+        """
+        with self._jobs_lock:
+            self._jobs.pop(prompt_id, None)
+            self._orphans.pop(prompt_id, None)
+
+    def add_status_listener(self, callback: Callable[[dict], None]) -> None:
+        """
+        Subscribe to 'status' broadcasts (queue depth) from the server.
+        """
+        if callback not in self._status_listeners:
+            self._status_listeners.append(callback)
+
+    def remove_status_listener(self, callback: Callable[[dict], None]) -> None:
+        """
+        Unsubscribe from 'status' broadcasts.
+        """
+        if callback in self._status_listeners:
+            self._status_listeners.remove(callback)
+
+    def register(self, prompt_id: str, events=None):
+        """
+        Route the events of a prompt about to be queued to a job, draining
+        those that arrived early, and return the receiver. Any object with a
+        thread-safe put(event) works (the asyncio client passes its own);
+        the default queue.Queue is read with get_event().
+        """
+        if events is None:
+            events = queue.Queue()
+        with self._jobs_lock:
+            for event in self._orphans.pop(prompt_id, []):
+                events.put(event)
+            self._jobs[prompt_id] = events
+        return events
+
+    def rename(self, prompt_id: str, server_id: str) -> None:
+        """
+        Route the events of a job to the prompt_id the server assigned instead of the one it was registered under.
+        """
+        with self._jobs_lock:
+            events = self._jobs.pop(prompt_id)
+            self._jobs[server_id] = events
+            for event in self._orphans.pop(server_id, []):
+                events.put(event)
+
+    def _delete_local_inputs(self) -> None:
+        """
+        Delete the inputs uploaded by this session from the ComfyUI input folder, when it is on this machine.
+        """
+        folder = os.path.dirname(INPUT_IMAGE_PATH)
+        if not os.path.isdir(folder):
+            return
+        with self._jobs_lock:
+            names, self._uploaded = self._uploaded, set()
+        for name in names:
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+        if DEBUG_ComfySession and names:
+            logger.info(f"[DEBUG][ComfySession] Deleted {len(names)} uploaded inputs from {folder}")
+
+    def _connect(self) -> None:
+        """
+        Open the websocket under this session's client_id.
+        """
+        sep = '&' if '?' in self.ws_url else '?'
+        ws = create_connection(f"{self.ws_url}{sep}clientId={self.client_id}", timeout=COMFY_WS_CONNECT_TIMEOUT)
+        ws.settimeout(None)
+        with self._ws_lock:
+            self._ws = ws
+        self.connect_count += 1
+        self._connected.set()
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Websocket connected to {self.ws_url}")
+
+    def _drop_ws(self) -> None:
+        """
+        Close the current websocket, waking up the reader.
+        """
+        self._connected.clear()
+        with self._ws_lock:
+            ws, self._ws = self._ws, None
+        if ws is not None:
+            try:
+                ws.abort()
+                ws.close()
+            except Exception:
+                pass
+
+    def _reader_loop(self) -> None:
+        """
+        Receive websocket frames, reconnecting with backoff when the link drops.
+        """
+        delay = 0.5
+        was_connected = False
+        while not self._stop.is_set():
+            if self._ws is None:
+                try:
+                    self._connect()
+                except Exception as e:
+                    logger.info(f"[ComfySession] Websocket connection to {self.ws_url} failed: {e!r}")
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, COMFY_WS_RECONNECT_DELAY_MAX)
+                    continue
+                delay = 0.5
+                if was_connected:
+                    self._broadcast({'type': 'session_reconnected', 'data': {}})
+                was_connected = True
+            ws = self._ws
+            if ws is None:
+                continue
+            try:
+                msg = ws.recv()
+            except (WebSocketConnectionClosedException, OSError, AttributeError) as e:
+                if not self._stop.is_set():
+                    logger.info(f"[ComfySession] Websocket closed: {e!r}")
+                self._on_disconnect()
+                continue
+            except Exception as e:
+                logger.info(f"[ComfySession] Unexpected exception on ws.recv(): {type(e).__name__}: {e!r}")
+                self._on_disconnect()
+                continue
+            self._dispatch(msg)
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Reader stopped.")
+
+    def _on_disconnect(self) -> None:
+        """
+        Drop the websocket and tell the running jobs their server is unreachable.
+        """
+        self._drop_ws()
+        if not self._stop.is_set():
+            self._broadcast({'type': 'session_disconnected', 'data': {}})
+
+    def _keepalive_loop(self) -> None:
+        """
+        Ping the server periodically; a failed ping forces a reconnect.
+        """
+        while not self._stop.wait(COMFY_WS_PING_INTERVAL):
+            ws = self._ws
+            if ws is None:
+                continue
+            try:
+                ws.ping()
+                if DEBUG_ComfySession_FULL:
+                    logger.info("[DEBUG][ComfySession] ping sent successfully.")
+            except Exception as e:
+                logger.info(f"[ComfySession] Keep-alive ping failed: {e!r}")
+                self._drop_ws()
+        if DEBUG_ComfySession:
+            logger.info(f"[DEBUG][ComfySession] Keep-alive stopped.")
+
+    def _dispatch(self, msg: object) -> None:
+        """
+        Route one websocket frame to the job that owns it.
+        """
+        event, prompt_id, self._executing_prompt_id = decode_message(msg, self._executing_prompt_id)
+        if event is None:
+            return
+        if event.get('type') == 'status':
+            self._on_status(event.get('data') or {})
+            self._broadcast(event)
+            return
+        if DEBUG_ComfySession_FULL:
+            logger.info(f"[DEBUG][ComfySession] Event {event.get('type')} for prompt_id={prompt_id}")
+        if prompt_id is None:
+            return
+        with self._jobs_lock:
+            events = self._jobs.get(prompt_id)
+            if events is None:
+                self._orphans.setdefault(prompt_id, []).append(event)
+                while len(self._orphans) > MAX_ORPHAN_PROMPTS:
+                    self._orphans.popitem(last=False)
+                return
+        events.put(event)
+
+    def _broadcast(self, event: dict) -> None:
+        """
+        Deliver an event to every registered job.
+        """
+        with self._jobs_lock:
+            targets = list(self._jobs.values())
+        for events in targets:
+            events.put(event)
+
+    def _on_status(self, data: dict) -> None:
+        """
+        Track the server queue depth from a 'status' event.
+        """
+        self.queue_remaining = queue_depth_from_status(data, self.queue_remaining)
+        for callback in self._status_listeners[:]:
+            try:
+                callback(data)
+            except Exception as e:
+                logger.info(f"[ComfySession] Error notifying status listener: {e}")
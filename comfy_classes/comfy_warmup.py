@@ -0,0 +1,313 @@
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from PySide6.QtGui import QImage, QColor
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_WarmupManager = DEBUG
+DEBUG_WarmupManager_FULL = DEBUG_FULL
+from constant import (
+    WARMUP_ENABLED, WARMUP_CHECK_INTERVAL, WARMUP_PROMPT_TIMEOUT, WARMUP_IMAGE_PATH,
+    WARMUP_IMAGE_SIZE, WARMUP_EVICTION_RATIO, COMFY_UPLOAD_SUBFOLDER, RESIDENCY_ENABLED
+)
+from comfy_classes.job_protocol import encode_qimage
+from comfy_classes.comfy_scheduler import ComfyScheduler, ComfyBackend
+from comfy_classes.comfy_session import ComfySession
+from comfy_classes.generation_job import GenerationJob
+from comfy_classes.workflow_registry import WorkflowRegistry
+from comfy_classes.model_residency import ModelResidency
+from prompts import dico_styles
+
+
+def warmup_prompt(job: GenerationJob, text: str) -> dict:
+    """
+    Return the prompt of a job reduced to a warm-up run: every loader of the
+    workflow still executes, but the samplers do a single step without
+    previews and the result is not written to the output folder.
+    """
+    prompt = job.build_prompt(text)
+    for nid in job.template.samplers:
+        inputs = prompt[nid]['inputs']
+        if 'steps' in inputs:
+            inputs['steps'] = 1
+        if 'preview_method' in inputs:
+            inputs['preview_method'] = 'none'
+    for nid in [nid for nid, node in prompt.items() if node.get('class_type') == 'PreviewImage']:
+        del prompt[nid]
+    for nid in job.template.save_images:
+        prompt[nid]['class_type'] = 'PreviewImage'
+        prompt[nid]['inputs'].pop('filename_prefix', None)
+    return prompt
+
+
+def vram_used(stats: dict) -> Optional[int]:
+    """
+    Return the VRAM in use on the first device of a /system_stats answer.
+    """
+    devices = stats.get('devices') or []
+    if not devices or not devices[0].get('vram_total'):
+        return None
+    return int(devices[0]['vram_total']) - int(devices[0].get('vram_free', 0))
+
+
+def vram_total(stats: dict) -> Optional[int]:
+    """
+    Return the VRAM of the first device of a /system_stats answer.
+    """
+    devices = stats.get('devices') or []
+    return int(devices[0]['vram_total']) if devices and devices[0].get('vram_total') else None
+
+
+class WarmupManager:
+    """
+    Keeps the models of every style resident on every backend while the booth
+    is idle. Each style gets a 1-step prompt (cold), then a second one (warm),
+    and both timings are logged. A backend is warmed again when it reconnects,
+    which is how a ComfyUI restart shows up, or when its VRAM use falls below
+    WARMUP_EVICTION_RATIO of the value measured after the warm-up.
+    With RESIDENCY_ENABLED the backend is first emptied with /free and only
+    the styles planned by ModelResidency are warmed, most popular first;
+    the VRAM and load time of their models are recorded on the way.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "WarmupManager":
+        """
+        Return the shared warm-up manager, watching the scheduler's backends.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(ComfyScheduler.get_instance().backends)
+        return cls._instance
+
+    @classmethod
+    def close_instance(cls) -> None:
+        """
+        Stop the shared warm-up manager (called when the application quits).
+        """
+        with cls._instance_lock:
+            manager, cls._instance = cls._instance, None
+        if manager is not None:
+            manager.close()
+
+    def __init__(self, backends: list, check_interval: float = WARMUP_CHECK_INTERVAL) -> None:
+        """
+        Create a paused manager for a list of backends.
+        """
+        self.backends: list[ComfyBackend] = list(backends)
+        self.residency: Optional[ModelResidency] = ModelResidency.get_instance() if RESIDENCY_ENABLED else None
+        self.timings: dict[tuple, dict] = {}
+        self._check_interval = check_interval
+        self._warmed: dict[str, dict] = {}
+        self._enabled = threading.Event()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._image_bytes: Optional[bytes] = None
+
+    def resume(self) -> None:
+        """
+        Allow warm-up (the sleep screen is shown) and check the backends at once.
+        """
+        if not WARMUP_ENABLED:
+            return
+        self._enabled.set()
+        self._wake.set()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="WarmupManager", daemon=True)
+            self._thread.start()
+
+    def pause(self) -> None:
+        """
+        Stop sending warm-up prompts (a visitor is using the booth).
+        The prompt already sent, if any, finishes on the server.
+        """
+        self._enabled.clear()
+
+    def close(self) -> None:
+        """
+        Stop the warm-up thread.
+        """
+        self._enabled.clear()
+        self._stop.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def needs_warmup(self, backend: ComfyBackend) -> bool:
+        """
+        True if a connected backend was never warmed, has reconnected since,
+        had a style outside the residency plan selected, or has released most of
+        the VRAM it used after the warm-up.
+        """
+        session = backend.session
+        if not session.connected:
+            return False
+        state = self._warmed.get(backend.name)
+        if state is None or state['connect_count'] != session.connect_count:
+            return True
+        if self.residency is not None and self.residency.is_stale(backend.name):
+            logger.info(f"[WarmupManager] A style outside the residency plan was selected, warming the plan on {backend.name} again")
+            return True
+        if state['vram_used'] is None:
+            return False
+        used = self._vram_used(session)
+        if used is not None and used < state['vram_used'] * WARMUP_EVICTION_RATIO:
+            logger.info(f"[WarmupManager] {backend.name} VRAM use fell to {used} bytes, models were evicted")
+            return True
+        return False
+
+    def warm(self, backend: ComfyBackend) -> bool:
+        """
+        Run the cold and warm passes of every workflow on a backend, or of
+        the planned ones after a /free (styles falling back to the same
+        workflow are warmed once). Returns False if it was interrupted by
+        pause() or a failure.
+        """
+        session = backend.session
+        connect_count = session.connect_count
+        registry = WorkflowRegistry.get_instance()
+        try:
+            input_name = session.upload_image(self._input_bytes(), 'warmup.jpg', COMFY_UPLOAD_SUBFOLDER)
+        except Exception as e:
+            logger.info(f"[WarmupManager] Cannot upload the warm-up image to {backend.name}: {e!r}")
+            return False
+        styles = list(dico_styles)
+        if self.residency is not None:
+            try:
+                session.post('/free', json={'unload_models': True, 'free_memory': True})
+                stats = session.get('/system_stats').json()
+            except Exception as e:
+                logger.info(f"[WarmupManager] Cannot free {backend.name}: {e!r}")
+                stats = {}
+            styles = self.residency.plan(vram_total(stats))
+        warmed_templates = set()
+        loaded: set = set()
+        for style in styles:
+            try:
+                template = registry.get(style)
+            except FileNotFoundError:
+                continue
+            if template.name in warmed_templates:
+                continue
+            warmed_templates.add(template.name)
+            new_models = [m for m in template.models if m not in loaded]
+            before = self._vram_used(session) if self.residency is not None and new_models else None
+            timing = {}
+            for phase in ('cold', 'warm'):
+                if not self._enabled.is_set() or self._stop.is_set():
+                    return False
+                job = GenerationJob(style, template)
+                job.input_name = input_name
+                try:
+                    timing[phase] = self._run_prompt(session, warmup_prompt(job, dico_styles[style]))
+                except Exception as e:
+                    logger.info(f"[WarmupManager] Warm-up of {style} on {backend.name} failed: {e}")
+                    timing[phase] = None
+                    break
+            self.timings[(backend.name, style)] = timing
+            logger.info(
+                f"[WarmupManager] {style} on {backend.name}: cold {self._fmt(timing.get('cold'))}, "
+                f"warm {self._fmt(timing.get('warm'))}"
+            )
+            if timing.get('warm') is None:
+                continue
+            loaded.update(template.models)
+            if before is not None:
+                after = self._vram_used(session)
+                self.residency.record_load(new_models, None if after is None else after - before, timing['cold'] - timing['warm'])
+        self._warmed[backend.name] = {'connect_count': connect_count, 'vram_used': self._vram_used(session)}
+        if self.residency is not None:
+            self.residency.set_resident(backend.name, loaded)
+            cold = {s: round(p, 1) for s, p in self.residency.penalties(backend.name).items() if p > 0}
+            logger.info(f"[WarmupManager] {backend.name} keeps {styles} warm, cold-load penalties {cold or 'none'}")
+        return True
+
+    def _loop(self) -> None:
+        """
+        Check every backend periodically while enabled, warming the ones that need it.
+        """
+        while not self._stop.is_set():
+            self._wake.wait(self._check_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if not self._enabled.is_set():
+                continue
+            for backend in self.backends:
+                if not self._enabled.is_set():
+                    break
+                if self.needs_warmup(backend):
+                    if DEBUG_WarmupManager:
+                        logger.info(f"[DEBUG][WarmupManager] Warming {backend.name}")
+                    self.warm(backend)
+
+    def _run_prompt(self, session: ComfySession, prompt: dict) -> float:
+        """
+        Queue a prompt, wait for it to end and return its duration in seconds.
+        An execution error is raised as RuntimeError (the loaders that ran stay resident).
+        """
+        start = time.monotonic()
+        prompt_id = session.queue_prompt(prompt)
+        deadline = start + WARMUP_PROMPT_TIMEOUT
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    session.cancel_prompt(prompt_id)
+                    raise TimeoutError(f"no answer after {WARMUP_PROMPT_TIMEOUT:.0f}s")
+                try:
+                    event = session.get_event(prompt_id, timeout=min(remaining, 1.0))
+                except queue.Empty:
+                    continue
+                t = event.get('type')
+                d = event.get('data') or {}
+                if t == 'execution_success' or (t == 'executing' and d.get('node') is None):
+                    return time.monotonic() - start
+                if t == 'execution_error':
+                    raise RuntimeError(d.get('exception_message') or 'execution error')
+                if t in ('execution_interrupted', 'session_disconnected'):
+                    raise RuntimeError(t)
+        finally:
+            session.release(prompt_id)
+
+    def _input_bytes(self) -> bytes:
+        """
+        Return the warm-up input: WARMUP_IMAGE_PATH if present, else a small grey image.
+        """
+        if self._image_bytes is None:
+            qimg = QImage(WARMUP_IMAGE_PATH) if os.path.isfile(WARMUP_IMAGE_PATH) else QImage()
+            if qimg.isNull():
+                qimg = QImage(WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, QImage.Format_RGB888)
+                qimg.fill(QColor(128, 128, 128))
+            else:
+                qimg = qimg.scaledToWidth(min(qimg.width(), WARMUP_IMAGE_SIZE * 2))
+            self._image_bytes = encode_qimage(qimg, 'JPG', 90)
+        return self._image_bytes
+
+    @staticmethod
+    def _vram_used(session: ComfySession) -> Optional[int]:
+        """
+        Read the VRAM in use from /system_stats, or None if unavailable.
+        """
+        try:
+            return vram_used(session.get('/system_stats').json())
+        except Exception:
+            return None
+
+    @staticmethod
+    def _fmt(seconds: Optional[float]) -> str:
+        """
+        Format a timing for the log.
+        """
+        return 'failed' if seconds is None else f"{seconds:.2f}s"
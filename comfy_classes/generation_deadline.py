@@ -0,0 +1,95 @@
+import time
+from typing import Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG
+DEBUG_Deadline = DEBUG
+
+STAGE_UPLOAD = 'upload'
+STAGE_QUEUE = 'queue'
+STAGE_EXECUTION = 'execution'
+STAGE_RETRIEVAL = 'retrieval'
+
+
+class GenerationTimeoutError(TimeoutError):
+    """
+    Raised when a generation misses its deadline or stalls.
+    stage is the step that was running: upload, queue, execution or retrieval.
+    """
+
+    def __init__(self, stage: str, elapsed: float, budget: float, stalled: bool = False) -> None:
+        """
+        Describe the stage that timed out and how long the job had been running.
+        """
+        self.stage = stage
+        self.elapsed = elapsed
+        self.budget = budget
+        self.stalled = stalled
+        reason = "stalled" if stalled else "missed its deadline"
+        super().__init__(f"Generation {reason} in stage '{stage}' after {elapsed:.1f}s (budget {budget:.1f}s)")
+
+    @property
+    def backend_at_fault(self) -> bool:
+        """
+        True if the timeout points at the server: a stalled prompt, or an
+        upload or retrieval that did not complete. A deadline missed in the
+        queue or during a progressing execution only means the server is busy.
+        """
+        return self.stalled or self.stage in (STAGE_UPLOAD, STAGE_RETRIEVAL)
+
+
+class Deadline:
+    """
+    Time budget of one generation, shared by every stage of the job.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        """
+        Start a budget of the given number of seconds.
+        """
+        self.seconds = seconds
+        self._start = time.monotonic()
+
+    def elapsed(self) -> float:
+        """
+        Return the seconds spent since the deadline started.
+        """
+        return time.monotonic() - self._start
+
+    def remaining(self) -> float:
+        """
+        Return the seconds left, never negative.
+        """
+        return max(0.0, self.seconds - self.elapsed())
+
+    @property
+    def expired(self) -> bool:
+        """
+        True once the budget is spent.
+        """
+        return self.remaining() <= 0.0
+
+    def cap(self, seconds: Optional[float] = None) -> float:
+        """
+        Return a timeout for one blocking call: seconds, but no more than what is left.
+        """
+        remaining = self.remaining()
+        return remaining if seconds is None else min(seconds, remaining)
+
+    def error(self, stage: str, stalled: bool = False) -> GenerationTimeoutError:
+        """
+        Build the timeout error of a stage.
+        """
+        error = GenerationTimeoutError(stage, self.elapsed(), self.seconds, stalled)
+        if DEBUG_Deadline:
+            logger.info(f"[DEBUG][Deadline] {error} (backend at fault: {error.backend_at_fault})")
+        return error
+
+    def check(self, stage: str) -> None:
+        """
+        Raise GenerationTimeoutError if the budget is spent.
+        """
+        if self.expired:
+            raise self.error(stage)
@@ -0,0 +1,173 @@
+import glob
+import os
+import random
+import time
+import uuid
+from typing import List, Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_GenerationJob = DEBUG
+DEBUG_GenerationJob_FULL = DEBUG_FULL
+from constant import COMFY_OUTPUT_PREFIX, INPUT_IMAGE_PATH
+from comfy_classes.workflow_registry import WorkflowTemplate
+from comfy_classes.progress_model import ProgressEstimator
+
+
+class GenerationJob:
+    """
+    State of a single generation: progress accounting, input name and output naming.
+    Nothing here is shared between jobs, so several jobs can run at the same time.
+    """
+
+    def __init__(self, style: str, template: WorkflowTemplate, seed: Optional[int] = None, size_divisor: Optional[float] = None) -> None:
+        """
+        Create a job for a style and its workflow template.
+        Without a seed, a random one is drawn when the prompt is built.
+        A size_divisor replaces the value of the workflow's divisor nodes.
+        """
+        self.job_id: str = uuid.uuid4().hex
+        self.style = style
+        self.template = template
+        self.seed = seed
+        self.size_divisor = size_divisor
+        self.prompt_id: Optional[str] = None
+        self.backend: Optional[str] = None
+        self.input_name: Optional[str] = None
+        self.stage: Optional[str] = None
+        self.stage_times: List[tuple] = []
+        self.output_prefix: str = f"{COMFY_OUTPUT_PREFIX}_{self.job_id}"
+        self.total_steps: dict[str, float] = dict(template.total_steps)
+        self.total_steps_sum: float = template.total_steps_sum
+        self.progress: dict[str, float] = {}
+        self.cached_nodes: List[str] = []
+        self.progress_model = ProgressEstimator(template)
+        self.result_images: List[dict] = []
+        self.result_bytes: Optional[bytes] = None
+        self.started_at: float = time.time()
+        if DEBUG_GenerationJob:
+            logger.info(
+                f"[DEBUG][GenerationJob] Created job {self.job_id} for style={style!r} "
+                f"workflow={template.name!r} steps={self.total_steps_sum}"
+            )
+
+    def reset(self) -> None:
+        """
+        Forget the progress and results of a failed attempt before it is retried.
+        """
+        self.prompt_id = None
+        self.stage = None
+        self.stage_times = []
+        self.progress.clear()
+        self.cached_nodes = []
+        self.progress_model.reset()
+        self.result_images = []
+        self.result_bytes = None
+
+    def build_prompt(self, text: str, websocket_output: bool = False) -> dict:
+        """
+        Return the prompt of this job: the template with the style text, the
+        sampler seeds derived from the job seed, the size divisor, the input
+        image and the job's output naming patched in.
+        With websocket_output, SaveImage is replaced by SaveImageWebsocket.
+        """
+        template = self.template
+        prompt = template.copy_prompt()
+        if self.seed is None:
+            self.seed = random.randint(0, 2**32 - 1)
+        rng = random.Random(self.seed)
+        for nid in template.text_nodes:
+            prompt[nid]['inputs']['text'] = text
+        for nid in template.samplers:
+            inputs = prompt[nid]['inputs']
+            inputs['seed'] = rng.randint(0, 2**32 - 1)
+            if 'preview_method' in inputs:
+                inputs['preview_method'] = 'auto'
+        if self.size_divisor is not None:
+            for nid in template.size_divisors:
+                prompt[nid]['inputs']['value'] = self.size_divisor
+        for nid in template.load_images:
+            prompt[nid]['inputs']['image'] = self.input_name or INPUT_IMAGE_PATH
+        for nid in template.save_images:
+            node = prompt[nid]
+            if websocket_output:
+                node['class_type'] = 'SaveImageWebsocket'
+                node['inputs'].pop('filename_prefix', None)
+            else:
+                node['inputs']['filename_prefix'] = self.output_prefix
+        return prompt
+
+    def set_stage(self, stage: str) -> None:
+        """
+        Enter a stage of the job (upload, queue, execution, retrieval), recording when.
+        """
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_times.append((stage, time.monotonic()))
+
+    def stage_durations(self, end: Optional[float] = None) -> dict[str, float]:
+        """
+        Return the seconds spent in each stage; the last one runs until end
+        (a time.monotonic() value, now by default).
+        """
+        end = time.monotonic() if end is None else end
+        durations: dict[str, float] = {}
+        for (stage, start), (_, stop) in zip(self.stage_times, self.stage_times[1:] + [(None, end)]):
+            durations[stage] = durations.get(stage, 0.0) + stop - start
+        return durations
+
+    def update_progress(self, node: str, value: float) -> Optional[float]:
+        """
+        Record the step reached by a sampler node and return the job percentage,
+        or None if the node is not one of the workflow samplers.
+        """
+        if node not in self.total_steps:
+            return None
+        self.progress[node] = min(value, self.total_steps[node])
+        return self.progress_percentage()
+
+    def record_cached(self, nodes: list) -> None:
+        """
+        Record the nodes ComfyUI served from its execution cache (execution_cached event).
+        """
+        self.cached_nodes.extend(nid for nid in nodes if nid not in self.cached_nodes)
+
+    def cache_hit_rate(self) -> float:
+        """
+        Return the fraction of the workflow nodes that were served from ComfyUI's cache.
+        """
+        return len(self.cached_nodes) / len(self.template.nodes) if self.template.nodes else 0.0
+
+    def progress_percentage(self) -> float:
+        """
+        Return the progress of the job over all its samplers.
+        """
+        if not self.total_steps_sum:
+            return 0.0
+        return sum(self.progress.values()) / self.total_steps_sum * 100
+
+    def output_paths(self, folder: str) -> List[str]:
+        """
+        Return the files this job wrote in an output folder, oldest first.
+        """
+        paths = glob.glob(os.path.join(folder, f"{self.output_prefix}*.png"))
+        for info in self.result_images:
+            path = os.path.join(folder, info.get('subfolder', ''), info.get('filename', ''))
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+        return sorted(paths, key=os.path.getmtime)
+
+    def clear_outputs(self, folder: str) -> None:
+        """
+        Delete the files this job wrote in an output folder.
+        """
+        for path in self.output_paths(folder):
+            try:
+                os.remove(path)
+                if DEBUG_GenerationJob:
+                    logger.info(f"[DEBUG][GenerationJob] Deleted output image: {path}")
+            except OSError as e:
+                if DEBUG_GenerationJob:
+                    logger.info(f"[DEBUG][GenerationJob] Failed to delete output image {path}: {e}")
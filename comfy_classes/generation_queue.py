@@ -0,0 +1,486 @@
+import concurrent.futures
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Optional
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QImage
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_GenerationQueue = DEBUG
+DEBUG_GenerationQueue_FULL = DEBUG_FULL
+from constant import COMFY_BACKENDS, COMFY_QUEUE_DEPTH_PER_BACKEND, RESULT_CACHE_ENABLED
+from constant import GENERATION_TIMEOUT, GENERATION_WATCHDOG_GRACE
+from comfy_classes.comfy_class_API import ImageGeneratorAPIWrapper
+from comfy_classes.result_cache import ResultCache, photo_digest, default_seed, make_key
+from comfy_classes.workflow_registry import WorkflowRegistry, WorkflowTemplate
+from comfy_classes.quality_governor import QualityGovernor
+from comfy_classes.generation_deadline import GenerationTimeoutError, STAGE_QUEUE
+from comfy_classes import comfy_async
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REGENERATE = 1
+PRIORITY_SPECULATIVE = 2
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+
+class GenerationTicket(QObject):
+    """
+    Handle on one queued generation. Signals are delivered in the Qt thread;
+    finished carries the generated QImage, or None on failure or cancellation
+    (error then holds the exception, if any). A ticket with a template runs
+    that workflow instead of the style's one (deferred upscale). A two-pass
+    ticket emits draft_ready with the draft before the final result.
+    submitted_at is when a visitor asked for it (a promoted prefetch counts
+    from its promotion) and tier the quality tier it runs at.
+    """
+    progress_changed = Signal(float)
+    preview_ready = Signal(QImage)
+    draft_ready = Signal(QImage)
+    finished = Signal(object)
+
+    def __init__(self, style: str, input_image: QImage, priority: int, key: tuple, seed: Optional[int] = None, cache_key: Optional[str] = None, template: Optional[WorkflowTemplate] = None) -> None:
+        """
+        Create a pending ticket.
+        """
+        super().__init__()
+        self.style = style
+        self.template = template
+        self.input_image = input_image
+        self.priority = priority
+        self.key = key
+        self.seed = seed
+        self.cache_key = cache_key
+        self.state = PENDING
+        self.draft = 0.0
+        self.tier = 0
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.first_image_at: Optional[float] = None
+        self.api = None
+        self.result: Optional[QImage] = None
+        self.error: Optional[Exception] = None
+        self._emitted = False
+        self._watchdog: Optional[threading.Timer] = None
+
+    @property
+    def active(self) -> bool:
+        """
+        True while the ticket is pending or running.
+        """
+        return self.state in (PENDING, RUNNING)
+
+    def is_executing(self) -> bool:
+        """
+        True while the server is running this ticket's prompt.
+        """
+        return self.state == RUNNING and self.api is not None and self.api.is_executing()
+
+    def estimate(self) -> Optional[tuple]:
+        """
+        Return (percent, seconds left or None, queued) of the running job, or None before it starts.
+        """
+        job = self.api.job if self.api is not None else None
+        return job.progress_model.snapshot() if job is not None else None
+
+    def cancel(self) -> None:
+        """
+        Cancel the ticket: dropped locally if pending, cancelled on the server if running.
+        """
+        GenerationQueue.get_instance().cancel(self)
+
+
+class GenerationQueue:
+    """
+    Priority queue in front of the API wrappers: interactive > regenerate > speculative.
+    At most COMFY_QUEUE_DEPTH_PER_BACKEND jobs per backend are submitted to ComfyUI,
+    the others wait here so that a new interactive job overtakes them. Submitting
+    the same style for the same photo twice returns the active ticket.
+    Results are looked up in and written to the ResultCache. The quality tier
+    of new jobs comes from the QualityGovernor, fed with the visitors' waits.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "GenerationQueue":
+        """
+        Return the shared generation queue.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(COMFY_QUEUE_DEPTH_PER_BACKEND * len(COMFY_BACKENDS))
+        return cls._instance
+
+    def __init__(self, max_inflight: int) -> None:
+        """
+        Create an empty queue submitting at most max_inflight jobs at a time.
+        """
+        self.max_inflight = max(1, max_inflight)
+        self._heap: list = []
+        self._counter = itertools.count()
+        self._tickets: dict[tuple, GenerationTicket] = {}
+        self._running: set = set()
+        self._lock = threading.RLock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._last_digest: tuple = (None, None)
+
+    def submit(self, style: str, input_image: QImage, priority: int = PRIORITY_INTERACTIVE, seed: Optional[int] = None, template: Optional[WorkflowTemplate] = None) -> GenerationTicket:
+        """
+        Queue a generation, or return the active ticket for the same style and photo
+        (raising its priority if needed). Without a seed, the first generation of a
+        style uses the photo's default seed and a regenerate draws a new one; with
+        one, only a ticket of the same seed is reused (prefetched variants).
+        A template replaces the workflow of the style (see submit_upscale()).
+        A cached result gives a ticket that is already done.
+        """
+        name = template.name if template is not None else style
+        key = (name, input_image.cacheKey()) if seed is None else (name, input_image.cacheKey(), seed)
+        with self._lock:
+            ticket = self._tickets.get(key)
+            if ticket is not None and ticket.active:
+                if priority < ticket.priority:
+                    if ticket.priority >= PRIORITY_SPECULATIVE > priority:
+                        ticket.submitted_at = time.monotonic()
+                    ticket.priority = priority
+                    if ticket.state == PENDING:
+                        self._push(ticket)
+                if DEBUG_GenerationQueue:
+                    logger.info(f"[DEBUG][GenerationQueue] Reusing {ticket.state} ticket for {style} (priority={ticket.priority})")
+                return ticket
+            if seed is None:
+                seed = random.randint(0, 2**32 - 1) if priority == PRIORITY_REGENERATE else None
+            tier = self._quality_tier() if template is None else 0
+            ticket = self._new_ticket(style, input_image, priority, key, seed, template, tier)
+            if ticket.result is not None:
+                return ticket
+            self._tickets[key] = ticket
+            self._push(ticket)
+            if DEBUG_GenerationQueue:
+                logger.info(f"[DEBUG][GenerationQueue] Queued {style} (priority={priority}, waiting={len(self._heap)})")
+        self._dispatch()
+        return ticket
+
+    def submit_upscale(self, style: str, image: QImage, priority: int = PRIORITY_INTERACTIVE) -> Optional[GenerationTicket]:
+        """
+        Queue the deferred upscale stage of a style on one of its results, or
+        return None if the image is already large enough or the style has no upscale nodes.
+        """
+        registry = WorkflowRegistry.get_instance()
+        try:
+            template = registry.get(style).upscale_stage()
+        except FileNotFoundError:
+            return None
+        if template is None or not registry.needs_upscale(image.height()):
+            return None
+        return self.submit(style, image, priority, template=template)
+
+    def cancel(self, ticket: GenerationTicket) -> None:
+        """
+        Cancel a ticket and free its slot.
+        """
+        with self._lock:
+            if not ticket.active:
+                return
+            was_running = ticket.state == RUNNING
+            ticket.state = CANCELLED
+            self._forget(ticket)
+            emit = not was_running or ticket.api is None
+            if emit:
+                ticket._emitted = True
+        if was_running and ticket.api is not None:
+            ticket.api.cancel()
+        if emit:
+            ticket.finished.emit(None)
+        if DEBUG_GenerationQueue:
+            logger.info(f"[DEBUG][GenerationQueue] Cancelled {ticket.style} ({'running' if was_running else 'pending'})")
+        self._dispatch()
+
+    def cancel_all(self, min_priority: int = PRIORITY_INTERACTIVE) -> None:
+        """
+        Cancel every active ticket whose priority is min_priority or lower.
+        """
+        with self._lock:
+            tickets = [t for t in self._tickets.values() if t.active and t.priority >= min_priority]
+        for ticket in tickets:
+            self.cancel(ticket)
+
+    def pending_count(self) -> int:
+        """
+        Return the number of tickets waiting locally.
+        """
+        with self._lock:
+            return sum(1 for t in self._tickets.values() if t.state == PENDING)
+
+    def _quality_tier(self) -> int:
+        """
+        Return the quality tier of a new job from the visitors' jobs queued or running (called with the lock held).
+        """
+        depth = sum(
+            1 for t in self._tickets.values()
+            if t.active and t.priority < PRIORITY_SPECULATIVE and t.template is None
+        )
+        return QualityGovernor.get_instance().evaluate(depth, self.max_inflight)
+
+    def _new_ticket(self, style: str, input_image: QImage, priority: int, key: tuple, seed: Optional[int], template: Optional[WorkflowTemplate] = None, tier: int = 0) -> GenerationTicket:
+        """
+        Create a ticket with its seed and cache key, already done on a cache hit
+        (called with the lock held). The key covers the workflow variant, quality
+        tier and size divisor the job will run with.
+        """
+        if not RESULT_CACHE_ENABLED or (template is not None and not template.cacheable):
+            ticket = GenerationTicket(style, input_image, priority, key, seed, template=template)
+            ticket.tier = tier
+            return ticket
+        try:
+            if template is None:
+                registry = WorkflowRegistry.get_instance()
+                sized, divisor = registry.sized(registry.get(style), input_image.height(), tier=tier)
+                digest = sized.digest if divisor is None else f"{sized.digest}/{divisor}"
+            else:
+                digest = template.digest
+        except (FileNotFoundError, ValueError) as e:
+            logger.info(f"[GenerationQueue] No workflow for {style}, result not cached: {e}")
+            ticket = GenerationTicket(style, input_image, priority, key, seed, template=template)
+            ticket.tier = tier
+            return ticket
+        if self._last_digest[0] != key[1]:
+            self._last_digest = (key[1], photo_digest(input_image))
+        photo = self._last_digest[1]
+        if seed is None:
+            seed = default_seed(photo, style)
+        ticket = GenerationTicket(style, input_image, priority, key, seed, make_key(photo, key[0], digest, seed), template)
+        ticket.tier = tier
+        cached = ResultCache.get_instance().get(ticket.cache_key)
+        if cached is not None:
+            ticket.state = DONE
+            ticket.result = cached
+            if DEBUG_GenerationQueue:
+                logger.info(f"[DEBUG][GenerationQueue] Cache hit for {style} (seed={seed})")
+        return ticket
+
+    def _push(self, ticket: GenerationTicket) -> None:
+        """
+        Add a ticket to the heap; stale entries are skipped when popped.
+        """
+        heapq.heappush(self._heap, (ticket.priority, next(self._counter), ticket))
+
+    def _forget(self, ticket: GenerationTicket) -> None:
+        """
+        Remove a ticket from the bookkeeping (called with the lock held).
+        """
+        self._running.discard(ticket)
+        if self._tickets.get(ticket.key) is ticket:
+            del self._tickets[ticket.key]
+
+    def _dispatch(self) -> None:
+        """
+        Start the highest-priority pending tickets while slots are free.
+        """
+        while True:
+            with self._lock:
+                if len(self._running) >= self.max_inflight:
+                    return
+                ticket = None
+                while self._heap:
+                    priority, _, candidate = heapq.heappop(self._heap)
+                    if candidate.state == PENDING and candidate.priority == priority:
+                        ticket = candidate
+                        break
+                if ticket is None:
+                    return
+                ticket.state = RUNNING
+                ticket.started_at = time.monotonic()
+                self._running.add(ticket)
+            self._start(ticket)
+
+    def _start(self, ticket: GenerationTicket) -> None:
+        """
+        Create the wrapper of a ticket and submit it to ComfyUI. A visitor's
+        ticket of a style with a draft ratio runs the draft first, unless the
+        load lowered the quality tier (the draft is then one job too many).
+        """
+        front = ticket.priority < PRIORITY_SPECULATIVE
+        if front and ticket.template is None and ticket.tier == 0:
+            ticket.draft = WorkflowRegistry.get_instance().draft_ratio(ticket.style)
+        if DEBUG_GenerationQueue:
+            logger.info(f"[DEBUG][GenerationQueue] Starting {ticket.key[0]} (priority={ticket.priority}, front={front})")
+        use_async = comfy_async.is_available()
+        try:
+            if use_async:
+                api = comfy_async.AsyncImageGeneratorAPIWrapper(style=ticket.style, qimg=ticket.input_image)
+            else:
+                api = ImageGeneratorAPIWrapper(style=ticket.style, qimg=ticket.input_image)
+            if ticket.template is not None:
+                api.set_template(ticket.template)
+            if ticket.tier:
+                api.set_quality_tier(ticket.tier)
+            api.progress_changed.connect(ticket.progress_changed)
+            api.preview_ready.connect(ticket.preview_ready)
+            ticket.api = api
+            if use_async and ticket.draft:
+                future = api.generate(front=front, seed=ticket.seed, draft=ticket.draft)
+                future.add_done_callback(lambda f, ticket=ticket: self._on_draft_done(ticket, f, front))
+                self._arm_watchdog(ticket)
+                return
+            if use_async:
+                future = api.generate(front=front, seed=ticket.seed)
+            else:
+                on_draft = lambda qimg, ticket=ticket: self._on_draft(ticket, qimg)
+                on_refine = lambda ticket=ticket: self._on_refine(ticket)
+                future = self._get_executor().submit(self._run_blocking, api, front, ticket.seed, ticket.draft, on_draft, on_refine)
+        except Exception as e:
+            logger.info(f"[GenerationQueue] Failed to start {ticket.style}: {e!r}")
+            self._finish(ticket, None)
+            return
+        future.add_done_callback(lambda f, ticket=ticket: self._on_future_done(ticket, f))
+        self._arm_watchdog(ticket)
+
+    def _arm_watchdog(self, ticket: GenerationTicket) -> None:
+        """
+        (Re)start the watchdog of a running ticket for one generation.
+        """
+        if ticket._watchdog is not None:
+            ticket._watchdog.cancel()
+        ticket._watchdog = threading.Timer(GENERATION_TIMEOUT + GENERATION_WATCHDOG_GRACE, self._on_watchdog, (ticket,))
+        ticket._watchdog.daemon = True
+        ticket._watchdog.start()
+
+    def _on_draft(self, ticket: GenerationTicket, qimg: Optional[QImage]) -> None:
+        """
+        Publish the draft of a two-pass ticket.
+        """
+        if ticket.state != RUNNING or qimg is None or qimg.isNull():
+            return
+        ticket.first_image_at = time.monotonic()
+        ticket.draft_ready.emit(qimg)
+        if DEBUG_GenerationQueue:
+            logger.info(f"[DEBUG][GenerationQueue] Draft of {ticket.style} after {ticket.first_image_at - ticket.submitted_at:.2f}s")
+
+    def _on_refine(self, ticket: GenerationTicket) -> None:
+        """
+        Re-arm the watchdog of a blocking two-pass ticket for its full-quality pass,
+        which has a deadline of its own.
+        """
+        if ticket.state == RUNNING:
+            self._arm_watchdog(ticket)
+
+    def _on_draft_done(self, ticket: GenerationTicket, future: concurrent.futures.Future, front: bool) -> None:
+        """
+        Publish the draft of an asyncio two-pass ticket and start its full-quality pass with the same seed.
+        """
+        try:
+            self._on_draft(ticket, future.result())
+        except Exception as e:
+            logger.info(f"[GenerationQueue] Draft of {ticket.style} failed: {e!r}")
+        if ticket.state != RUNNING or ticket.api.cancelled:
+            self._finish(ticket, None)
+            return
+        seed = ticket.api.job.seed if ticket.api.job is not None else ticket.seed
+        try:
+            refine = ticket.api.generate(front=front, seed=seed)
+        except Exception as e:
+            logger.info(f"[GenerationQueue] Failed to start {ticket.style}: {e!r}")
+            self._finish(ticket, None)
+            return
+        refine.add_done_callback(lambda f, ticket=ticket: self._on_future_done(ticket, f))
+        self._arm_watchdog(ticket)
+
+    def _on_watchdog(self, ticket: GenerationTicket) -> None:
+        """
+        Give up on a job whose wrapper did not end within its deadline: cancel
+        it on the server and finish the ticket with a GenerationTimeoutError.
+        """
+        if ticket.state != RUNNING:
+            return
+        job = ticket.api.job if ticket.api is not None else None
+        stage = (job.stage if job is not None else None) or STAGE_QUEUE
+        ticket.error = GenerationTimeoutError(stage, GENERATION_TIMEOUT + GENERATION_WATCHDOG_GRACE, GENERATION_TIMEOUT)
+        logger.info(f"[GenerationQueue] Watchdog: {ticket.style} {ticket.error}")
+        if ticket.api is not None:
+            threading.Thread(target=ticket.api.cancel, name="GenerationQueue-watchdog", daemon=True).start()
+        self._finish(ticket, None)
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """
+        Return the worker pool used when the asyncio client is not available.
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_inflight, thread_name_prefix="GenerationQueue"
+            )
+        return self._executor
+
+    @staticmethod
+    def _run_blocking(api: ImageGeneratorAPIWrapper, front: bool, seed: Optional[int], draft: float = 0.0, on_draft=None, on_refine=None) -> Optional[QImage]:
+        """
+        Worker body for the blocking wrapper; with a draft ratio the draft is
+        generated and passed to on_draft first, then on_refine is called and
+        the final image generated with the same seed.
+        """
+        if draft:
+            try:
+                api.generate_image(front=front, seed=seed, draft=draft)
+                if not api.cancelled:
+                    on_draft(api.load_result_image(timeout=15.0))
+                    api.delete_input_and_output_images()
+            except Exception as e:
+                logger.info(f"[GenerationQueue] Draft failed: {e!r}")
+            if api.cancelled:
+                return None
+            seed = api.job.seed if api.job is not None else seed
+            on_refine()
+        api.generate_image(front=front, seed=seed)
+        if api.cancelled:
+            return None
+        qimg = api.load_result_image(timeout=15.0)
+        api.delete_input_and_output_images()
+        return qimg
+
+    def _on_future_done(self, ticket: GenerationTicket, future: concurrent.futures.Future) -> None:
+        """
+        Collect the result of a finished job.
+        """
+        try:
+            qimg = future.result()
+        except Exception as e:
+            logger.info(f"[GenerationQueue] Generation of {ticket.style} failed: {e!r}")
+            if ticket.error is None:
+                ticket.error = e
+            qimg = None
+        self._finish(ticket, qimg)
+
+    def _finish(self, ticket: GenerationTicket, qimg: Optional[QImage]) -> None:
+        """
+        Publish a result once, free the slot and start the next ticket.
+        """
+        if ticket._watchdog is not None:
+            ticket._watchdog.cancel()
+        with self._lock:
+            if ticket._emitted:
+                return
+            ticket._emitted = True
+            cancelled = ticket.state == CANCELLED
+            ticket.state = CANCELLED if cancelled else DONE
+            self._forget(ticket)
+        ticket.result = None if cancelled or qimg is None or qimg.isNull() else qimg
+        now = time.monotonic()
+        if ticket.draft and ticket.result is not None:
+            first = (ticket.first_image_at or now) - ticket.submitted_at
+            logger.info(f"[GenerationQueue] {ticket.style}: first image after {first:.2f}s, final after {now - ticket.submitted_at:.2f}s")
+        if ticket.result is not None and ticket.template is None and ticket.priority < PRIORITY_SPECULATIVE:
+            QualityGovernor.get_instance().record(now - ticket.submitted_at, now - (ticket.started_at or ticket.submitted_at))
+        if ticket.result is not None and ticket.cache_key:
+            ResultCache.get_instance().store(ticket.cache_key, ticket.result)
+        ticket.finished.emit(ticket.result)
+        self._dispatch()
@@ -0,0 +1,263 @@
+import time
+from typing import Optional
+
+from PySide6.QtCore import QBuffer, QByteArray, QIODevice
+from PySide6.QtGui import QImage
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_JobProtocol = DEBUG
+DEBUG_JobProtocol_FULL = DEBUG_FULL
+from constant import (
+    COMFY_UPLOAD_FORMAT, COMFY_UPLOAD_QUALITY, COMFY_PREVIEW_ENABLED, COMFY_PREVIEW_MIN_INTERVAL,
+    COMFY_STALL_TIMEOUT
+)
+from comfy_classes.generation_job import GenerationJob
+from comfy_classes.generation_deadline import Deadline, STAGE_EXECUTION
+
+OUTPUT_NODE_TYPES = ('SaveImage', 'SaveImageWebsocket')
+FINISHED_EVENTS = ('done', 'execution_success', 'execution_complete', 'execution_end')
+
+CONTINUE = 'continue'
+FINISHED = 'finished'
+DISCONNECTED = 'disconnected'
+RECONNECTED = 'reconnected'
+
+
+def encode_qimage(image: QImage, fmt: str = COMFY_UPLOAD_FORMAT, quality: int = COMFY_UPLOAD_QUALITY) -> bytes:
+    """
+    Encode a QImage in memory and return the bytes.
+    """
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    ok = image.save(buffer, fmt, quality)
+    buffer.close()
+    if not ok:
+        raise IOError(f"Failed to encode image as {fmt}")
+    return bytes(data.data())
+
+
+class InputUpload:
+    """
+    The input image of a wrapper and the name it was uploaded under. A name
+    is reused on the server that received it, and found again through the
+    remember_input() of the server's ComfySession by the other wrappers,
+    blocking or asyncio, working on the same image.
+    """
+
+    def __init__(self, image: Optional[QImage] = None) -> None:
+        """
+        Hold an input image, not uploaded anywhere yet.
+        """
+        self.image = image
+        self.name: Optional[str] = None
+        self.session = None
+
+    def set_image(self, image: QImage) -> None:
+        """
+        Replace the input image, forgetting its upload unless it is the same image.
+        """
+        if image is not self.image:
+            self.image = image
+            self.name = None
+            self.session = None
+
+    def name_on(self, session) -> Optional[str]:
+        """
+        Return the name of the image on a server if it was already uploaded there, else None.
+        """
+        if self.image is None:
+            return None
+        if self.name is not None and self.session is session:
+            return self.name
+        name = session.input_name(self.image.cacheKey())
+        if name is not None:
+            self.name, self.session = name, session
+            if DEBUG_JobProtocol:
+                logger.info(f"[DEBUG][JobProtocol] Reusing uploaded input {name}")
+        return name
+
+    def encode(self, session) -> tuple:
+        """
+        Return (data, filename, mime) of the upload of the image to a server,
+        under the slot name of the image there (see ComfySession.input_filename()).
+        """
+        ext = 'png' if COMFY_UPLOAD_FORMAT.upper() == 'PNG' else 'jpg'
+        mime = 'image/png' if ext == 'png' else 'image/jpeg'
+        return encode_qimage(self.image), session.input_filename(self.image.cacheKey(), ext), mime
+
+    def uploaded(self, session, name: str) -> None:
+        """
+        Record the name an upload to a server returned.
+        """
+        self.name, self.session = name, session
+        session.remember_input(self.image.cacheKey(), name)
+
+    def preferred(self, sessions: list) -> Optional[int]:
+        """
+        Return the index of a session the image was already uploaded to: a
+        regenerate sent there only recomputes the nodes that depend on the seed.
+        """
+        if self.image is None:
+            return None
+        key = self.image.cacheKey()
+        return next((i for i, session in enumerate(sessions) if session.input_name(key) is not None), None)
+
+
+def fail_over(scheduler, backend, name: str, job: GenerationJob, error: Exception, tried: list, owner: str) -> None:
+    """
+    Take a backend that dropped a job out of rotation and reset the job for
+    the next attempt.
+    """
+    scheduler.mark_failed(backend, error)
+    tried.append(backend)
+    job.reset()
+    logger.info(f"[{owner}] Job {job.job_id} failed on {name}, failing over: {error}")
+
+
+class JobProtocol:
+    """
+    The event state machine of one running job, shared by the blocking and
+    the asyncio wrappers. It does no I/O: the wrapper waits for the next event
+    of the prompt within next_timeout(), passes it to handle() and acts on the
+    answer: CONTINUE, FINISHED, DISCONNECTED (wait for the server to come back)
+    or RECONNECTED (ask /history and /queue, see record_history()). Stage,
+    progress, cached nodes and result images are recorded on the job; the
+    progress and throttled sampler previews are emitted through the
+    progress_changed and preview_ready signals of the wrapper.
+    """
+
+    def __init__(self, job: GenerationJob, prompt: dict, wrapper) -> None:
+        """
+        Start following a job whose prompt was just queued.
+        """
+        self.job = job
+        self.wrapper = wrapper
+        self.output_nodes = {nid for nid, node in prompt.items() if node.get('class_type') in OUTPUT_NODE_TYPES}
+        self._executing_node: Optional[str] = None
+        self._last_preview = 0.0
+
+    def next_timeout(self, deadline: Deadline) -> tuple:
+        """
+        Return (seconds, stalled): how long to wait for the next event, and
+        whether running out means the prompt stalled (COMFY_STALL_TIMEOUT
+        without an event while executing) rather than missed its deadline.
+        """
+        stalled = self.job.stage == STAGE_EXECUTION and deadline.remaining() > COMFY_STALL_TIMEOUT
+        return deadline.cap(COMFY_STALL_TIMEOUT if stalled else None), stalled
+
+    def handle(self, event: dict) -> str:
+        """
+        Apply one event of the prompt to the job and return what the wrapper must do next.
+        """
+        job = self.job
+        t = event.get('type', '')
+        d = event.get('data', {})
+        node = d.get('node')
+        if t in ('execution_start', 'executing', 'progress', 'executed', 'binary'):
+            job.set_stage(STAGE_EXECUTION)
+        job.progress_model.on_event(event)
+        update = job.progress_model.poll()
+        if update is not None:
+            self.wrapper.progress_changed.emit(update[0])
+
+        if t == 'binary':
+            self._on_binary(d)
+        elif t == 'executing':
+            self._executing_node = node
+            if node is None:
+                if DEBUG_JobProtocol:
+                    logger.info(f"[DEBUG][JobProtocol] Generation terminated (type={t})")
+                return FINISHED
+        elif t == 'execution_cached':
+            job.record_cached(d.get('nodes') or [])
+        elif t == 'executed' and node in self.output_nodes:
+            images = (d.get('output') or {}).get('images') or []
+            self._add_images(images)
+            if DEBUG_JobProtocol:
+                logger.info(f"[DEBUG][JobProtocol] Node {node} executed, outputs={images}")
+        elif t == 'progress':
+            if node in job.total_steps:
+                raw = d.get('value', 0)
+                pct = job.update_progress(node, raw)
+                if DEBUG_JobProtocol_FULL:
+                    logger.info(f"[DEBUG][JobProtocol] {pct:.2f}% — node {node}: {raw}/{job.total_steps[node]}")
+            elif DEBUG_JobProtocol:
+                logger.info(f"[DEBUG][JobProtocol] Ignored progress for unknown node {node!r}")
+        elif t.lower() in FINISHED_EVENTS:
+            if DEBUG_JobProtocol:
+                logger.info(f"[DEBUG][JobProtocol] Generation terminated (type={t})")
+            return FINISHED
+        elif t in ('execution_error', 'execution_interrupted'):
+            self.wrapper.progress_changed.emit(100.0)
+            if DEBUG_JobProtocol:
+                logger.info(f"[DEBUG][JobProtocol] Generation stopped: {d.get('exception_message', t)}")
+            return FINISHED
+        elif t == 'session_disconnected':
+            return DISCONNECTED
+        elif t == 'session_reconnected':
+            return RECONNECTED
+        return CONTINUE
+
+    def _on_binary(self, d: dict) -> None:
+        """
+        Keep the bytes of a result frame, or emit a sampler preview at most every COMFY_PREVIEW_MIN_INTERVAL.
+        """
+        data = d.get('bytes')
+        if not data:
+            return
+        if (d.get('node') or self._executing_node) in self.output_nodes:
+            self.job.result_bytes = data
+            if DEBUG_JobProtocol:
+                logger.info(f"[DEBUG][JobProtocol] Result received over websocket ({len(data)} bytes).")
+            return
+        if not COMFY_PREVIEW_ENABLED:
+            return
+        now = time.monotonic()
+        if now - self._last_preview >= COMFY_PREVIEW_MIN_INTERVAL:
+            preview = QImage.fromData(data)
+            if not preview.isNull():
+                self._last_preview = now
+                self.wrapper.preview_ready.emit(preview)
+
+    def _add_images(self, images: list) -> None:
+        """
+        Record the output images of an output node (previews in the temp folder are skipped).
+        """
+        self.job.result_images.extend(img for img in images if img.get('type', 'output') == 'output')
+
+    def record_history(self, history: dict) -> bool:
+        """
+        Record the outputs of the prompt from a /history answer after a
+        reconnect; return False if the prompt is not there (not finished).
+        """
+        entry = history.get(self.job.prompt_id)
+        if entry is None:
+            return False
+        outputs = entry.get('outputs') or {}
+        for nid in self.output_nodes:
+            self._add_images((outputs.get(nid) or {}).get('images') or [])
+        if DEBUG_JobProtocol:
+            logger.info(f"[DEBUG][JobProtocol] Generation finished while reconnecting.")
+        return True
+
+    def is_queued(self, info: dict) -> bool:
+        """
+        True if a /queue answer still lists the prompt as running or pending.
+        """
+        entries = info.get('queue_running', []) + info.get('queue_pending', [])
+        return any(len(entry) > 1 and entry[1] == self.job.prompt_id for entry in entries)
+
+    def finish(self, owner: str) -> None:
+        """
+        Close the progress of the job and log how much of it ComfyUI served from its cache.
+        """
+        job = self.job
+        job.progress_model.finish()
+        logger.info(
+            f"[{owner}] Job {job.job_id} ({job.style}, seed={job.seed}): "
+            f"{len(job.cached_nodes)}/{len(job.template.nodes)} nodes from the ComfyUI cache ({job.cache_hit_rate():.0%})"
+        )
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+from typing import Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_ModelResidency = DEBUG
+DEBUG_ModelResidency_FULL = DEBUG_FULL
+from constant import (
+    RESIDENCY_STATS_PATH, RESIDENCY_VRAM_BUDGET, RESIDENCY_DEFAULT_MODEL_BYTES, RESIDENCY_DEFAULT_LOAD_SECONDS
+)
+from comfy_classes.workflow_registry import WorkflowRegistry
+from comfy_classes.style_popularity import StylePopularity
+from prompts import dico_styles
+
+
+class ModelResidency:
+    """
+    Decides which models stay loaded on the backends. Styles are taken in
+    the StylePopularity ranking; plan() keeps the top ones while their models
+    fit in RESIDENCY_VRAM_BUDGET of the VRAM, and the WarmupManager frees the
+    backend and warms those styles only. The VRAM and load time of each model
+    are learnt from the warm-ups and saved in RESIDENCY_STATS_PATH.
+    cold_penalty() predicts the load time a style adds on a backend; selecting
+    a style outside the plan marks the backends for a new warm-up once the
+    booth is idle again.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "ModelResidency":
+        """
+        Return the shared residency state, loaded from disk on first use.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, path: str = RESIDENCY_STATS_PATH) -> None:
+        """
+        Load the model measurements, starting empty if the file is missing.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._models: dict[str, dict] = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._models = dict(data.get('models', {}))
+        except (OSError, ValueError, AttributeError):
+            pass
+        self._planned: Optional[list] = None
+        self._resident: dict[str, set] = {}
+        self._stale: set = set()
+
+    def note_selection(self, style: str) -> None:
+        """
+        Mark every backend stale if a style outside the plan is selected.
+        """
+        with self._lock:
+            if self._planned is None or style in self._planned or not self._resident:
+                return
+            self._stale.update(self._resident)
+        if DEBUG_ModelResidency:
+            logger.info(f"[DEBUG][ModelResidency] {style} selected outside the plan, backends marked stale")
+
+    def plan(self, vram_total: Optional[int]) -> list:
+        """
+        Return the styles to keep warm, most popular first: each one whose
+        models not yet planned still fit in the budget (every style if the VRAM is unknown).
+        """
+        registry = WorkflowRegistry.get_instance()
+        budget = vram_total * RESIDENCY_VRAM_BUDGET if vram_total else None
+        planned, models, used = [], set(), 0
+        for style in StylePopularity.get_instance().ranking():
+            try:
+                new = set(registry.get(style).models) - models
+            except FileNotFoundError:
+                continue
+            cost = sum(self.model_bytes(m) for m in new)
+            if budget is not None and used + cost > budget:
+                continue
+            planned.append(style)
+            models |= new
+            used += cost
+        with self._lock:
+            self._planned = planned
+        if DEBUG_ModelResidency:
+            logger.info(f"[DEBUG][ModelResidency] Plan {planned}: {used / 1024 ** 3:.1f} of {(budget or 0) / 1024 ** 3:.1f} GiB")
+        return planned
+
+    def record_load(self, models: list, vram_bytes: Optional[int], seconds: Optional[float]) -> None:
+        """
+        Record the VRAM and time taken by loading some models together, shared evenly between them.
+        """
+        if not models:
+            return
+        with self._lock:
+            for model in models:
+                entry = self._models.setdefault(model, {})
+                if vram_bytes is not None and vram_bytes > 0:
+                    entry['bytes'] = vram_bytes // len(models)
+                if seconds is not None:
+                    entry['seconds'] = max(0.0, seconds) / len(models)
+        self._save()
+
+    def set_resident(self, backend: str, models: set) -> None:
+        """
+        Record the models a backend holds after its warm-up.
+        """
+        with self._lock:
+            self._resident[backend] = set(models)
+            self._stale.discard(backend)
+
+    def is_stale(self, backend: str) -> bool:
+        """
+        True if a style outside the plan was selected since the warm-up of this backend.
+        """
+        with self._lock:
+            return backend in self._stale
+
+    def model_bytes(self, model: str) -> int:
+        """
+        Return the learnt VRAM of a model, or RESIDENCY_DEFAULT_MODEL_BYTES.
+        """
+        with self._lock:
+            return self._models.get(model, {}).get('bytes', RESIDENCY_DEFAULT_MODEL_BYTES)
+
+    def cold_penalty(self, style: str, backend: Optional[str] = None) -> float:
+        """
+        Return the seconds of model loading a style is expected to add on a
+        backend (the best backend if none is given).
+        """
+        try:
+            models = set(WorkflowRegistry.get_instance().get(style).models)
+        except FileNotFoundError:
+            return 0.0
+        with self._lock:
+            backends = [backend] if backend is not None else list(self._resident) or [None]
+            return min(
+                sum(
+                    self._models.get(m, {}).get('seconds', RESIDENCY_DEFAULT_LOAD_SECONDS)
+                    for m in models - self._resident.get(name, set())
+                )
+                for name in backends
+            )
+
+    def penalties(self, backend: Optional[str] = None) -> dict[str, float]:
+        """
+        Return the predicted cold-load penalty of every style.
+        """
+        return {style: self.cold_penalty(style, backend) for style in dico_styles}
+
+    def _save(self) -> None:
+        """
+        Write the model measurements to disk.
+        """
+        with self._lock:
+            data = json.dumps({'models': self._models}, indent=2)
+        tmp = f"{self._path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp, self._path)
+        except OSError as e:
+            logger.info(f"[ModelResidency] Failed to save {self._path}: {e}")
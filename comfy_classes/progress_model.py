@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_ProgressEstimator = DEBUG
+DEBUG_ProgressEstimator_FULL = DEBUG_FULL
+from constant import (
+    PROGRESS_HISTORY_PATH, PROGRESS_HISTORY_ALPHA, PROGRESS_MIN_INTERVAL,
+    PROGRESS_ETA_SMOOTHING, PROGRESS_DEFAULT_STEP_SECONDS, PROGRESS_DEFAULT_NODE_SECONDS
+)
+from comfy_classes.workflow_registry import WorkflowTemplate
+
+
+class NodeTimings:
+    """
+    Average execution time of every node of every workflow, learnt from the
+    'executing' events of past jobs and saved in PROGRESS_HISTORY_PATH.
+    The history of a workflow is dropped when its digest changes.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "NodeTimings":
+        """
+        Return the shared timing history, loaded from disk on first use.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, path: str = PROGRESS_HISTORY_PATH) -> None:
+        """
+        Load the history from disk, starting empty if the file is missing.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._data: dict[str, dict] = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def expected(self, template: WorkflowTemplate) -> tuple:
+        """
+        Return (seconds per node, seconds per job) learnt for a workflow, or ({}, None).
+        """
+        with self._lock:
+            entry = self._data.get(template.name)
+            if entry is None or entry.get('digest') != template.digest:
+                return {}, None
+            return dict(entry['nodes']), entry.get('job')
+
+    def record(self, template: WorkflowTemplate, durations: dict, job_seconds: float) -> None:
+        """
+        Blend the node durations and the execution time of a finished job into the history.
+        """
+        a = PROGRESS_HISTORY_ALPHA
+        with self._lock:
+            entry = self._data.get(template.name)
+            if entry is None or entry.get('digest') != template.digest:
+                entry = self._data[template.name] = {'digest': template.digest, 'nodes': {}, 'job': None}
+            nodes = entry['nodes']
+            for nid, seconds in durations.items():
+                nodes[nid] = seconds if nid not in nodes else nodes[nid] * (1 - a) + seconds * a
+            entry['job'] = job_seconds if entry['job'] is None else entry['job'] * (1 - a) + job_seconds * a
+            data = json.dumps(self._data, indent=2)
+        tmp = f"{self._path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp, self._path)
+        except OSError as e:
+            logger.info(f"[NodeTimings] Failed to save {self._path}: {e}")
+
+
+class ProgressEstimator:
+    """
+    Progress and time left of one job, from queue to last node. Each node is
+    weighted by its learnt duration (sampler steps and defaults before any
+    history); cached nodes weigh nothing; the wait in the ComfyUI queue is the
+    number of prompts ahead times the learnt job duration. The percentage never
+    goes back and the ETA is smoothed. Fed from the worker thread with on_queued()
+    and on_event(), read from any thread with snapshot().
+    """
+
+    def __init__(self, template: WorkflowTemplate, timings: Optional[NodeTimings] = None) -> None:
+        """
+        Create the estimator of a job, reading the history of its workflow.
+        """
+        self.template = template
+        self._timings = timings or NodeTimings.get_instance()
+        learnt, self._job_seconds = self._timings.expected(template)
+        self.has_history = bool(learnt)
+        self._expected = {
+            nid: learnt.get(nid, template.total_steps.get(nid, 0) * PROGRESS_DEFAULT_STEP_SECONDS or PROGRESS_DEFAULT_NODE_SECONDS)
+            for nid in template.nodes
+        }
+        if self._job_seconds is None:
+            self._job_seconds = sum(self._expected.values())
+        self._lock = threading.Lock()
+        self._created = time.monotonic()
+        self._last_poll = 0.0
+        self._percent = 0.0
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget the server-side state (failover to another backend); elapsed time is kept.
+        """
+        with self._lock:
+            self._ahead = 0
+            self._started: Optional[float] = None
+            self._ended: Optional[float] = None
+            self._current: Optional[str] = None
+            self._node_start = 0.0
+            self._fraction = 0.0
+            self._cached: set = set()
+            self._durations: dict[str, float] = {}
+            self._done = False
+            self._failed = False
+            self._eta: Optional[float] = None
+
+    def on_queued(self, ahead: int) -> None:
+        """
+        Record the number of prompts the server runs before this one.
+        """
+        with self._lock:
+            self._ahead = max(0, int(ahead))
+
+    def on_event(self, event: dict) -> None:
+        """
+        Update the state from one event of the job (or a 'status' broadcast).
+        """
+        t = event.get('type')
+        d = event.get('data') or {}
+        now = time.monotonic()
+        with self._lock:
+            if t == 'status':
+                if self._started is None:
+                    exec_info = (d.get('status') or {}).get('exec_info') or {}
+                    if 'queue_remaining' in exec_info:
+                        self._ahead = min(self._ahead, max(0, int(exec_info['queue_remaining'] or 0) - 1))
+            elif t == 'execution_start':
+                self._started = now
+                self._ahead = 0
+            elif t == 'execution_cached':
+                self._cached.update(d.get('nodes') or [])
+            elif t == 'executing':
+                self._close_node(now)
+                if self._started is None:
+                    self._started = now
+                    self._ahead = 0
+                if d.get('node') is None:
+                    self._end(now)
+                else:
+                    self._current = d['node']
+                    self._node_start = now
+                    self._fraction = 0.0
+            elif t == 'progress':
+                if d.get('node') == self._current and d.get('max'):
+                    self._fraction = min(1.0, float(d.get('value', 0)) / float(d['max']))
+            elif t == 'execution_success':
+                self._close_node(now)
+                self._end(now)
+            elif t in ('execution_error', 'execution_interrupted'):
+                self._failed = True
+
+    def snapshot(self, now: Optional[float] = None) -> tuple:
+        """
+        Return (percent, seconds left or None without history, queued) at a given time.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._done:
+                self._percent = 100.0
+                return 100.0, 0.0, False
+            queued = self._started is None
+            remaining = sum(
+                seconds for nid, seconds in self._expected.items()
+                if nid not in self._cached and nid not in self._durations and nid != self._current
+            )
+            if self._current is not None:
+                expected = self._expected.get(self._current, PROGRESS_DEFAULT_NODE_SECONDS)
+                spent = now - self._node_start
+                if self._fraction > 0.05:
+                    remaining += spent * (1 - self._fraction) / self._fraction
+                else:
+                    remaining += max(expected - spent, expected * 0.1)
+            if queued:
+                remaining += self._ahead * self._job_seconds
+            elapsed = now - self._created
+            percent = min(99.0, elapsed / (elapsed + remaining) * 100) if elapsed + remaining > 0 else 0.0
+            self._percent = max(self._percent, percent)
+            if self._eta is None:
+                self._eta = remaining
+            else:
+                self._eta += (remaining - self._eta) * PROGRESS_ETA_SMOOTHING
+            eta = self._eta if self.has_history else None
+            return self._percent, eta, queued
+
+    def poll(self) -> Optional[tuple]:
+        """
+        Return snapshot() at most every PROGRESS_MIN_INTERVAL seconds, else None.
+        """
+        now = time.monotonic()
+        if now - self._last_poll < PROGRESS_MIN_INTERVAL and not self._done:
+            return None
+        self._last_poll = now
+        return self.snapshot(now)
+
+    def finish(self) -> None:
+        """
+        Save the node durations of a job that completed into the history.
+        """
+        with self._lock:
+            if not self._done or self._failed or self._started is None or not self._durations:
+                return
+            durations = dict(self._durations)
+            job_seconds = self._ended - self._started
+        self._timings.record(self.template, durations, job_seconds)
+        if DEBUG_ProgressEstimator:
+            logger.info(f"[DEBUG][ProgressEstimator] {self.template.name}: {len(durations)} node timings, {job_seconds:.2f}s")
+
+    def _end(self, now: float) -> None:
+        """
+        Mark the job as completed (called with the lock held).
+        """
+        if not self._done:
+            self._done = True
+            self._ended = now
+
+    def _close_node(self, now: float) -> None:
+        """
+        Record the duration of the node that was executing (called with the lock held).
+        """
+        if self._current is not None and self._current not in self._cached:
+            self._durations[self._current] = now - self._node_start
+        self._current = None
@@ -0,0 +1,119 @@
+import collections
+import math
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_QualityGovernor = DEBUG
+DEBUG_QualityGovernor_FULL = DEBUG_FULL
+from constant import (
+    QUALITY_GOVERNOR_ENABLED, QUALITY_TARGET_P90, QUALITY_WINDOW_SECONDS, QUALITY_MIN_SAMPLES,
+    QUALITY_STEP_UP_RATIO, QUALITY_MIN_DWELL
+)
+from comfy_classes.workflow_registry import WorkflowRegistry
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Return the nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class QualityGovernor:
+    """
+    Picks the quality tier of new generations from the load: the p90 of the
+    recent waits of visitors (request to result) and the wait expected from
+    the number of their jobs queued or running, times the median job duration.
+    Above QUALITY_TARGET_P90 it steps down one tier, below QUALITY_STEP_UP_RATIO
+    of it with a free slot it steps back up, at most once per QUALITY_MIN_DWELL.
+    Samples are dropped on each change so that a tier is judged on its own jobs.
+    Fed by the GenerationQueue; every change is logged with its reason.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "QualityGovernor":
+        """
+        Return the shared governor.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(WorkflowRegistry.get_instance().quality_tier_count())
+        return cls._instance
+
+    def __init__(self, tier_count: int, enabled: bool = QUALITY_GOVERNOR_ENABLED) -> None:
+        """
+        Create a governor at full quality over tier_count tiers.
+        """
+        self.enabled = enabled and tier_count > 1
+        self.max_tier = max(0, tier_count - 1)
+        self.tier = 0
+        self._lock = threading.Lock()
+        self._waits: collections.deque = collections.deque()
+        self._durations: collections.deque = collections.deque()
+        self._changed_at = time.monotonic()
+
+    def record(self, wait: float, duration: float) -> None:
+        """
+        Add the wait of a visitor (request to result) and the duration of its job (start to result).
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._waits.append((now, wait))
+            self._durations.append((now, duration))
+        if DEBUG_QualityGovernor:
+            logger.info(f"[DEBUG][QualityGovernor] Tier {self.tier}: wait {wait:.2f}s, job {duration:.2f}s")
+
+    def evaluate(self, depth: int, slots: int) -> int:
+        """
+        Return the tier of a new visitor's job given the visitors' jobs queued
+        or running and the number of jobs run at once, changing tier if due.
+        """
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            if now - self._changed_at < QUALITY_MIN_DWELL:
+                return self.tier
+            for samples in (self._waits, self._durations):
+                while samples and now - samples[0][0] > QUALITY_WINDOW_SECONDS:
+                    samples.popleft()
+            waits = [w for _, w in self._waits]
+            p90 = percentile(waits, 90) if len(waits) >= QUALITY_MIN_SAMPLES else None
+            expected = None
+            if self._durations:
+                expected = (depth // max(1, slots) + 1) * percentile([d for _, d in self._durations], 50)
+            old = self.tier
+            reason = None
+            if p90 is not None and p90 > QUALITY_TARGET_P90 and self.tier < self.max_tier:
+                self.tier += 1
+                reason = f"p90 wait {p90:.1f}s over the {QUALITY_TARGET_P90:.0f}s target"
+            elif expected is not None and expected > QUALITY_TARGET_P90 and self.tier < self.max_tier:
+                self.tier += 1
+                reason = f"{depth} jobs queued, expected wait {expected:.1f}s over the {QUALITY_TARGET_P90:.0f}s target"
+            elif self.tier > 0 and depth < slots:
+                limit = QUALITY_TARGET_P90 * QUALITY_STEP_UP_RATIO
+                if (p90 is None or p90 < limit) and (expected is None or expected < limit):
+                    self.tier -= 1
+                    reason = (
+                        f"load dropped: {depth} jobs queued, p90 wait "
+                        f"{'n/a' if p90 is None else f'{p90:.1f}s'}, expected wait "
+                        f"{'n/a' if expected is None else f'{expected:.1f}s'} under {limit:.0f}s"
+                    )
+            if reason is None:
+                return self.tier
+            self._changed_at = now
+            self._waits.clear()
+            self._durations.clear()
+            tier = self.tier
+        logger.info(f"[QualityGovernor] Quality tier {old} -> {tier}: {reason}")
+        return tier
@@ -0,0 +1,259 @@
+import concurrent.futures
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from PySide6.QtGui import QImage
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_ResultCache = DEBUG
+DEBUG_ResultCache_FULL = DEBUG_FULL
+from constant import RESULT_CACHE_DIR, RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_DISK_BYTES
+
+
+def photo_digest(qimg: QImage) -> str:
+    """
+    Return the SHA-256 of the pixels of an image with its size and format.
+    Only the same pixels give the same digest, so a result is never served
+    for another photo, however similar.
+    """
+    width, height, stride = qimg.width(), qimg.height(), qimg.bytesPerLine()
+    digest = hashlib.sha256(f"{width}x{height}:{qimg.format().name}:".encode('utf-8'))
+    bits = qimg.constBits()
+    row = (width * qimg.depth() + 7) // 8
+    if row == stride:
+        digest.update(bits[:stride * height])
+    else:
+        for y in range(height):
+            digest.update(bits[y * stride:y * stride + row])
+    return digest.hexdigest()
+
+
+def default_seed(photo: str, style: str) -> int:
+    """
+    Return the seed of the first generation of a style for a photo digest, so
+    that generating the same style twice gives the same image (and a cache hit).
+    """
+    digest = hashlib.sha256(f"{photo}:{style}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big')
+
+
+def make_key(photo: str, style: str, workflow_digest: str, seed: int) -> str:
+    """
+    Return the cache key of a generation from the photo digest.
+    """
+    return hashlib.sha256(f"{photo}:{style}:{workflow_digest}:{seed}".encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed store of generated images. A memory LRU of decoded
+    QImages sits under RESULT_CACHE_MEMORY_BYTES, in front of PNG files in
+    RESULT_CACHE_DIR trimmed to RESULT_CACHE_DISK_BYTES (oldest first).
+    The disk tier survives restarts. Every disk write, trim and purge runs
+    on the cache's own writer thread, never on the caller's.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "ResultCache":
+        """
+        Return the shared result cache.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def close_instance(cls) -> None:
+        """
+        Finish the pending disk writes (called when the application quits).
+        """
+        with cls._instance_lock:
+            cache = cls._instance
+        if cache is not None:
+            cache.close()
+
+    def __init__(self, folder: str = RESULT_CACHE_DIR, memory_bytes: int = RESULT_CACHE_MEMORY_BYTES, disk_bytes: int = RESULT_CACHE_DISK_BYTES) -> None:
+        """
+        Create the cache over the disk tier of previous runs, which the writer
+        thread trims to its budget and cleans of interrupted writes.
+        """
+        self.folder = folder
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory: "OrderedDict[str, QImage]" = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self._writer: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._get_writer().submit(self._trim_disk)
+
+    def get(self, key: str) -> Optional[QImage]:
+        """
+        Return the image stored under a key, or None.
+        """
+        with self._lock:
+            qimg = self._memory.get(key)
+            if qimg is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                if DEBUG_ResultCache:
+                    logger.info(f"[DEBUG][ResultCache] Memory hit {key[:12]}")
+                return qimg
+        path = self._path(key)
+        qimg = QImage(path) if os.path.isfile(path) else QImage()
+        with self._lock:
+            if qimg.isNull():
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, qimg)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        if DEBUG_ResultCache:
+            logger.info(f"[DEBUG][ResultCache] Disk hit {key[:12]}")
+        return qimg
+
+    def store(self, key: str, qimg: Optional[QImage]) -> Optional[concurrent.futures.Future]:
+        """
+        Store an image in memory now and on disk from the writer thread, so
+        that the PNG encode and the disk trim never hold up the caller.
+        """
+        if qimg is None or qimg.isNull():
+            return None
+        with self._lock:
+            self._remember(key, qimg)
+            return self._get_writer().submit(self._write, key, qimg)
+
+    def close(self) -> None:
+        """
+        Wait for the writer thread to store the pending images, then stop it.
+        """
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.shutdown(wait=True)
+
+    def _write(self, key: str, qimg: QImage) -> None:
+        """
+        Write an image to the disk tier and trim it to its budget.
+        """
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp = self._path(key) + '.tmp'
+            if not qimg.save(tmp, 'PNG'):
+                raise OSError(f"cannot write {tmp}")
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            logger.info(f"[ResultCache] Failed to store {key[:12]} on disk: {e}")
+            return
+        self._trim_disk()
+        if DEBUG_ResultCache:
+            logger.info(f"[DEBUG][ResultCache] Stored {key[:12]} ({qimg.sizeInBytes()} bytes decoded)")
+
+    def clear(self) -> concurrent.futures.Future:
+        """
+        Drop every cached image from memory now and from disk on the writer thread.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+            return self._get_writer().submit(self._clear_disk)
+
+    def _get_writer(self) -> concurrent.futures.ThreadPoolExecutor:
+        """
+        Return the writer thread, starting it on first use (called with the lock held).
+        """
+        if self._writer is None:
+            self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ResultCache-writer")
+        return self._writer
+
+    def _clear_disk(self) -> None:
+        """
+        Delete every file of the disk tier.
+        """
+        for name in self._disk_files() + self._tmp_files():
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+    def _path(self, key: str) -> str:
+        """
+        Return the file of a key in the disk tier.
+        """
+        return os.path.join(self.folder, f"{key}.png")
+
+    def _remember(self, key: str, qimg: QImage) -> None:
+        """
+        Insert an image in the memory tier and evict the least recently used ones
+        (called with the lock held).
+        """
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= old.sizeInBytes()
+        size = qimg.sizeInBytes()
+        if size > self.memory_bytes:
+            return
+        self._memory[key] = qimg
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= evicted.sizeInBytes()
+
+    def _disk_files(self, suffix: str = '.png') -> list:
+        """
+        Return the names of the files of the disk tier ending with suffix.
+        """
+        try:
+            return [n for n in os.listdir(self.folder) if n.endswith(suffix)]
+        except OSError:
+            return []
+
+    def _tmp_files(self) -> list:
+        """
+        Return the names of the temporary files left by interrupted writes.
+        """
+        return self._disk_files('.png.tmp')
+
+    def _trim_disk(self) -> None:
+        """
+        Delete the temporary files of interrupted writes, then the least
+        recently used files until the disk tier fits its budget (writer thread only,
+        so the file being written is never taken for a leftover).
+        """
+        for name in self._tmp_files():
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+        entries = []
+        total = 0
+        for name in self._disk_files():
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+                total -= size
+            except OSError:
+                pass
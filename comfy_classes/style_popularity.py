@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from typing import Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_StylePopularity = DEBUG
+DEBUG_StylePopularity_FULL = DEBUG_FULL
+from constant import STYLE_STATS_PATH, STYLE_STATS_SAVE_DELAY
+from prompts import dico_styles
+
+
+class StylePopularity:
+    """
+    Counts how often each style is selected and accepted, persisted in
+    STYLE_STATS_PATH. ranking() is the one popularity order of the booth:
+    speculative generation, the style buttons and the model residency plan
+    all read it. Saves are grouped and written from a timer thread
+    STYLE_STATS_SAVE_DELAY seconds after the last change.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "StylePopularity":
+        """
+        Return the shared popularity counter.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def close_instance(cls) -> None:
+        """
+        Write the pending counts (called when the application quits).
+        """
+        with cls._instance_lock:
+            popularity = cls._instance
+        if popularity is not None:
+            popularity.flush()
+
+    def __init__(self, path: str = STYLE_STATS_PATH) -> None:
+        """
+        Load the counts from disk, starting from zero if the file is missing.
+        A file of the former {style: accepts} layout is read as accepts.
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._accepts: dict[str, int] = {}
+        self._selections: dict[str, int] = {}
+        self._timer: Optional[threading.Timer] = None
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if 'accepts' in data or 'selections' in data:
+                self._accepts = {k: int(v) for k, v in data.get('accepts', {}).items()}
+                self._selections = {k: int(v) for k, v in data.get('selections', {}).items()}
+            else:
+                self._accepts = {k: int(v) for k, v in data.items()}
+        except (OSError, ValueError, AttributeError, TypeError):
+            pass
+
+    def record(self, style: str) -> None:
+        """
+        Count one more accepted result of a style.
+        """
+        with self._lock:
+            self._accepts[style] = self._accepts.get(style, 0) + 1
+            count = self._accepts[style]
+        self._schedule_save()
+        if DEBUG_StylePopularity:
+            logger.info(f"[DEBUG][StylePopularity] {style} accepted {count} times")
+
+    def record_selection(self, style: str) -> None:
+        """
+        Count one more selection of a style.
+        """
+        with self._lock:
+            self._selections[style] = self._selections.get(style, 0) + 1
+            count = self._selections[style]
+        self._schedule_save()
+        if DEBUG_StylePopularity:
+            logger.info(f"[DEBUG][StylePopularity] {style} selected {count} times")
+
+    def ranking(self, exclude: tuple = ()) -> list:
+        """
+        Return the styles by accepts, then selections, ties broken by the order of dico_styles.
+        """
+        order = list(dico_styles)
+        with self._lock:
+            key = {s: (-self._accepts.get(s, 0), -self._selections.get(s, 0), i) for i, s in enumerate(order)}
+        return sorted((s for s in order if s not in exclude), key=key.__getitem__)
+
+    def top(self, n: int, exclude: tuple = ()) -> list:
+        """
+        Return the n most popular styles.
+        """
+        return self.ranking(exclude)[:n]
+
+    def flush(self) -> None:
+        """
+        Write a pending save now.
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            self._save()
+
+    def _schedule_save(self) -> None:
+        """
+        Start the save timer unless one is already pending.
+        """
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(STYLE_STATS_SAVE_DELAY, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self) -> None:
+        """
+        Timer body: save the counts unless flush() already did.
+        """
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer = None
+        self._save()
+
+    def _save(self) -> None:
+        """
+        Write the counts to disk.
+        """
+        with self._lock:
+            data = json.dumps({'accepts': self._accepts, 'selections': self._selections}, indent=2)
+        tmp = f"{self._path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp, self._path)
+        except OSError as e:
+            logger.info(f"[StylePopularity] Failed to save style stats: {e}")
+        if DEBUG_StylePopularity_FULL:
+            logger.info(f"[DEBUG][StylePopularity] Saved {self._path}")
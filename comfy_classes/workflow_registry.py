@@ -0,0 +1,518 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_WorkflowRegistry = DEBUG
+DEBUG_WorkflowRegistry_FULL = DEBUG_FULL
+from constant import COMFY_WORKFLOW_DIR, COMFY_PRUNE_WORKFLOWS
+from constant import (
+    GENERATION_ADAPTIVE_SIZE, GENERATION_SHARE_HEIGHT, GENERATION_SIZE_TOLERANCE, GENERATION_MIN_BASE_HEIGHT,
+    DEFERRED_UPSCALE, DRAFT_STEP_RATIO, DRAFT_STEP_RATIOS, QUALITY_TIERS, QUALITY_TIERS_BY_WORKFLOW
+)
+
+DEFAULT_WORKFLOW = 'default'
+TEXT_NODE_TYPES = ('textmultiline', 'textmultilinewidget', 'textmultilineprompt')
+SAMPLER_NODE_TYPES = ('KSampler', 'KSampler (Efficient)')
+IMAGE_OUTPUT_NODE_TYPES = ('SaveImage', 'PreviewImage', 'SaveImageWebsocket')
+UPSCALE_NODE_TYPES = ('ImageUpscaleWithModel',)
+LATENT_SIZE_INPUTS = ('empty_latent_width', 'empty_latent_height', 'width', 'height')
+BASE_SUFFIX = '@base'
+UPSCALE_SUFFIX = '@upscale'
+PREPROCESS_SUFFIX = '@preprocess'
+DRAFT_SUFFIX = '@draft'
+TIER_SUFFIX = '@q'
+IMAGE_INPUTS = ('image', 'images')
+MODEL_EXTENSIONS = ('.safetensors', '.ckpt', '.pt', '.pth', '.bin', '.gguf')
+DEFAULT_UPSCALE_FACTOR = 2.0
+
+
+class WorkflowError(ValueError):
+    """
+    Raised when a workflow JSON file is not a usable ComfyUI API prompt.
+    """
+
+
+def is_text_node(class_type: str) -> bool:
+    """
+    Return True for the multiline text nodes that receive the style prompt.
+    """
+    return class_type.lower().replace(' ', '') in TEXT_NODE_TYPES
+
+
+def is_link(value: object) -> bool:
+    """
+    Return True if an input value is a [node_id, output_index] link.
+    """
+    return (
+        isinstance(value, list) and len(value) == 2
+        and isinstance(value[0], str) and isinstance(value[1], int)
+    )
+
+
+def ancestors(nodes: dict, roots: list) -> set:
+    """
+    Return the ids of the roots and of every node they depend on through links.
+    """
+    seen = set()
+    stack = list(roots)
+    while stack:
+        nid = stack.pop()
+        if nid in seen or nid not in nodes:
+            continue
+        seen.add(nid)
+        stack.extend(value[0] for value in nodes[nid]['inputs'].values() if is_link(value))
+    return seen
+
+
+def upscale_factor(model_name: str) -> float:
+    """
+    Return the scale of an upscale model from its file name (RealESRGAN_x2, 4x-UltraSharp).
+    """
+    match = re.search(r'(\d+)x|x(\d+)', model_name or '', re.IGNORECASE)
+    return float(match.group(1) or match.group(2)) if match else DEFAULT_UPSCALE_FACTOR
+
+
+class WorkflowTemplate:
+    """
+    A validated workflow with its patch points and step totals precomputed.
+    With prune, the nodes the SaveImage output does not depend on (previews of
+    intermediate images, unused branches) are dropped: ComfyUI runs every output
+    node of a prompt, so each PreviewImage costs an encode and a write per shot.
+    The sampler resolution is the input size divided by a Primitive node
+    ('b' of a MathExpression 'a//b' feeding the latent size); plan_size() picks
+    that divisor and whether the upscale model runs for a given output height.
+    models lists the model files the loaders of the workflow read.
+    output_type is the node type the workflow must end in: SaveImage for the
+    workflows that produce a result, PreviewImage for the preprocess stage.
+    """
+
+    def __init__(self, name: str, nodes: dict, path: Optional[str] = None, prune: bool = COMFY_PRUNE_WORKFLOWS, output_type: str = 'SaveImage') -> None:
+        """
+        Validate the nodes of a workflow, prune them and index the nodes the booth patches.
+        """
+        self.name = name
+        self.path = path
+        self.nodes = nodes
+        self.output_type = output_type
+        self.validate()
+        self.pruned: list[str] = []
+        self.pruned_encodes: int = 0
+        if prune:
+            self.prune()
+        self.text_nodes: list[str] = []
+        self.samplers: list[str] = []
+        self.load_images: list[str] = []
+        self.save_images: list[str] = []
+        for nid, node in nodes.items():
+            ctype = node['class_type']
+            if is_text_node(ctype):
+                self.text_nodes.append(nid)
+            elif ctype in SAMPLER_NODE_TYPES:
+                self.samplers.append(nid)
+            elif ctype == 'LoadImage':
+                self.load_images.append(nid)
+            elif ctype == 'SaveImage':
+                self.save_images.append(nid)
+        self.upscalers: dict[str, float] = {
+            nid: self._upscaler_factor(node)
+            for nid, node in nodes.items() if node['class_type'] in UPSCALE_NODE_TYPES
+        }
+        self.models: list[str] = sorted({
+            value for node in nodes.values() for value in node['inputs'].values()
+            if isinstance(value, str) and value.lower().endswith(MODEL_EXTENSIONS)
+        })
+        self.output_scale: float = 1.0
+        for factor in self.upscalers.values():
+            self.output_scale *= factor
+        self.size_divisors: list[str] = self._find_size_divisors()
+        self.size_divisor: Optional[float] = (
+            float(nodes[self.size_divisors[0]]['inputs']['value']) if self.size_divisors else None
+        )
+        self._base: Optional[WorkflowTemplate] = None
+        self._upscale: Optional[WorkflowTemplate] = None
+        self._preprocess: Optional[WorkflowTemplate] = None
+        self._steps_variants: dict[tuple, WorkflowTemplate] = {}
+        self.cacheable = True
+        self.total_steps: dict[str, float] = {
+            nid: node['inputs']['steps']
+            for nid, node in nodes.items()
+            if isinstance(node['inputs'].get('steps'), (int, float))
+        }
+        self.total_steps_sum: float = sum(self.total_steps.values())
+        self.digest = hashlib.sha256(json.dumps(nodes, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def validate(self) -> None:
+        """
+        Check the structure and the links of the workflow, raising WorkflowError.
+        """
+        if not isinstance(self.nodes, dict) or not self.nodes:
+            raise WorkflowError(f"{self.name}: workflow must be a non-empty JSON object in API format")
+        for nid, node in self.nodes.items():
+            if not isinstance(node, dict) or not isinstance(node.get('class_type'), str):
+                raise WorkflowError(f"{self.name}: node {nid} has no class_type")
+            inputs = node.setdefault('inputs', {})
+            if not isinstance(inputs, dict):
+                raise WorkflowError(f"{self.name}: node {nid} inputs must be an object")
+            for key, value in inputs.items():
+                if is_link(value) and value[0] not in self.nodes:
+                    raise WorkflowError(f"{self.name}: node {nid} input '{key}' links to missing node {value[0]}")
+        types = [node['class_type'] for node in self.nodes.values()]
+        if self.output_type not in types:
+            raise WorkflowError(f"{self.name}: no {self.output_type} node")
+        if 'LoadImage' not in types:
+            raise WorkflowError(f"{self.name}: no LoadImage node")
+
+    def prune(self) -> None:
+        """
+        Keep only the output nodes and their ancestors, recording what was dropped.
+        """
+        roots = [nid for nid, node in self.nodes.items() if node['class_type'] == self.output_type]
+        kept = ancestors(self.nodes, roots)
+        self.pruned = [nid for nid in self.nodes if nid not in kept]
+        self.pruned_encodes = sum(
+            1 for nid in self.pruned if self.nodes[nid]['class_type'] in IMAGE_OUTPUT_NODE_TYPES
+        )
+        self.nodes = {nid: node for nid, node in self.nodes.items() if nid in kept}
+
+    def _upscaler_factor(self, node: dict) -> float:
+        """
+        Return the scale of an upscale node, read from the name of its model.
+        """
+        link = node['inputs'].get('upscale_model')
+        loader = self.nodes.get(link[0]) if is_link(link) else None
+        return upscale_factor(loader['inputs'].get('model_name', '') if loader else '')
+
+    def _find_size_divisors(self) -> list:
+        """
+        Return the Primitive nodes dividing the input size into the latent size.
+        """
+        found = []
+        for node in self.nodes.values():
+            for key in LATENT_SIZE_INPUTS:
+                link = node['inputs'].get(key)
+                math = self.nodes.get(link[0]) if is_link(link) else None
+                if math is None or not math['class_type'].startswith('MathExpression'):
+                    continue
+                if '/' not in str(math['inputs'].get('expression', '')):
+                    continue
+                b = math['inputs'].get('b')
+                if not is_link(b) or b[0] in found:
+                    continue
+                primitive = self.nodes[b[0]]
+                if primitive['class_type'].startswith('Primitive') and isinstance(primitive['inputs'].get('value'), (int, float)):
+                    found.append(b[0])
+        return found
+
+    def without_upscale(self) -> "WorkflowTemplate":
+        """
+        Return the variant of the workflow that saves the sampler output directly,
+        with the upscale nodes (and their model loaders) removed.
+        """
+        if not self.upscalers:
+            return self
+        if self._base is None:
+            nodes = self.copy_prompt()
+            for nid in self.upscalers:
+                source = nodes[nid]['inputs'].get('image')
+                for node in nodes.values():
+                    for key, value in node['inputs'].items():
+                        if is_link(value) and value[0] == nid:
+                            node['inputs'][key] = source
+            self._base = WorkflowTemplate(f"{self.name}{BASE_SUFFIX}", nodes, self.path, prune=True, output_type=self.output_type)
+        return self._base
+
+    def upscale_stage(self) -> Optional["WorkflowTemplate"]:
+        """
+        Return the upscale nodes of the workflow as a workflow of their own,
+        loading the image to upscale and saving the result, or None without upscale nodes.
+        """
+        if not self.upscalers:
+            return None
+        if self._upscale is None:
+            sources = {
+                self.nodes[nid]['inputs']['image'][0] for nid in self.upscalers
+                if is_link(self.nodes[nid]['inputs'].get('image'))
+            } - set(self.upscalers)
+            upstream = ancestors(self.nodes, list(sources))
+            kept = ancestors(self.nodes, self.save_images) - upstream
+            nodes = {nid: {**self.nodes[nid], 'inputs': dict(self.nodes[nid]['inputs'])} for nid in kept}
+            load_id = self.load_images[0]
+            for node in nodes.values():
+                for key, value in node['inputs'].items():
+                    if is_link(value) and value[0] in sources:
+                        node['inputs'][key] = [load_id, 0]
+            nodes[load_id] = {'class_type': 'LoadImage', 'inputs': {'image': ''}}
+            self._upscale = WorkflowTemplate(f"{self.name}{UPSCALE_SUFFIX}", nodes, self.path, prune=True)
+        return self._upscale
+
+    def preprocess_stage(self) -> Optional["WorkflowTemplate"]:
+        """
+        Return the image nodes computed from the input alone (preprocessors,
+        size probes) as a workflow ending in a PreviewImage per preprocessed
+        image, or None if there are none. Run on the same input before the full
+        prompt, these nodes are then served from ComfyUI's execution cache.
+        PreviewImage writes to ComfyUI's temp folder, emptied when it starts,
+        and the stage has no result to retrieve.
+        """
+        if self._preprocess is None:
+            downstream = {nid for nid in self.nodes if set(self.samplers) & ancestors(self.nodes, [nid])}
+            from_input = {
+                nid for nid in self.nodes
+                if nid not in downstream and nid not in self.load_images
+                and set(self.load_images) & ancestors(self.nodes, [nid])
+                and self.nodes[nid]['class_type'] not in IMAGE_OUTPUT_NODE_TYPES
+            }
+            images = {}
+            for node in self.nodes.values():
+                for key in IMAGE_INPUTS:
+                    value = node['inputs'].get(key)
+                    if is_link(value) and value[0] in from_input:
+                        images[value[0]] = value[1]
+            leaves = [
+                nid for nid in images
+                if not any(nid in ancestors(self.nodes, [other]) for other in images if other != nid)
+            ]
+            if not leaves:
+                return None
+            kept = ancestors(self.nodes, leaves)
+            nodes = {nid: {**self.nodes[nid], 'inputs': dict(self.nodes[nid]['inputs'])} for nid in kept}
+            for nid in leaves:
+                nodes[f"{nid}_preview"] = {
+                    'class_type': 'PreviewImage',
+                    'inputs': {'images': [nid, images[nid]]},
+                }
+            self._preprocess = WorkflowTemplate(
+                f"{self.name}{PREPROCESS_SUFFIX}", nodes, self.path, prune=True, output_type='PreviewImage'
+            )
+            self._preprocess.cacheable = False
+        return self._preprocess
+
+    def draft(self, ratio: float) -> "WorkflowTemplate":
+        """
+        Return the draft of the workflow, with the sampler steps scaled by ratio.
+        """
+        return self.with_steps(ratio, DRAFT_SUFFIX)
+
+    def with_steps(self, ratio: float, suffix: str) -> "WorkflowTemplate":
+        """
+        Return the variant of the workflow with the sampler steps scaled by ratio
+        (at least one step), named with a suffix.
+        """
+        if (ratio, suffix) not in self._steps_variants:
+            nodes = self.copy_prompt()
+            for nid, steps in self.total_steps.items():
+                nodes[nid]['inputs']['steps'] = max(1, round(steps * ratio))
+            self._steps_variants[ratio, suffix] = WorkflowTemplate(
+                f"{self.name}{suffix}", nodes, self.path, prune=True, output_type=self.output_type
+            )
+        return self._steps_variants[ratio, suffix]
+
+    def plan_size(self, input_height: int, target_height: int) -> tuple:
+        """
+        Return (template, divisor) for an input and an output height: the variant
+        without upscaling when the sampler alone can reach the target, and the
+        divisor giving the smallest sampler height that meets it, never above
+        the height the workflow was made for nor below GENERATION_MIN_BASE_HEIGHT.
+        The divisor is None when the workflow has no divisor node.
+        """
+        if self.size_divisor is None or not input_height or not target_height:
+            return self, None
+        needed = target_height * GENERATION_SIZE_TOLERANCE
+        floor = min(GENERATION_MIN_BASE_HEIGHT, input_height)
+        cap = max(input_height / self.size_divisor, floor)
+        if not self.upscalers or cap >= needed:
+            template, scale = self.without_upscale(), 1.0
+        else:
+            template, scale = self, self.output_scale
+        height = min(max(needed / scale, floor), cap)
+        return template, round(input_height / height, 3)
+
+    def copy_prompt(self) -> dict:
+        """
+        Return a structural copy of the nodes that can be patched freely.
+        Link lists are shared since patches only replace input values.
+        """
+        return {
+            nid: {**node, 'inputs': dict(node['inputs'])}
+            for nid, node in self.nodes.items()
+        }
+
+
+class WorkflowRegistry:
+    """
+    Loads and validates every workflow in COMFY_WORKFLOW_DIR once.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "WorkflowRegistry":
+        """
+        Return the singleton registry, loading the workflows on first use.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.load()
+        return cls._instance
+
+    def __init__(self, directory: str = COMFY_WORKFLOW_DIR) -> None:
+        """
+        Initialize an empty registry for a workflow directory.
+        """
+        self.directory = directory
+        self._templates: dict[str, WorkflowTemplate] = {}
+        self.errors: dict[str, str] = {}
+        self.target_height: int = GENERATION_SHARE_HEIGHT
+
+    def load(self) -> dict[str, str]:
+        """
+        (Re)load every workflow JSON file and return the errors found, by file name.
+        """
+        if DEBUG_WorkflowRegistry:
+            logger.info(f"[DEBUG][WorkflowRegistry] Entering load: directory={self.directory}")
+        templates: dict[str, WorkflowTemplate] = {}
+        errors: dict[str, str] = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.json'))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                with open(path, encoding='utf-8') as f:
+                    nodes = json.load(f)
+                templates[name] = WorkflowTemplate(name, nodes, path)
+            except (OSError, json.JSONDecodeError, WorkflowError) as e:
+                errors[os.path.basename(path)] = str(e)
+                logger.error(f"[WorkflowRegistry] Invalid workflow {path}: {e}")
+        self._templates = templates
+        self.errors = errors
+        if DEBUG_WorkflowRegistry:
+            for name, template in templates.items():
+                logger.info(
+                    f"[DEBUG][WorkflowRegistry] {name}: samplers={template.samplers} "
+                    f"text={template.text_nodes} load={template.load_images} save={template.save_images} "
+                    f"steps={template.total_steps_sum} pruned={template.pruned}"
+                )
+        return errors
+
+    def check_styles(self, styles: list) -> list:
+        """
+        Return the styles that have neither their own workflow nor a default one.
+        """
+        if DEFAULT_WORKFLOW in self._templates:
+            return []
+        missing = [style for style in styles if style not in self._templates]
+        for style in missing:
+            logger.error(f"[WorkflowRegistry] No usable workflow for style '{style}'")
+        return missing
+
+    def pruning_report(self, styles: list) -> dict[str, dict]:
+        """
+        Log and return, for each style, the nodes and image encodes pruned from its workflow.
+        """
+        report = {}
+        for style in styles:
+            try:
+                template = self.get(style)
+            except FileNotFoundError:
+                continue
+            report[style] = {
+                'workflow': template.name,
+                'nodes': len(template.nodes),
+                'pruned_nodes': len(template.pruned),
+                'pruned_encodes': template.pruned_encodes,
+            }
+            if template.pruned:
+                logger.info(
+                    f"[WorkflowRegistry] {style} ({template.name}): pruned {len(template.pruned)} nodes "
+                    f"{template.pruned}, saving {template.pruned_encodes} image encodes per shot"
+                )
+        return report
+
+    def set_display_height(self, height: int) -> None:
+        """
+        Set the height results are shown at; the output target is the larger of it and GENERATION_SHARE_HEIGHT.
+        """
+        self.target_height = max(int(height), GENERATION_SHARE_HEIGHT)
+        logger.info(f"[WorkflowRegistry] Output height target {self.target_height}px (display {int(height)}px)")
+
+    def sized(self, template: WorkflowTemplate, input_height: int, draft: float = 0.0, tier: int = 0) -> tuple:
+        """
+        Return (template, divisor) to generate from an input of a given height
+        (see WorkflowTemplate.plan_size); the template unchanged if adaptive size is off.
+        With DEFERRED_UPSCALE the upscale nodes are left to upscale_stage().
+        A draft ratio gives the draft of the result, at the same size but
+        without upscaling and with fewer steps. A quality tier above 0 applies
+        the reductions of quality_tier().
+        """
+        spec = self.quality_tier(template.name, tier)
+        target = self.target_height * spec.get('height', 1.0)
+        if not GENERATION_ADAPTIVE_SIZE:
+            planned, divisor = template, None
+        else:
+            planned, divisor = template.plan_size(input_height, target)
+        if (DEFERRED_UPSCALE and template.upscalers) or draft or not spec.get('upscale', True):
+            planned = planned.without_upscale()
+        if spec.get('steps', 1.0) < 1.0:
+            planned = planned.with_steps(spec['steps'], f"{TIER_SUFFIX}{tier}")
+        if draft:
+            planned = planned.draft(draft)
+        if DEBUG_WorkflowRegistry and divisor is not None:
+            logger.info(
+                f"[DEBUG][WorkflowRegistry] {template.name}: input {input_height}px -> {planned.name}, "
+                f"divisor {divisor} (sampler {int(input_height / divisor)}px, target {self.target_height}px)"
+            )
+        return planned, divisor
+
+    def draft_ratio(self, style: str) -> float:
+        """
+        Return the draft step ratio of the workflow of a style (0 for a single pass).
+        """
+        try:
+            name = self.get(style).name
+        except FileNotFoundError:
+            return 0.0
+        return float(DRAFT_STEP_RATIOS.get(name, DRAFT_STEP_RATIO) or 0.0)
+
+    def quality_tier(self, name: str, tier: int) -> dict:
+        """
+        Return the reductions of a quality tier for a workflow (the last one
+        for a tier beyond its list); tier 0 is the workflow as saved.
+        """
+        tiers = QUALITY_TIERS_BY_WORKFLOW.get(name, QUALITY_TIERS)
+        if tier <= 0 or not tiers:
+            return {}
+        return tiers[min(tier, len(tiers) - 1)]
+
+    def quality_tier_count(self) -> int:
+        """
+        Return the number of quality tiers of the workflow with the most.
+        """
+        return max([len(QUALITY_TIERS)] + [len(tiers) for tiers in QUALITY_TIERS_BY_WORKFLOW.values()])
+
+    def needs_upscale(self, height: int) -> bool:
+        """
+        True if a result of this height is too small for the output target (a deferred upscale is due).
+        """
+        return DEFERRED_UPSCALE and height < self.target_height * GENERATION_SIZE_TOLERANCE
+
+    def get(self, style: str) -> WorkflowTemplate:
+        """
+        Return the template for a style, falling back to the default workflow.
+        """
+        template = self._templates.get(style) or self._templates.get(DEFAULT_WORKFLOW)
+        if template is None:
+            raise FileNotFoundError(f"No JSON found for {style}")
+        return template
+
+    def names(self) -> list:
+        """
+        Return the names of all loaded workflows.
+        """
+        return list(self._templates)
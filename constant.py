@@ -236,6 +236,7 @@ QToolTip {
 COUNTDOWN_FONT_STYLE = "font-size: 120px; font-weight: bold; color: #fff; font-family: Arial, sans-serif; background: transparent;"
 
 COLOR_LOADING_BAR = "rgba(0, 0, 0, 255)"
+LOADING_PREVIEW_HEIGHT_RATIO = 0.5   # live preview height in the loading overlay, relative to the screen
 
 OVERLAY_TITLE_STYLE = ("color: black; font-size: 40px; font-weight: bold; background: transparent;")
 OVERLAY_MSG_STYLE = ("color: black; font-size: 30px; background: transparent;")
@@ -417,6 +418,114 @@ WS_URL = "ws://127.0.0.1:8188/ws"
 HTTP_BASE_URL = "http://127.0.0.1:8188"
 HOTSPOT_URL = "https://192.168.10.2:5000/share"
 
+# Every ComfyUI server the booth may send generations to, as (HTTP base URL, websocket URL).
+# Add one entry per GPU box; each generation goes to the least-loaded healthy server.
+COMFY_BACKENDS = [
+    (HTTP_BASE_URL, WS_URL),
+]
+COMFY_SCHEDULER_POLL_INTERVAL = 2.0  # seconds between two /queue polls of every backend
+COMFY_FAILOVER_GRACE = 5.0           # seconds a running job waits for its backend to reconnect
+COMFY_BACKEND_RETRY_DELAY = 10.0     # seconds a failed backend is skipped by the scheduler
+GENERATION_TIMEOUT = 90.0            # seconds for a whole job: upload, queue wait, execution and retrieval
+COMFY_STALL_TIMEOUT = 30.0           # seconds a running prompt may go without any websocket event
+GENERATION_WATCHDOG_GRACE = 5.0      # seconds past GENERATION_TIMEOUT before the queue gives up on a job
+COMFY_QUEUE_DEPTH_PER_BACKEND = 2    # jobs submitted to each ComfyUI at once, the rest wait in GenerationQueue
+COMFY_HTTP_TIMEOUT = (3.05, 30)      # (connect, read) seconds for every ComfyUI HTTP call
+COMFY_HTTP_POOL_SIZE = 4             # pooled keep-alive connections to ComfyUI
+COMFY_WS_CONNECT_TIMEOUT = 5         # seconds to wait for the websocket handshake
+COMFY_WS_PING_INTERVAL = 15          # seconds between keep-alive pings
+COMFY_WS_RECONNECT_DELAY_MAX = 10    # max seconds between websocket reconnect attempts
+# How the generated image is retrieved from ComfyUI:
+#   "view"      -> filename from the websocket 'executed' event, bytes fetched from /view
+#   "websocket" -> SaveImage replaced by SaveImageWebsocket, bytes received as a binary frame
+#   "disk"      -> legacy polling of COMFY_OUTPUT_FOLDER (requires a shared filesystem)
+# "view" and "websocket" fall back to "disk" when nothing was received and COMFY_OUTPUT_FOLDER is local.
+COMFY_RETRIEVAL_MODE = "view"
+# How the captured photo reaches ComfyUI:
+#   "upload" -> encoded in memory and POSTed to /upload/image, overwriting one of at most 16 names per
+#               server (see ComfySession.input_filename()); deleted at exit if the ComfyUI folder is local
+#   "disk"   -> legacy PNG written to INPUT_IMAGE_PATH (ComfyUI must sit next to the booth)
+COMFY_INPUT_MODE = "upload"
+COMFY_UPLOAD_FORMAT = "JPG"          # "JPG" encodes much faster than "PNG" on the worker thread
+COMFY_UPLOAD_QUALITY = 95
+COMFY_UPLOAD_SUBFOLDER = "photobooth"
+COMFY_OUTPUT_PREFIX = "photobooth"   # SaveImage filename_prefix, suffixed with the job id
+COMFY_PREVIEW_ENABLED = True         # show live sampler previews in the loading overlay
+COMFY_PREVIEW_MIN_INTERVAL = 0.25    # seconds between two decoded preview frames
+COMFY_PRUNE_WORKFLOWS = True         # drop the nodes SaveImage does not depend on (PreviewImage debug nodes)
+# Warm-up: while the sleep screen is shown, a 1-step prompt per style is sent to every
+# backend so that the first visitor does not pay for loading the models. It runs again
+# when a backend reconnects (restart) or its VRAM use drops (models evicted).
+WARMUP_ENABLED = True
+WARMUP_CHECK_INTERVAL = 30.0         # seconds between two residency checks of every backend
+WARMUP_PROMPT_TIMEOUT = 180.0        # seconds a warm-up prompt may take (cold model loads included)
+WARMUP_IMAGE_SIZE = 256              # side of the synthetic input image when WARMUP_IMAGE_PATH is missing
+WARMUP_EVICTION_RATIO = 0.5          # VRAM use below this fraction of the warmed value means eviction
+# Model residency: styles are ranked by StylePopularity (accepts, then selections) and only the
+# models of the top styles that fit in the VRAM budget are warmed, after unloading
+# everything with /free, so that a rarely used style does not evict the popular ones.
+RESIDENCY_ENABLED = True
+RESIDENCY_VRAM_BUDGET = 0.8          # share of the VRAM the warmed models may fill
+RESIDENCY_DEFAULT_MODEL_BYTES = 2 * 1024 ** 3  # size assumed for a model never measured
+RESIDENCY_DEFAULT_LOAD_SECONDS = 4.0 # load time assumed for a model never measured
+RESIDENCY_REORDER_STYLES = True      # show the most popular styles first
+# Speculative generation: after a capture, also generate the most popular other styles
+# at low priority so that switching style in the validation screen is instant.
+SPECULATIVE_GENERATION = False
+SPECULATIVE_STYLE_COUNT = 2          # number of extra styles generated per capture
+# Variant prefetch: once a result is shown, extra seeds of the same style are generated at
+# low priority while the visitor decides, and "regenerate" shows one of them at once.
+VARIANT_PREFETCH_COUNT = 1           # variants kept ready or in progress (0 disables)
+# Face check: an OpenCV detector runs on the capture before it is sent to ComfyUI.
+# A photo without a face asks for a retake at once; otherwise the upload is cropped
+# around the faces (same aspect ratio), so the GPU processes fewer pixels.
+FACE_CHECK_ENABLED = True
+FACE_CROP_ENABLED = True
+FACE_DETECT_WIDTH = 480              # width of the copy the detector runs on
+FACE_MIN_SIZE_RATIO = 0.06           # smallest face detected, as a fraction of the photo width
+FACE_CROP_MARGIN = 1.2               # padding around the faces, in face heights
+FACE_CROP_MAX_AREA = 0.8             # no crop when the region keeps more than this fraction of the photo
+# Output size: the sampler resolution (the divisor node of the workflow) and the use of the
+# upscale model are chosen per job from the input height and the height the result is
+# shown at (screen) or shared at, so that no pixels are generated that nobody sees.
+GENERATION_ADAPTIVE_SIZE = True
+GENERATION_SHARE_HEIGHT = 1080       # height of the image sent to phones
+GENERATION_SIZE_TOLERANCE = 0.9      # a result this fraction of the target height is enough
+GENERATION_MIN_BASE_HEIGHT = 512     # the sampler never runs below this height (unless the input is smaller)
+# Deferred upscale: the result is shown before the upscale model runs; the upscale
+# stage runs on the shown image only when the visitor accepts it for sharing.
+DEFERRED_UPSCALE = True
+DEFERRED_UPSCALE_PREFETCH = False    # also upscale the shown result in the background, at speculative priority
+# Countdown preprocessing: a preview frame is grabbed during the countdown and the image
+# preprocessors of the style run on it; if the capture is close enough to the preview, the
+# preview is generated instead, so ComfyUI serves those nodes from its cache.
+COUNTDOWN_PREPROCESS = True
+PREPROCESS_AT_COUNT = 3              # countdown number at which the preview frame is grabbed
+PREPROCESS_MAX_DIFFERENCE = 0.04     # mean absolute difference (0-1) of the thumbnails to reuse the preview
+# Two-pass generation: a draft with a fraction of the sampler steps (same seed, no upscale)
+# is shown as soon as it lands, then cross-faded into the full-quality result.
+DRAFT_STEP_RATIO = 0.0               # draft steps / full steps for workflows not listed below (0: single pass)
+DRAFT_STEP_RATIOS = {                # per workflow name
+    'default': 0.3,
+}
+DRAFT_CROSSFADE_MS = 600             # duration of the cross-fade from the draft to the final image
+# Quality governor: when visitors' jobs queue up, generations step down through quality
+# tiers (fewer steps, no upscaler, smaller sampler size) to hold the p90 wait under the
+# target, and step back up when the load drops. Tier 0 is the workflow as saved.
+QUALITY_GOVERNOR_ENABLED = True
+QUALITY_TARGET_P90 = 25.0            # seconds from request to result that 90% of visitors should get
+QUALITY_WINDOW_SECONDS = 300.0       # age of the oldest wait that counts in the percentile
+QUALITY_MIN_SAMPLES = 3              # waits needed at a tier before its p90 is trusted
+QUALITY_STEP_UP_RATIO = 0.6          # step back up when the expected p90 is below this share of the target
+QUALITY_MIN_DWELL = 60.0             # seconds at a tier before changing it again
+QUALITY_TIERS = [                    # steps: share of the sampler steps, upscale: run the upscaler,
+    {},                              # height: share of the output height target
+    {'steps': 0.75},
+    {'steps': 0.75, 'upscale': False},
+    {'steps': 0.5, 'upscale': False, 'height': 0.75},
+]
+QUALITY_TIERS_BY_WORKFLOW = {}       # per workflow name, replaces QUALITY_TIERS
+
 import os
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 COMFY_OUTPUT_FOLDER = os.path.abspath(
@@ -428,6 +537,25 @@ INPUT_IMAGE_PATH = os.path.abspath(
 COMFY_WORKFLOW_DIR = os.path.abspath(
     os.path.join(BASE_DIR, "workflows")
 )
+STYLE_STATS_PATH = os.path.join(BASE_DIR, "style_stats.json")
+STYLE_STATS_SAVE_DELAY = 5.0         # seconds after a selection or accept before the counts are written
+RESIDENCY_STATS_PATH = os.path.join(BASE_DIR, "residency_stats.json")
+WARMUP_IMAGE_PATH = os.path.join(BASE_DIR, "warmup.jpg")  # optional photo with a face for IPAdapter FaceID
+# Generated images keyed by (photo pixel digest, style, workflow digest, seed), kept in memory
+# under a byte budget and on disk across restarts. Repeating a generation is then instant.
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_DIR = os.path.join(BASE_DIR, "result_cache")
+RESULT_CACHE_MEMORY_BYTES = 256 * 1024 * 1024
+RESULT_CACHE_DISK_BYTES = 2 * 1024 * 1024 * 1024
+# Progress and ETA of the loading overlay, from the learnt duration of every workflow node
+# and the number of prompts ahead in the ComfyUI queue.
+PROGRESS_HISTORY_PATH = os.path.join(BASE_DIR, "progress_history.json")
+PROGRESS_HISTORY_ALPHA = 0.3         # weight of the last job in the learnt node durations
+PROGRESS_MIN_INTERVAL = 0.25         # seconds between two progress updates of a job
+PROGRESS_ETA_SMOOTHING = 0.3         # weight of the new estimate in the displayed ETA
+PROGRESS_DEFAULT_STEP_SECONDS = 0.5  # sampler step duration assumed before any history
+PROGRESS_DEFAULT_NODE_SECONDS = 0.3  # other node duration assumed before any history
+PROGRESS_UPDATE_INTERVAL_MS = 500    # refresh period of the loading overlay
 
 ShareByHotspot = False  
 
@@ -1,5 +1,5 @@
 import sys
-from PySide6.QtCore import Qt, QObject, QMutex, QMutexLocker
+from PySide6.QtCore import Qt, QObject, QMutex, QMutexLocker, QTimer, QElapsedTimer
 from PySide6.QtGui import QImage, QPixmap, QPainter, QTransform
 from PySide6.QtWidgets import QApplication, QLabel, QWidget, QVBoxLayout
 
@@ -51,6 +51,13 @@ class BackgroundManager(QObject):
         self.captured: QPixmap | None = None
         self.generated: QPixmap | None = None
         self.current: str = 'live'
+        self._generated_key = None
+        self._fade_from: QPixmap | None = None
+        self._fade_ms = 0
+        self._fade_clock = QElapsedTimer()
+        self._fade_timer = QTimer(self)
+        self._fade_timer.setInterval(33)
+        self._fade_timer.timeout.connect(self._on_fade_tick)
         if DEBUG_BackgroundManager:
             logger.info(f"[DEBUG][BackgroundManager] Exiting __init__: return=None")
 
@@ -164,19 +171,61 @@ class BackgroundManager(QObject):
         if DEBUG_BackgroundManager:
             logger.info(f"[DEBUG][BackgroundManager] Exiting capture: return=None")
 
-    def set_generated(self, qimage: QImage) -> None:
+    def set_generated(self, qimage: QImage, fade_ms: int = 0) -> None:
         """
-        Set the generated image and update the view.
+        Set the generated image and update the view; with fade_ms the previous
+        generated image cross-fades into it. Setting the shown image again does nothing.
         """
         if DEBUG_BackgroundManager:
-            logger.info(f"[DEBUG][BackgroundManager] Entering set_generated: args=({qimage!r})")
+            logger.info(f"[DEBUG][BackgroundManager] Entering set_generated: args=({qimage!r}, {fade_ms!r})")
+        key = qimage.cacheKey()
         with QMutexLocker(self._mutex):
+            if key == self._generated_key and self.current == 'generated':
+                return
+            previous = self.generated if self.current == 'generated' else None
             self.generated = QPixmap.fromImage(qimage)
+            self._generated_key = key
             self.current = 'generated'
-        self._update_view()
+        self._fade_timer.stop()
+        self._fade_from = None
+        if fade_ms > 0 and previous is not None:
+            self._fade_from = previous
+            self._fade_ms = fade_ms
+            self._fade_clock.start()
+            self._fade_timer.start()
+            self._on_fade_tick()
+        else:
+            self._update_view()
         if DEBUG_BackgroundManager:
             logger.info(f"[DEBUG][BackgroundManager] Exiting set_generated: return=None")
 
+    def _on_fade_tick(self) -> None:
+        """
+        Render one frame of the cross-fade: the new generated image over the previous one with growing opacity.
+        """
+        with QMutexLocker(self._mutex):
+            target = self.generated if self.current == 'generated' else None
+        if target is None or self._fade_from is None:
+            self._fade_timer.stop()
+            self._fade_from = None
+            self._update_view()
+            return
+        t = min(1.0, self._fade_clock.elapsed() / self._fade_ms)
+        if t >= 1.0:
+            self._fade_timer.stop()
+            self._fade_from = None
+            self._render_camera(target)
+            return
+        frame = QPixmap(target.size())
+        frame.fill(Qt.black)
+        painter = QPainter(frame)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(frame.rect(), self._fade_from)
+        painter.setOpacity(t)
+        painter.drawPixmap(0, 0, target)
+        painter.end()
+        self._render_camera(frame)
+
     def on_generate(self) -> None:
         """
         Generate a test image and set it as the generated image.
@@ -195,9 +244,12 @@ class BackgroundManager(QObject):
         """
         if DEBUG_BackgroundManager:
             logger.info(f"[DEBUG][BackgroundManager] Entering cleanup: args=()")
+        self._fade_timer.stop()
+        self._fade_from = None
         with QMutexLocker(self._mutex):
             self.captured = None
             self.generated = None
+            self._generated_key = None
             self.current = 'live'
         self._update_view()
         if DEBUG_BackgroundManager:
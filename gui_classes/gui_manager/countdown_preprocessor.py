@@ -0,0 +1,106 @@
+from typing import Optional
+
+import numpy as np
+from PySide6.QtCore import QObject, Qt
+from PySide6.QtGui import QImage
+
+from comfy_classes.generation_queue import GenerationQueue, GenerationTicket, PRIORITY_INTERACTIVE
+from comfy_classes.workflow_registry import WorkflowRegistry
+from gui_classes.gui_manager.face_analyzer import FaceAnalyzer
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_CountdownPreprocessor = DEBUG
+DEBUG_CountdownPreprocessor_FULL = DEBUG_FULL
+from constant import FACE_CHECK_ENABLED, PREPROCESS_MAX_DIFFERENCE
+
+THUMBNAIL_SIZE = (64, 36)
+
+
+def frame_difference(a: QImage, b: QImage) -> float:
+    """
+    Return the mean absolute difference (0-1) of two frames, compared as small grayscale thumbnails.
+    """
+    arrays = []
+    for qimg in (a, b):
+        gray = qimg.scaled(*THUMBNAIL_SIZE, Qt.IgnoreAspectRatio, Qt.FastTransformation).convertToFormat(
+            QImage.Format_Grayscale8
+        )
+        w, h = gray.width(), gray.height()
+        arr = np.frombuffer(gray.constBits(), np.uint8, gray.bytesPerLine() * h).reshape((h, gray.bytesPerLine()))[:, :w]
+        arrays.append(arr.astype(np.int16))
+    return float(np.abs(arrays[0] - arrays[1]).mean()) / 255
+
+
+class CountdownPreprocessor(QObject):
+    """
+    Uses the idle seconds of the countdown: the image preprocessors of the
+    style (WorkflowTemplate.preprocess_stage()) run on a preview frame, and
+    if the final capture barely differs from it the preview becomes the
+    generation input, so its upload and preprocessed images are reused by
+    ComfyUI. Otherwise the preview job is cancelled and the capture is used.
+    Outcomes are counted across sessions and logged.
+    """
+    totals = {'hits': 0, 'misses': 0, 'skipped': 0}
+
+    def __init__(self, frame: QImage, style: str, parent: Optional[QObject] = None) -> None:
+        """
+        Create the preprocessor of a preview frame for one style.
+        """
+        if DEBUG_CountdownPreprocessor:
+            logger.info(f"[DEBUG][CountdownPreprocessor] Entering __init__: args={{'frame':<QImage>,'style':{style}}}")
+        super().__init__(parent)
+        self.frame = frame
+        self.style = style
+        self.input_image: Optional[QImage] = None
+        self._ticket: Optional[GenerationTicket] = None
+
+    def start(self) -> None:
+        """
+        Prepare the preview like a capture and queue its preprocessing, unless it shows no face.
+        """
+        try:
+            template = WorkflowRegistry.get_instance().get(self.style).preprocess_stage()
+        except FileNotFoundError:
+            template = None
+        if template is None:
+            return
+        self.input_image = FaceAnalyzer.get_instance().prepare(self.frame) if FACE_CHECK_ENABLED else self.frame
+        if self.input_image is None:
+            if DEBUG_CountdownPreprocessor:
+                logger.info(f"[DEBUG][CountdownPreprocessor] No face in the preview, nothing preprocessed")
+            return
+        self._ticket = GenerationQueue.get_instance().submit(
+            self.style, self.input_image, PRIORITY_INTERACTIVE, template=template
+        )
+        if DEBUG_CountdownPreprocessor:
+            logger.info(f"[DEBUG][CountdownPreprocessor] Preprocessing {template.name} ({len(template.nodes)} nodes)")
+
+    def match(self, capture: QImage) -> Optional[QImage]:
+        """
+        Return the preprocessed preview input if the capture is close enough
+        to the preview, else cancel the preview job and return None.
+        """
+        if self._ticket is None:
+            CountdownPreprocessor.totals['skipped'] += 1
+            return None
+        difference = frame_difference(self.frame, capture)
+        hit = difference <= PREPROCESS_MAX_DIFFERENCE
+        CountdownPreprocessor.totals['hits' if hit else 'misses'] += 1
+        if not hit:
+            self.cancel()
+        logger.info(
+            f"[CountdownPreprocessor] {self.style}: capture differs by {difference:.3f} from the preview, "
+            f"{'reusing it' if hit else 'not reused'} (all sessions: {CountdownPreprocessor.totals})"
+        )
+        return self.input_image if hit else None
+
+    def cancel(self) -> None:
+        """
+        Cancel the preview job if it has not finished.
+        """
+        ticket, self._ticket = self._ticket, None
+        if ticket is not None and ticket.active:
+            ticket.cancel()
@@ -0,0 +1,141 @@
+import threading
+from typing import Optional
+
+import numpy as np
+import cv2
+from PySide6.QtCore import Qt, QRect
+from PySide6.QtGui import QImage
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_FaceAnalyzer = DEBUG
+DEBUG_FaceAnalyzer_FULL = DEBUG_FULL
+from constant import FACE_DETECT_WIDTH, FACE_MIN_SIZE_RATIO, FACE_CROP_MARGIN, FACE_CROP_MAX_AREA, FACE_CROP_ENABLED
+
+FACE_CASCADE = 'haarcascade_frontalface_default.xml'
+
+
+class FaceAnalyzer:
+    """
+    CPU check of a capture before it is sent to ComfyUI: an OpenCV Haar
+    cascade runs on a downscaled grayscale copy, so that a photo without a
+    face is rejected at once instead of failing on the GPU, and the upload
+    can be cropped to the faces.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "FaceAnalyzer":
+        """
+        Return the shared analyzer, loading the cascade on first use.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, cascade_path: Optional[str] = None) -> None:
+        """
+        Load the face cascade; the analyzer is disabled if it cannot be read
+        (OpenCV builds without the objdetect cascades included).
+        """
+        self._lock = threading.Lock()
+        self._cascade = None
+        classifier = getattr(cv2, 'CascadeClassifier', None)
+        path = cascade_path or getattr(getattr(cv2, 'data', None), 'haarcascades', '') + FACE_CASCADE
+        if classifier is not None:
+            self._cascade = classifier(path)
+            if self._cascade.empty():
+                self._cascade = None
+        if self._cascade is None:
+            logger.error(f"[FaceAnalyzer] Cannot load face cascade {path}, face check disabled")
+
+    @property
+    def available(self) -> bool:
+        """
+        True if the detector is loaded.
+        """
+        return self._cascade is not None
+
+    def detect(self, qimg: QImage) -> Optional[list]:
+        """
+        Return the faces of an image as QRects in its own coordinates,
+        or None if the detector is unavailable.
+        """
+        if self._cascade is None or qimg is None or qimg.isNull():
+            return None
+        small = qimg
+        if qimg.width() > FACE_DETECT_WIDTH:
+            small = qimg.scaledToWidth(FACE_DETECT_WIDTH, Qt.FastTransformation)
+        gray = small.convertToFormat(QImage.Format_Grayscale8)
+        w, h = gray.width(), gray.height()
+        arr = np.frombuffer(gray.constBits(), np.uint8, gray.bytesPerLine() * h).reshape((h, gray.bytesPerLine()))[:, :w]
+        arr = cv2.equalizeHist(np.ascontiguousarray(arr))
+        min_side = max(16, int(w * FACE_MIN_SIZE_RATIO))
+        with self._lock:
+            found = self._cascade.detectMultiScale(arr, scaleFactor=1.1, minNeighbors=5, minSize=(min_side, min_side))
+        scale = qimg.width() / w
+        faces = [
+            QRect(int(x * scale), int(y * scale), int(fw * scale), int(fh * scale))
+            for (x, y, fw, fh) in found
+        ]
+        if DEBUG_FaceAnalyzer:
+            logger.info(f"[DEBUG][FaceAnalyzer] {len(faces)} face(s) in {qimg.width()}x{qimg.height()}: {[f.getRect() for f in faces]}")
+        return faces
+
+    @staticmethod
+    def crop_region(size: tuple, faces: list) -> Optional[QRect]:
+        """
+        Return the region around the faces, padded by FACE_CROP_MARGIN face sizes
+        and widened to the aspect ratio of the image, or None when it would
+        keep more than FACE_CROP_MAX_AREA of the image.
+        """
+        if not faces:
+            return None
+        width, height = size
+        region = faces[0]
+        for face in faces[1:]:
+            region = region.united(face)
+        margin = int(max(f.height() for f in faces) * FACE_CROP_MARGIN)
+        region = region.adjusted(-margin, -margin, margin, margin)
+        ratio = width / height
+        if region.width() / region.height() < ratio:
+            grow = int(region.height() * ratio) - region.width()
+            region.adjust(-grow // 2, 0, grow - grow // 2, 0)
+        else:
+            grow = int(region.width() / ratio) - region.height()
+            region.adjust(0, -grow // 2, 0, grow - grow // 2)
+        if region.width() >= width or region.height() >= height:
+            return None
+        region.moveLeft(min(max(region.left(), 0), width - region.width()))
+        region.moveTop(min(max(region.top(), 0), height - region.height()))
+        if region.width() * region.height() > FACE_CROP_MAX_AREA * width * height:
+            return None
+        return region
+
+    def crop(self, qimg: QImage, faces: list) -> QImage:
+        """
+        Return the image cropped around its faces, or the image itself if cropping is not worth it.
+        """
+        region = self.crop_region((qimg.width(), qimg.height()), faces)
+        if region is None:
+            return qimg
+        if DEBUG_FaceAnalyzer:
+            logger.info(f"[DEBUG][FaceAnalyzer] Cropping {qimg.width()}x{qimg.height()} to {region.getRect()}")
+        return qimg.copy(region)
+
+    def prepare(self, qimg: QImage) -> Optional[QImage]:
+        """
+        Return the generation input of a capture: cropped around its faces
+        (FACE_CROP_ENABLED), the capture itself if the detector is unavailable,
+        or None if it has no face.
+        """
+        faces = self.detect(qimg)
+        if faces is None:
+            return qimg
+        if not faces:
+            return None
+        return self.crop(qimg, faces) if FACE_CROP_ENABLED else qimg
@@ -0,0 +1,105 @@
+from typing import Optional
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QImage
+
+from comfy_classes.generation_queue import GenerationQueue, GenerationTicket, PRIORITY_SPECULATIVE, DONE
+from comfy_classes.style_popularity import StylePopularity
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_SpeculationManager = DEBUG
+DEBUG_SpeculationManager_FULL = DEBUG_FULL
+from constant import SPECULATIVE_STYLE_COUNT
+
+
+class SpeculationManager(QObject):
+    """
+    Generates the most popular other styles for one capture in the background
+    and keeps every result of the capture in a per-session cache. Jobs go
+    through the GenerationQueue at speculative priority, so an interactive
+    generation always overtakes them.
+    """
+    result_ready = Signal(str, QImage)
+    result_failed = Signal(str)
+
+    def __init__(self, input_image: QImage, parent: Optional[QObject] = None) -> None:
+        """
+        Create an empty speculation session for a captured photo.
+        """
+        if DEBUG_SpeculationManager:
+            logger.info(f"[DEBUG][SpeculationManager] Entering __init__: args={{'input_image':<QImage>}}")
+        super().__init__(parent)
+        self._input_image = input_image
+        self._cache: dict[str, QImage] = {}
+        self._tickets: dict[str, GenerationTicket] = {}
+        self._closed = False
+
+    def start(self, selected_style: str, count: int = SPECULATIVE_STYLE_COUNT) -> list:
+        """
+        Queue low-priority generations for the most popular styles other than the selected one.
+        """
+        styles = StylePopularity.get_instance().top(count, exclude=(selected_style,))
+        queue = GenerationQueue.get_instance()
+        for style in styles:
+            ticket = queue.submit(style, self._input_image, PRIORITY_SPECULATIVE)
+            if ticket.result is not None:
+                self.store(style, ticket.result)
+                continue
+            self._tickets[style] = ticket
+            ticket.finished.connect(self._on_finished)
+        if DEBUG_SpeculationManager:
+            logger.info(f"[DEBUG][SpeculationManager] Speculating on {styles}")
+        return styles
+
+    def store(self, style: str, qimg: QImage) -> None:
+        """
+        Keep a generated image of this capture.
+        """
+        if qimg is not None and not qimg.isNull():
+            self._cache[style] = qimg
+
+    def get(self, style: str) -> Optional[QImage]:
+        """
+        Return the cached image of a style, if any.
+        """
+        return self._cache.get(style)
+
+    def cancel_all(self) -> None:
+        """
+        End the session: cancel every pending job on the server and drop the cache.
+        """
+        if DEBUG_SpeculationManager:
+            logger.info(f"[DEBUG][SpeculationManager] Cancelling {list(self._tickets)}")
+        self._closed = True
+        tickets, self._tickets = self._tickets, {}
+        for ticket in tickets.values():
+            try:
+                ticket.finished.disconnect(self._on_finished)
+            except Exception:
+                pass
+            if ticket.priority >= PRIORITY_SPECULATIVE:
+                ticket.cancel()
+        self._cache.clear()
+
+    def _on_finished(self, qimg: Optional[QImage]) -> None:
+        """
+        Publish the result of a speculative ticket (delivered in the Qt thread).
+        """
+        ticket = self.sender()
+        if ticket is None:
+            return
+        style = ticket.style
+        if self._tickets.get(style) is ticket:
+            del self._tickets[style]
+        if self._closed or ticket.state != DONE:
+            return
+        if qimg is None or qimg.isNull():
+            self.result_failed.emit(style)
+            return
+        self._cache[style] = qimg
+        if DEBUG_SpeculationManager:
+            logger.info(f"[DEBUG][SpeculationManager] {style} ready")
+        self.result_ready.emit(style, qimg)
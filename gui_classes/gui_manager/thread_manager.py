@@ -2,10 +2,12 @@ import os
 import glob
 import time
 import cv2
+from typing import Optional
 from PySide6.QtCore import Qt, QObject, QThread, Signal, QTimer
 from PySide6.QtGui import QImage, QPixmap, QPainter, QTransform
 from PySide6.QtWidgets import QApplication, QLabel, QPushButton, QVBoxLayout, QWidget, QHBoxLayout, QComboBox
-from comfy_classes.comfy_class_API import ImageGeneratorAPIWrapper
+from comfy_classes.generation_queue import GenerationQueue, GenerationTicket, PRIORITY_INTERACTIVE
+from comfy_classes.generation_deadline import GenerationTimeoutError
 from gui_classes.gui_object.overlay import OverlayCountdown, OverlayLoading
 from gui_classes.gui_object.toolbox import ImageUtils
 from hotspot_classes.hotspot_client import HotspotClient
@@ -14,6 +16,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 from constant import DEBUG, DEBUG_FULL
+from constant import PROGRESS_UPDATE_INTERVAL_MS
 DEBUG_CountdownThread = DEBUG
 DEBUG_CountdownThread_FULL = DEBUG_FULL
 
@@ -28,6 +31,7 @@ DEBUG_ThreadShareImage_FULL = DEBUG_FULL
 
 class CountdownThread(QObject):
     overlay_finished = Signal()
+    tick = Signal(int)
 
     class Thread(QThread):
         tick = Signal(int)
@@ -119,6 +123,7 @@ class CountdownThread(QObject):
         if self._overlay and getattr(self._overlay, '_is_alive', True):
             if hasattr(self._overlay, 'show_number'):
                 self._overlay.show_number(count)
+        self.tick.emit(count)
         if DEBUG_CountdownThread: 
             logger.info(f"[DEBUG][CountdownThread] Exiting _on_tick: return=None")
 
@@ -181,21 +186,26 @@ class CountdownThread(QObject):
 
 class ImageGenerationThread(QObject):
     finished = Signal(object)
+    failed = Signal(object)
+    draft_ready = Signal(object)
 
-    def __init__(self, style: object, input_image: QImage, parent: QObject = None) -> None:
+    def __init__(self, style: object, input_image: QImage, parent: QObject = None, priority: int = PRIORITY_INTERACTIVE, seed: Optional[int] = None) -> None:
         """
-        Initialize the ImageGenerationThread with style, input image, and optional parent.
+        Initialize the ImageGenerationThread with style, input image, optional parent, queue priority and seed.
         """
         if DEBUG_ImageGenerationThread: 
-            logger.info(f"[DEBUG][ImageGenerationThread] Entering __init__: args={{(style, input_image, parent)}}")
+            logger.info(f"[DEBUG][ImageGenerationThread] Entering __init__: args={{(style, input_image, parent, priority, seed)}}")
         super().__init__(parent)
         self.style = style
         self.input_image = input_image
-        self.api = ImageGeneratorAPIWrapper(style=style, qimg=input_image)
+        self.priority = priority
+        self.seed = seed
+        self._ticket: Optional[GenerationTicket] = None
         self._running = True
-        self._thread = None
-        self._worker = None
         self._loading_overlay = None
+        self._eta_timer = QTimer(self)
+        self._eta_timer.setInterval(PROGRESS_UPDATE_INTERVAL_MS)
+        self._eta_timer.timeout.connect(self._on_eta_tick)
         if DEBUG_ImageGenerationThread: 
             logger.info(f"[DEBUG][ImageGenerationThread] Exiting __init__: return=None")
 
@@ -220,11 +230,6 @@ class ImageGenerationThread(QObject):
         if self.parent():
             self._loading_overlay = OverlayLoading(self.parent())
             
-            try:
-                self.api.progress_changed.disconnect()
-            except Exception:
-                pass
-            self.api.progress_changed.connect(self._on_progress_changed)
             self._loading_overlay.show()
             self._loading_overlay.raise_()
         if DEBUG_ImageGenerationThread: 
@@ -242,6 +247,43 @@ class ImageGenerationThread(QObject):
         if DEBUG_ImageGenerationThread:
             logger.info(f"[DEBUG][ImageGenerationThread] Exiting _on_progress_changed: return=None")
 
+    def _on_eta_tick(self) -> None:
+        """
+        Refresh the progress bar and the time left from the ticket's estimate.
+        """
+        estimate = self._ticket.estimate() if self._ticket is not None else None
+        if estimate is None or self._loading_overlay is None:
+            return
+        percent, eta, queued = estimate
+        self._loading_overlay.set_percent(int(percent))
+        self._loading_overlay.set_eta(eta, queued)
+        if DEBUG_ImageGenerationThread_FULL:
+            logger.info(f"[DEBUG][ImageGenerationThread] Estimate: {percent:.1f}% eta={eta} queued={queued}")
+
+    def _on_preview_ready(self, qimg: QImage) -> None:
+        """
+        Show the latest sampler preview in the loading overlay.
+        """
+        if DEBUG_ImageGenerationThread_FULL:
+            logger.info(f"[DEBUG][ImageGenerationThread] Entering _on_preview_ready: args={{(qimg,)}}")
+        if self._loading_overlay is not None:
+            self._loading_overlay.set_preview(qimg)
+        if DEBUG_ImageGenerationThread_FULL:
+            logger.info(f"[DEBUG][ImageGenerationThread] Exiting _on_preview_ready: return=None")
+
+    def _on_draft_ready(self, qimg: QImage) -> None:
+        """
+        Hide the loading overlay and emit the draft of a two-pass generation.
+        """
+        if DEBUG_ImageGenerationThread:
+            logger.info(f"[DEBUG][ImageGenerationThread] Entering _on_draft_ready: args={{(qimg,)}}")
+        if not self._running:
+            return
+        self.hide_loading()
+        self.draft_ready.emit(qimg)
+        if DEBUG_ImageGenerationThread:
+            logger.info(f"[DEBUG][ImageGenerationThread] Exiting _on_draft_ready: return=None")
+
     def hide_loading(self) -> None:
         """
         Hide and delete the loading overlay.
@@ -269,161 +311,98 @@ class ImageGenerationThread(QObject):
 
     def cleanup(self) -> None:
         """
-        Stop and delete the thread and worker, cleaning up resources.
+        Cancel the queued or running generation and release the loading overlay.
         """
         if DEBUG_ImageGenerationThread: 
             logger.info(f"[DEBUG][ImageGenerationThread] Entering cleanup: args=()")
         self.stop()
-        if self._thread:
-            if QThread.currentThread() != self._thread:
-                if self._thread.isRunning():
-                    self._thread.quit()
-                    self._thread.wait()
-                self._thread.deleteLater()
-                self._thread = None
-            else:
-                QTimer.singleShot(0, self._delete_thread_safe)
         if DEBUG_ImageGenerationThread: 
             logger.info(f"[DEBUG][ImageGenerationThread] Exiting cleanup: return=None")
 
-    def _delete_thread_safe(self) -> None:
-        """
-        Delete the thread safely in the main thread.
-        """
-        if DEBUG_ImageGenerationThread: 
-            logger.info(f"[DEBUG][ImageGenerationThread] Entering _delete_thread_safe: args=()")
-        if self._thread and QThread.currentThread() != self._thread:
-            self._thread.quit()
-            self._thread.wait()
-            self._thread.deleteLater()
-            self._thread = None
-        if DEBUG_ImageGenerationThread: 
-            logger.info(f"[DEBUG][ImageGenerationThread] Exiting _delete_thread_safe: return=None")
-
     def start(self) -> None:
         """
-        Start the background image generation and show the loading overlay.
+        Submit the generation to the GenerationQueue and show the loading overlay.
         """
         if DEBUG_ImageGenerationThread: 
             logger.info(f"[DEBUG][ImageGenerationThread] Entering start: args=()")
-        if self._thread and self._thread.isRunning():
+        if self._ticket is not None and self._ticket.active:
             if DEBUG_ImageGenerationThread: 
                 logger.info(f"[DEBUG][ImageGenerationThread] Exiting start: return=None")
             return
+        self._running = True
         self.show_loading()
-        self._thread = QThread()
-        if DEBUG_ImageGenerationThread: 
-            logger.info(f"[DEBUG][ImageGenerationThread] Starting worker thread")
-
-        class ImageGenerationWorker(QObject):
-            finished = Signal(object)
-
-            def __init__(self, api: ImageGeneratorAPIWrapper, style: any, input_image: QImage):
-                """
-                Inputs:
-                    api (ImageGeneratorAPIWrapper), style (any), input_image (QImage)
-                Outputs: initializes worker
-                """
-                if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationWorker] Entering __init__: args={{(api, style, input_image)}}")
-                super().__init__()
-                self.api = api
-                self.style = style
-                self.input_image = input_image
-                self._running = True
-                if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationWorker] Exiting __init__: return=None")
-
-            def run(self) -> None:
-                """
-                Inputs: none
-                Outputs: emits generated QImage or None
-                """
-                if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationWorker] Entering run: args=()")
-                try:
-                    self.api.set_style(self.style)
-                    if not self._running:
-                        self.finished.emit(None)
-                        if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationWorker] Exiting run: return=None")
-                        return
-                    self.api.set_img(self.input_image)
-                    self.api.generate_image()
-                    if not self._running:
-                        self.finished.emit(None)
-                        if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationWorker] Exiting run: return=None")
-                        return
-                    
-                    qimg = self.api.wait_for_and_load_image(timeout=15.0)
-                    if qimg is None or qimg.isNull():
-                        if DEBUG_ImageGenerationThread:
-                            logger.info(f"[DEBUG][ImageGenerationWorker] Failed to load generated image, falling back to input image.")
-                        self.finished.emit(self.input_image)
-                    else:
-                        if DEBUG_ImageGenerationThread:
-                            logger.info(f"[DEBUG][ImageGenerationWorker] Successfully loaded generated image.")
-                        self.finished.emit(qimg)
-                        
-                    self.api.delete_input_and_output_images()
-                except Exception as e:
-                    if DEBUG_ImageGenerationThread:
-                        logger.info(f"[DEBUG][ImageGenerationWorker] Exception: {e}")
-                    self.finished.emit(self.input_image)
-                if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationWorker] Exiting run: return=None")
-
-            def stop(self) -> None:
-                """
-                Inputs: none
-                Outputs: flags stop
-                """
-                if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationWorker] Entering stop: args=()")
-                self._running = False
-                if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationWorker] Exiting stop: return=None")
-
-        self._worker = ImageGenerationWorker(self.api, self.style, self.input_image)
-        self._worker.moveToThread(self._thread)
-        self._worker.finished.connect(self._on_worker_finished)
-        self._thread.started.connect(self._worker.run)
-        self._thread.start()
+        ticket = GenerationQueue.get_instance().submit(self.style, self.input_image, self.priority, self.seed)
+        self._ticket = ticket
+        ticket.progress_changed.connect(self._on_progress_changed)
+        ticket.preview_ready.connect(self._on_preview_ready)
+        ticket.draft_ready.connect(self._on_draft_ready)
+        ticket.finished.connect(self._on_ticket_finished)
+        if not ticket.active:
+            self._on_ticket_finished(ticket.result)
+        else:
+            self._eta_timer.start()
         if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Exiting start: return=None")
 
-    def _on_worker_finished(self, result: QImage) -> None:
+    def is_active(self) -> bool:
         """
-        Handle the completion of the worker, emit finished, clean resources, and hide loading.
+        True while the generation is queued or running.
         """
-        if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Entering _on_worker_finished: args={{(result,)}}")
-        self.finished.emit(result)
-        if self._thread:
-            if self._thread.isRunning():
-                self._thread.quit()
-                self._thread.wait()
-            self._thread.deleteLater()
-            self._thread = None
-        if self._worker:
-            self._worker.deleteLater()
-            self._worker = None
-        self.hide_loading()
-        if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Exiting _on_worker_finished: return=None")
+        return self._running and self._ticket is not None and self._ticket.active
 
-    def _on_thread_finished_hide_overlay(self) -> None:
+    def _disconnect_ticket(self) -> None:
         """
-        Placeholder method for thread finished event, does nothing.
+        Stop listening to the current ticket.
         """
-        if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Entering _on_thread_finished_hide_overlay: args=()")
-        if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Exiting _on_thread_finished_hide_overlay: return=None")
+        self._eta_timer.stop()
+        if self._ticket is None:
+            return
+        for signal, slot in (
+            (self._ticket.progress_changed, self._on_progress_changed),
+            (self._ticket.preview_ready, self._on_preview_ready),
+            (self._ticket.draft_ready, self._on_draft_ready),
+            (self._ticket.finished, self._on_ticket_finished),
+        ):
+            try:
+                signal.disconnect(slot)
+            except Exception:
+                pass
+
+    def _on_ticket_finished(self, result: Optional[QImage]) -> None:
+        """
+        Emit the generated image, or the input image if the generation failed, then hide loading.
+        A timed-out generation emits failed with its GenerationTimeoutError instead.
+        """
+        if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Entering _on_ticket_finished: args={{(result,)}}")
+        self._disconnect_ticket()
+        if not self._running:
+            if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Exiting _on_ticket_finished: return=None")
+            return
+        self._running = False
+        error = self._ticket.error if self._ticket is not None else None
+        if (result is None or result.isNull()) and isinstance(error, GenerationTimeoutError):
+            logger.info(f"[ImageGenerationThread] {self.style}: {error}")
+            self.hide_loading()
+            self.failed.emit(error)
+            if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Exiting _on_ticket_finished: return=None")
+            return
+        if result is None or result.isNull():
+            if DEBUG_ImageGenerationThread:
+                logger.info(f"[DEBUG][ImageGenerationThread] Failed to load generated image, falling back to input image.")
+            result = self.input_image
+        self.finished.emit(result)
+        self.hide_loading()
+        if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Exiting _on_ticket_finished: return=None")
 
     def stop(self) -> None:
         """
-        Stop the worker and thread, and hide the loading overlay.
+        Cancel the generation on the server and hide the loading overlay.
         """
         if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Entering stop: args=()")
         self._running = False
-        if self._thread:
-            if self._thread.isRunning():
-                self._thread.quit()
-                self._thread.wait()
-            self._thread.deleteLater()
-            self._thread = None
-        if self._worker:
-            self._worker.deleteLater()
-            self._worker = None
+        self._disconnect_ticket()
+        if self._ticket is not None and self._ticket.active:
+            self._ticket.cancel()
+        self._ticket = None
         self.hide_loading()
         if DEBUG_ImageGenerationThread: logger.info(f"[DEBUG][ImageGenerationThread] Exiting stop: return=None")
 
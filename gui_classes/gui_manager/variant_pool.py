@@ -0,0 +1,134 @@
+import random
+from typing import Optional
+
+from PySide6.QtCore import QObject
+from PySide6.QtGui import QImage
+
+from comfy_classes.generation_queue import GenerationQueue, GenerationTicket, PRIORITY_SPECULATIVE, DONE
+
+import logging
+logger = logging.getLogger(__name__)
+
+from constant import DEBUG, DEBUG_FULL
+DEBUG_VariantPool = DEBUG
+DEBUG_VariantPool_FULL = DEBUG_FULL
+from constant import VARIANT_PREFETCH_COUNT
+
+
+class VariantPool(QObject):
+    """
+    Extra seeds of the shown style, generated in the background while the
+    visitor looks at the first result, so that regenerate is instant.
+    Jobs go through the GenerationQueue at speculative priority; the unused
+    ones are cancelled when the session ends. Hit counts are kept across
+    sessions and logged when a pool is closed.
+    """
+    totals = {'hits': 0, 'partial': 0, 'misses': 0, 'unused': 0}
+
+    def __init__(self, input_image: QImage, style: str, parent: Optional[QObject] = None) -> None:
+        """
+        Create an empty pool for one style of a captured photo.
+        """
+        if DEBUG_VariantPool:
+            logger.info(f"[DEBUG][VariantPool] Entering __init__: args={{'input_image':<QImage>,'style':{style}}}")
+        super().__init__(parent)
+        self.input_image = input_image
+        self.style = style
+        self._ready: list[tuple] = []
+        self._tickets: dict[int, GenerationTicket] = {}
+        self._stats = {'hits': 0, 'partial': 0, 'misses': 0, 'unused': 0}
+        self._closed = False
+
+    def matches(self, input_image: QImage, style: str) -> bool:
+        """
+        True if the pool serves this photo and style.
+        """
+        return not self._closed and input_image is self.input_image and style == self.style
+
+    def fill(self, count: int = VARIANT_PREFETCH_COUNT) -> None:
+        """
+        Queue new seeds until count variants are ready or in progress.
+        """
+        if self._closed:
+            return
+        queue = GenerationQueue.get_instance()
+        while len(self._ready) + len(self._tickets) < count:
+            seed = random.randint(0, 2**32 - 1)
+            ticket = queue.submit(self.style, self.input_image, PRIORITY_SPECULATIVE, seed)
+            if ticket.result is not None:
+                self._ready.append((seed, ticket.result))
+                continue
+            self._tickets[seed] = ticket
+            ticket.finished.connect(self._on_finished)
+            if DEBUG_VariantPool:
+                logger.info(f"[DEBUG][VariantPool] Prefetching {self.style} seed={seed}")
+
+    def take(self) -> tuple:
+        """
+        Return (image, seed) of a ready variant, (None, seed) of one still in
+        progress (generate that seed to promote its ticket), or (None, None).
+        """
+        if self._ready:
+            self._stats['hits'] += 1
+            seed, qimg = self._ready.pop(0)
+            return qimg, seed
+        if self._tickets:
+            self._stats['partial'] += 1
+            seed, ticket = next(iter(self._tickets.items()))
+            del self._tickets[seed]
+            self._disconnect(ticket)
+            return None, seed
+        self._stats['misses'] += 1
+        return None, None
+
+    def close(self) -> None:
+        """
+        End the session: cancel the variants still in progress and log the hit rate.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        tickets, self._tickets = self._tickets, {}
+        for ticket in tickets.values():
+            self._disconnect(ticket)
+            if ticket.priority >= PRIORITY_SPECULATIVE:
+                ticket.cancel()
+        self._stats['unused'] = len(tickets) + len(self._ready)
+        self._ready = []
+        for key, value in self._stats.items():
+            VariantPool.totals[key] += value
+        if any(self._stats.values()):
+            logger.info(f"[VariantPool] {self.style}: {self._stats}, all sessions: {self.hit_rate():.0%} of regenerations prefetched")
+
+    @classmethod
+    def hit_rate(cls) -> float:
+        """
+        Return the share of regenerations served by a ready or in-progress variant, over all sessions.
+        """
+        served = cls.totals['hits'] + cls.totals['partial']
+        requests = served + cls.totals['misses']
+        return served / requests if requests else 0.0
+
+    def _disconnect(self, ticket: GenerationTicket) -> None:
+        """
+        Stop listening to a ticket.
+        """
+        try:
+            ticket.finished.disconnect(self._on_finished)
+        except Exception:
+            pass
+
+    def _on_finished(self, qimg: Optional[QImage]) -> None:
+        """
+        Move a finished variant to the ready list (delivered in the Qt thread).
+        """
+        ticket = self.sender()
+        if ticket is None or self._closed:
+            return
+        if self._tickets.get(ticket.seed) is ticket:
+            del self._tickets[ticket.seed]
+        if ticket.state != DONE or qimg is None or qimg.isNull():
+            return
+        self._ready.append((ticket.seed, qimg))
+        if DEBUG_VariantPool:
+            logger.info(f"[DEBUG][VariantPool] {self.style} seed={ticket.seed} ready ({len(self._ready)} ready)")
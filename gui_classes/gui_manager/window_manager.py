@@ -5,6 +5,9 @@ from PySide6.QtGui import QResizeEvent
 from gui_classes.gui_window.main_window import MainWindow
 from gui_classes.gui_window.sleepscreen_window import SleepScreenWindow
 from gui_classes.gui_object.scroll_widget import ScrollOverlay
+from comfy_classes.workflow_registry import WorkflowRegistry
+from comfy_classes.comfy_warmup import WarmupManager
+from prompts import dico_styles
 
 import logging
 logger = logging.getLogger(__name__)
@@ -99,12 +102,18 @@ class WindowManager(QWidget):
         if DEBUG_WindowManager:
             logger.info(f"[DEBUG][WindowManager] Entering __init__: args={{}}")
         super().__init__()
+        registry = WorkflowRegistry.get_instance()
+        registry.check_styles(list(dico_styles))
+        registry.pruning_report(list(dico_styles))
         self.setWindowTitle("PhotoBooth")
         self.setStyleSheet("background: transparent;")
         self.setAttribute(Qt.WA_TranslucentBackground, True)
         
         self.setWindowFlags(self.windowFlags() | Qt.WindowStaysOnTopHint)
         self.showFullScreen()
+        screen = self.screen() or QApplication.primaryScreen()
+        if screen is not None:
+            registry.set_display_height(round(screen.geometry().height() * screen.devicePixelRatio()))
         layout: QVBoxLayout = QVBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
         self.stack: QStackedWidget = QStackedWidget()
@@ -160,6 +169,10 @@ class WindowManager(QWidget):
         new_widget = self.widgets[index]
         self.stack.setCurrentWidget(new_widget)
         self.showFullScreen()
+        if index == 0:
+            WarmupManager.get_instance().resume()
+        else:
+            WarmupManager.get_instance().pause()
         if DEBUG_WindowManager:
             logger.info(f"[DEBUG][WindowManager] Exiting set_view: return=None")
 
@@ -553,8 +553,8 @@ class Btns:
             logger.info(f"[DEBUG][Btns] Entering setup_buttons_style_2: args={(style2_names, slot_style2, layout, start_row)}")
         self.lower_()
         self.clear_style2_btns()
-        for name in style2_names:
-            self.add_style2_btn(name, slot_style2)
+        for name, text_key in style2_names:
+            self.add_style2_btn(name, text_key, slot_style2)
         if layout:
             self.place_style2(layout, start_row)
         self.raise_()
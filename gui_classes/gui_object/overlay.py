@@ -9,10 +9,13 @@ from PySide6.QtGui import (
     QPen, QPainterPath
 )
 from constant import TITLE_LABEL_STYLE, GRID_WIDTH, COUNTDOWN_FONT_STYLE,OVERLAY_TITLE_STYLE, OVERLAY_MSG_STYLE,OVERLAY_LOADING_MSG_STYLE, OVERLAY_LOADING_TITLE_STYLE
+from constant import LOADING_PREVIEW_HEIGHT_RATIO
 from gui_classes.gui_object.btn import Btns
 from gui_classes.gui_object.toolbox import normalize_btn_name, LoadingBar
 from gui_classes.gui_manager.language_manager import language_manager
 import os
+import math
+from typing import Optional
 
 import logging
 logger = logging.getLogger(__name__)
@@ -444,6 +447,11 @@ class OverlayLoading(OverlayWhite):
         self._overlay_layout.setSpacing(20)
         self._loading_bar = LoadingBar(width_percent, height_percent, border_thickness, parent=self)
 
+        self._preview_label = QLabel(self._overlay_widget)
+        self._preview_label.setAlignment(Qt.AlignCenter)
+        self._preview_label.setStyleSheet("background: transparent;")
+        self._preview_label.hide()
+
         self._title_label = QLabel("", self._overlay_widget)
         self._title_label.setStyleSheet(OVERLAY_LOADING_TITLE_STYLE)
         self._title_label.setAlignment(Qt.AlignCenter)
@@ -453,6 +461,7 @@ class OverlayLoading(OverlayWhite):
         self._msg_label.setAlignment(Qt.AlignCenter)
 
         self._overlay_layout.addStretch(1) 
+        self._overlay_layout.addWidget(self._preview_label, alignment=Qt.AlignCenter)
         self._overlay_layout.addWidget(self._title_label, alignment=Qt.AlignCenter)
         self._overlay_layout.addWidget(self._loading_bar, alignment=Qt.AlignCenter)
         self._overlay_layout.addWidget(self._msg_label, alignment=Qt.AlignCenter)
@@ -474,6 +483,7 @@ class OverlayLoading(OverlayWhite):
         if DEBUG_OverlayLoading: 
             logger.info(f"[DEBUG][OverlayLoading] Entering update_language: args=()")
         qr_texts = language_manager.get_texts("OverlayLoading")
+        self._texts = qr_texts
         self._title_label.setText(qr_texts.get("title", ""))
         self._msg_label.setText(qr_texts.get("message", ""))
         if DEBUG_OverlayLoading: 
@@ -579,6 +589,41 @@ class OverlayLoading(OverlayWhite):
         if DEBUG_OverlayLoading: 
             logger.info(f"[DEBUG][OverlayLoading] Exiting set_percent: return=None")
 
+    def set_eta(self, seconds: Optional[float], queued: bool = False) -> None:
+        """
+        Show the estimated time left under the loading bar, or the default message if unknown.
+        Long estimates are rounded to 5 s so that the text does not flicker.
+        """
+        if DEBUG_OverlayLoading_FULL:
+            logger.info(f"[DEBUG][OverlayLoading] Entering set_eta: args={(seconds, queued)}")
+        texts = getattr(self, '_texts', {})
+        if seconds is None:
+            text = texts.get("message", "")
+        elif seconds < 2:
+            text = texts.get("finishing", texts.get("message", ""))
+        else:
+            shown = math.ceil(seconds) if seconds < 10 else int(5 * math.ceil(seconds / 5))
+            key = "queued" if queued else "eta"
+            text = texts.get(key, "{seconds} s").format(seconds=shown)
+        if self._msg_label.text() != text:
+            self._msg_label.setText(text)
+
+    def set_preview(self, qimg: QImage) -> None:
+        """
+        Show a live preview of the image being generated above the loading bar.
+        """
+        if DEBUG_OverlayLoading_FULL:
+            logger.info(f"[DEBUG][OverlayLoading] Entering set_preview: args={(qimg,)}")
+        if qimg is None or qimg.isNull():
+            return
+        screen = self.screen() or QApplication.primaryScreen()
+        max_h = int(screen.geometry().height() * LOADING_PREVIEW_HEIGHT_RATIO) if screen else qimg.height()
+        pixmap = QPixmap.fromImage(qimg).scaledToHeight(max_h, Qt.SmoothTransformation)
+        self._preview_label.setPixmap(pixmap)
+        self._preview_label.show()
+        if DEBUG_OverlayLoading_FULL:
+            logger.info(f"[DEBUG][OverlayLoading] Exiting set_preview: return=None")
+
 class OverlayRules(OverlayWhite):
     def __init__(
         self,
@@ -14,9 +14,19 @@ from PySide6.QtWidgets import QApplication, QLabel
 
 from gui_classes.gui_window.base_window import BaseWindow
 from constant import HOTSPOT_URL, TOOLTIP_STYLE, TOOLTIP_DURATION_MS, SLEEP_TIMER_SECONDS_QRCODE_OVERLAY, MAIN_WINDOW_MSG_STYLE
+from constant import SPECULATIVE_GENERATION, VARIANT_PREFETCH_COUNT, FACE_CHECK_ENABLED
+from constant import DEFERRED_UPSCALE_PREFETCH, COUNTDOWN_PREPROCESS, PREPROCESS_AT_COUNT, DRAFT_CROSSFADE_MS
+from constant import RESIDENCY_REORDER_STYLES
 from prompts import dico_styles
 from gui_classes.gui_manager.thread_manager import CountdownThread, ImageGenerationThread
 from gui_classes.gui_manager.standby_manager import StandbyManager
+from gui_classes.gui_manager.speculation_manager import SpeculationManager
+from gui_classes.gui_manager.variant_pool import VariantPool
+from gui_classes.gui_manager.face_analyzer import FaceAnalyzer
+from gui_classes.gui_manager.countdown_preprocessor import CountdownPreprocessor
+from comfy_classes.generation_queue import GenerationQueue, GenerationTicket, PRIORITY_INTERACTIVE, PRIORITY_REGENERATE, PRIORITY_SPECULATIVE
+from comfy_classes.model_residency import ModelResidency
+from comfy_classes.style_popularity import StylePopularity
 from gui_classes.gui_manager.background_manager import BackgroundManager
 from gui_classes.gui_object.overlay import OverlayRules, OverlayQrcode
 from gui_classes.gui_object.toolbox import QRCodeUtils
@@ -40,9 +50,17 @@ class MainWindow(BaseWindow):
         self.setWindowFlags(self.windowFlags() | Qt.WindowStaysOnTopHint)
         self._default_background_color = QColor(0, 0, 0)
         self.countdown_overlay_manager = CountdownThread(self, 5)
+        self.countdown_overlay_manager.tick.connect(self._on_countdown_tick)
         self._generation_task = None
         self._generation_in_progress = False
         self._countdown_callback_active = False
+        self._speculation: Optional[SpeculationManager] = None
+        self._variants: Optional[VariantPool] = None
+        self._upscale: Optional[GenerationTicket] = None
+        self._share_pending = False
+        self._preprocess: Optional[CountdownPreprocessor] = None
+        self.generation_photo: Optional[QImage] = None
+        self.draft_image: Optional[QImage] = None
         self.standby_manager = StandbyManager(parent) if hasattr(parent, 'set_view') else None
         QApplication.instance().installEventFilter(self.standby_manager)
         self.bg_label = QLabel(self)
@@ -106,6 +124,8 @@ class MainWindow(BaseWindow):
             self.background_manager.on_leave()
         super().on_leave()
         self.cleanup()
+        self.stop_variants()
+        GenerationQueue.get_instance().cancel_all()
         self.hide_loading()
         language_manager.unsubscribe(self.update_language)
         if hasattr(self, '_countdown_overlay') and self._countdown_overlay:
@@ -155,15 +175,29 @@ class MainWindow(BaseWindow):
             return
         if checked:
             self.selected_style = style_name
+            self.record_selection(style_name)
         else:
             self.selected_style = None
         if generate_image:
-            if self.original_photo and self.selected_style:
-                self.start(self.selected_style, self.original_photo)
+            if self.generation_photo and self.selected_style:
+                self.start(self.selected_style, self.generation_photo)
         if DEBUG_MainWindow:
             logger.info(f"[DEBUG][MainWindow] Exiting set_generation_style: return=None")
         self.update_frame()
 
+    def record_selection(self, style_name: str) -> None:
+        """
+        Count a selection of a style and let the residency plan know about it.
+        """
+        StylePopularity.get_instance().record_selection(style_name)
+        ModelResidency.get_instance().note_selection(style_name)
+
+    def style_order(self) -> list:
+        """
+        Return the styles in button order: the most popular first with RESIDENCY_REORDER_STYLES.
+        """
+        return StylePopularity.get_instance().ranking() if RESIDENCY_REORDER_STYLES else list(dico_styles)
+
     def take_selfie(self) -> None:
         """
         Start the selfie process, including countdown and image generation.
@@ -184,9 +218,10 @@ class MainWindow(BaseWindow):
                         callback=lambda: (
                             self.generation(
                                 self.selected_style,
-                                self.original_photo,
+                                self.generation_photo,
                                 callback=self.show_generation
-                            )
+                            ),
+                            self.start_speculation()
                         )
                     )
                 )
@@ -195,6 +230,133 @@ class MainWindow(BaseWindow):
             logger.info(f"[DEBUG][MainWindow] Exiting take_selfie: return=None")
         self.update_frame()
 
+    def start_speculation(self) -> None:
+        """
+        Generate the most popular other styles of the new capture in the background.
+        """
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Entering start_speculation: args={{}}")
+        self.stop_speculation()
+        if SPECULATIVE_GENERATION and self.generation_photo and self.selected_style:
+            self._speculation = SpeculationManager(self.generation_photo, parent=self)
+            self._speculation.start(self.selected_style)
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Exiting start_speculation: return=None")
+
+    def stop_speculation(self) -> None:
+        """
+        Cancel the speculative generations of the current capture on the server.
+        """
+        if self._speculation is not None:
+            self._speculation.cancel_all()
+            self._speculation.deleteLater()
+            self._speculation = None
+
+    def start_variants(self) -> None:
+        """
+        Prefetch other seeds of the shown style, keeping the pool of the same photo and style.
+        """
+        if not VARIANT_PREFETCH_COUNT or not self.generation_photo or not self.selected_style:
+            return
+        if self._variants is None or not self._variants.matches(self.generation_photo, self.selected_style):
+            self.stop_variants()
+            self._variants = VariantPool(self.generation_photo, self.selected_style, parent=self)
+        self._variants.fill()
+
+    def stop_variants(self) -> None:
+        """
+        Cancel the prefetched variants of the current capture on the server.
+        """
+        if self._variants is not None:
+            self._variants.close()
+            self._variants.deleteLater()
+            self._variants = None
+
+    def start_upscale(self, priority: int = PRIORITY_SPECULATIVE) -> None:
+        """
+        Queue the deferred upscale of the shown result, or raise its priority if already queued.
+        """
+        if self.generated_image is None or not self.selected_style:
+            return
+        ticket = GenerationQueue.get_instance().submit_upscale(self.selected_style, self.generated_image, priority)
+        if self._upscale is not None and self._upscale is not ticket:
+            self.stop_upscale()
+        self._upscale = ticket
+
+    def stop_upscale(self) -> None:
+        """
+        Cancel the upscale of a result that will not be shared.
+        """
+        ticket, self._upscale = self._upscale, None
+        self._share_pending = False
+        if ticket is not None and ticket.active:
+            ticket.cancel()
+
+    def share(self, qimg: QImage) -> None:
+        """
+        Show the QR code of the upscaled result, waiting for the upscale if it is still running.
+        """
+        ticket = self._upscale
+        if ticket is None or not ticket.active:
+            self.show_qrcode_overlay(ticket.result if ticket is not None and ticket.result is not None else qimg)
+            return
+        self._share_pending = True
+        self.show_loading()
+        ticket.finished.connect(self._on_upscaled)
+
+    def _on_upscaled(self, qimg: Optional[QImage]) -> None:
+        """
+        Share the upscaled result (or the shown one if the upscale failed) once it is ready.
+        """
+        if not self._share_pending or self.sender() is not self._upscale:
+            return
+        self._share_pending = False
+        self.hide_loading()
+        self.show_qrcode_overlay(qimg if qimg is not None else self.generated_image)
+
+    def regenerate(self) -> None:
+        """
+        Show another seed of the selected style: a prefetched variant when one is
+        ready, otherwise the variant in progress is promoted or a new seed generated.
+        """
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Entering regenerate: args={{}}")
+        qimg, seed = None, None
+        if self._variants is not None and self._variants.matches(self.generation_photo, self.selected_style):
+            qimg, seed = self._variants.take()
+        if qimg is not None:
+            self.show_generation(qimg)
+        else:
+            self.generation(
+                self.selected_style,
+                self.generation_photo,
+                callback=self.show_generation,
+                priority=PRIORITY_REGENERATE,
+                seed=seed
+            )
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Exiting regenerate: variant={'ready' if qimg is not None else seed}")
+
+    def switch_style(self, style_name: str) -> None:
+        """
+        Show another style of the current capture from the validation state.
+        A cached speculative result is shown at once; otherwise the style is
+        generated, which promotes its speculative ticket if one is queued or running.
+        """
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Entering switch_style: args={{'style_name':{style_name}}}")
+        if self._generation_in_progress or style_name == self.selected_style or not self.generation_photo:
+            return
+        self.selected_style = style_name
+        self.record_selection(style_name)
+        cached = self._speculation.get(style_name) if self._speculation else None
+        if cached is not None:
+            self.show_generation(cached)
+        else:
+            self.generation(style_name, self.generation_photo, callback=self.show_generation)
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Exiting switch_style: return=None")
+
     def selfie_countdown(self, on_finished: Optional[Callable[[], None]] = None) -> None:
         """
         Start the countdown before taking a selfie, with an optional callback.
@@ -209,6 +371,28 @@ class MainWindow(BaseWindow):
         if DEBUG_MainWindow:
             logger.info(f"[DEBUG][MainWindow] Exiting selfie_countdown: return=None")
 
+    def _on_countdown_tick(self, count: int) -> None:
+        """
+        Grab a preview frame at PREPROCESS_AT_COUNT and preprocess it for the selected style.
+        """
+        if not COUNTDOWN_PREPROCESS or count != PREPROCESS_AT_COUNT or not getattr(self, 'selected_style', None):
+            return
+        self.stop_preprocess()
+        pixmap = self.background_manager.get_background_image() if hasattr(self, 'background_manager') else None
+        if pixmap is None or pixmap.isNull():
+            return
+        self._preprocess = CountdownPreprocessor(pixmap.toImage(), self.selected_style, parent=self)
+        self._preprocess.start()
+
+    def stop_preprocess(self) -> None:
+        """
+        Cancel the preprocessing of a preview frame that will not be used.
+        """
+        if self._preprocess is not None:
+            self._preprocess.cancel()
+            self._preprocess.deleteLater()
+            self._preprocess = None
+
     def selfie(self, callback: Optional[Callable[[], None]] = None) -> None:
         """
         Capture a selfie and call the callback when done.
@@ -225,31 +409,99 @@ class MainWindow(BaseWindow):
                 self.original_photo = pixmap.toImage()
             else:
                 self.original_photo = None
-        if not self._generation_in_progress and self.original_photo and callback:
+        self.generation_photo = self.original_photo
+        if self.original_photo and FACE_CHECK_ENABLED and not self.check_faces():
+            callback = None
+        elif self.original_photo and self._preprocess is not None:
+            preview = self._preprocess.match(self.original_photo)
+            if preview is not None:
+                self.generation_photo = preview
+                self._preprocess.deleteLater()
+                self._preprocess = None
+        self.stop_preprocess()
+        if not self._generation_in_progress and self.generation_photo and callback:
             callback()
         if DEBUG_MainWindow:
             logger.info(f"[DEBUG][MainWindow] Exiting selfie: return=None")
         self.update_frame()
 
-    def generation(self, style_name: str, input_image: QImage, callback: Optional[Callable[[], None]] = None) -> None:
+    def check_faces(self) -> bool:
+        """
+        Look for faces in the capture before anything is sent to ComfyUI.
+        Without a face the visitor is sent back to the default state at once;
+        otherwise the generation input is cropped around the faces. Returns
+        False if the capture was rejected.
+        """
+        prepared = FaceAnalyzer.get_instance().prepare(self.original_photo)
+        if prepared is None:
+            style = self.selected_style
+            logger.info(f"[MainWindow] No face in the capture, {style} not generated")
+            self.set_state_default()
+            self.selected_style = style
+            if hasattr(self, 'btns'):
+                for btn in self.btns.get_style2_btns():
+                    btn.setChecked(btn.get_name() == style)
+                no_face_msg = self._texts.get("no_face", "No face detected, try again")
+                self.show_message(self.btns.get_style1_btns(), no_face_msg, TOOLTIP_DURATION_MS)
+            return False
+        self.generation_photo = prepared
+        return True
+
+    def generation(self, style_name: str, input_image: QImage, callback: Optional[Callable[[], None]] = None, priority: int = PRIORITY_INTERACTIVE, seed: Optional[int] = None) -> None:
         """
         Generate an image using the selected style and input image, with an optional callback.
+        A second request for the generation already running is ignored.
         """
         self.update_frame()
         if DEBUG_MainWindow:
-            logger.info(f"[DEBUG][MainWindow] Entering generation: args={{'style_name':{style_name},'input_image':<QImage>,'callback':{callback}}}")
+            logger.info(f"[DEBUG][MainWindow] Entering generation: args={{'style_name':{style_name},'input_image':<QImage>,'callback':{callback},'priority':{priority},'seed':{seed}}}")
+        task = self._generation_task
+        if task and task.is_active() and task.style == style_name and task.input_image is input_image and task.seed == seed:
+            if DEBUG_MainWindow:
+                logger.info(f"[DEBUG][MainWindow] Exiting generation: already running")
+            return
         if self._generation_task:
             self.cleanup()
         self.hide_header_label()
+        self.draft_image = None
 
-        self._generation_task = ImageGenerationThread(style=style_name, input_image=input_image, parent=self)
+        self._generation_task = ImageGenerationThread(style=style_name, input_image=input_image, parent=self, priority=priority, seed=seed)
         if callback:
             self._generation_task.finished.connect(callback)
+        self._generation_task.draft_ready.connect(self.show_draft)
+        self._generation_task.failed.connect(self._on_generation_failed)
         self._generation_task.start()
         if DEBUG_MainWindow:
             logger.info(f"[DEBUG][MainWindow] Exiting generation: return=None")
         self.update_frame()
 
+    def show_draft(self, qimg: QImage) -> None:
+        """
+        Show the draft of a two-pass generation until the final image replaces it.
+        """
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Entering show_draft: args={{'qimg':<QImage>}}")
+        if self._generation_task is None or self.sender() is not self._generation_task:
+            return
+        self.draft_image = qimg
+        self.update_frame()
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Exiting show_draft: return=None")
+
+    def _on_generation_failed(self, error: Exception) -> None:
+        """
+        Return to the default state when a generation timed out.
+        """
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Entering _on_generation_failed: args={{'error':{error!r}}}")
+        self._generation_task = None
+        self._generation_in_progress = False
+        self.draft_image = None
+        self.hide_loading()
+        self.set_state_default()
+        if DEBUG_MainWindow:
+            logger.info(f"[DEBUG][MainWindow] Exiting _on_generation_failed: return=None")
+
     def show_generation(self, qimg: QImage) -> None:
         """
         Display the generated image and update the UI to validation state.
@@ -260,8 +512,19 @@ class MainWindow(BaseWindow):
         self._generation_task = None
         self._generation_in_progress = False
         self.generated_image = qimg if qimg and not qimg.isNull() else None
+        if self.draft_image is not None and self.generated_image is not None:
+            self.flag_show_generation = True
+            self.background_manager.set_generated(self.generated_image, fade_ms=DRAFT_CROSSFADE_MS)
+        self.draft_image = None
+        if self._speculation is not None and self.generated_image is not None and self.selected_style:
+            self._speculation.store(self.selected_style, self.generated_image)
         self.update_frame()
         self.set_state_validation()
+        self.stop_upscale()
+        if self.generated_image is not None:
+            self.start_variants()
+            if DEFERRED_UPSCALE_PREFETCH:
+                self.start_upscale()
         if DEBUG_MainWindow:
             logger.info(f"[DEBUG][MainWindow] Exiting show_generation: return=None")
         self.update_frame()
@@ -302,7 +565,7 @@ class MainWindow(BaseWindow):
             self.set_state_default()
             return
         def on_rules_validated():
-            self.show_qrcode_overlay(qimg)
+            self.share(qimg)
         def on_rules_refused():
             self.set_state_default()
         overlay = OverlayRules(
@@ -329,13 +592,13 @@ class MainWindow(BaseWindow):
                 self.set_state_default()
                 return
             qimg = self.generated_image
+            if self.selected_style:
+                StylePopularity.get_instance().record(self.selected_style)
+            if ShareByHotspot:
+                self.start_upscale(PRIORITY_INTERACTIVE)
             self.show_rules_overlay(qimg)
         elif sender and sender.objectName() == 'regenerate':
-            self.generation(
-                self.selected_style,
-                self.original_photo,
-                callback=self.show_generation
-            )
+            self.regenerate()
         elif sender and sender.objectName() == 'view':
             if DEBUG_MainWindow:
                 logger.info(f"[DEBUG][MainWindow] Entering _on_accept_close: args={{}}")
@@ -371,8 +634,14 @@ class MainWindow(BaseWindow):
             logger.info(f"[DEBUG][MainWindow] Entering reset_generation_state: args={{}}")
         self._generation_in_progress = False
         self._generation_task = None
+        self.stop_speculation()
+        self.stop_variants()
+        self.stop_upscale()
+        self.stop_preprocess()
         self.generated_image = None
+        self.draft_image = None
         self.original_photo = None
+        self.generation_photo = None
         self.selected_style = None
         self.flag_show_generation = False
         if DEBUG_MainWindow:
@@ -396,7 +665,7 @@ class MainWindow(BaseWindow):
         self.flag_show_generation = False
 
         style2 = [
-            (name, f"style.{name}") for name in dico_styles.keys()
+            (name, f"style.{name}") for name in self.style_order()
         ]
         self.setup_buttons(
             style1_names=["take_selfie"],
@@ -432,7 +701,14 @@ class MainWindow(BaseWindow):
             for btn in self.btns.get_style1_btns():
                 btn.show()
                 btn.setEnabled(True)
-            self.btns.clear_style2_btns()            
+            self.btns.clear_style2_btns()
+            if self._speculation is not None:
+                self.setup_buttons_style_2(
+                    [(name, f"style.{name}") for name in self.style_order()],
+                    slot_style2=lambda checked, btn=None: self.switch_style(btn.get_name())
+                )
+                for btn in self.btns.get_style2_btns():
+                    btn.setChecked(btn.get_name() == self.selected_style)
         self.update_frame()
         if self.standby_manager:
             self.standby_manager.put_standby(False)
@@ -466,7 +742,9 @@ class MainWindow(BaseWindow):
         if DEBUG_MainWindow_FULL:
             logger.info(f"[DEBUG][MainWindow] Entering update_frame: args={{}}")
         if hasattr(self, 'background_manager') and self.background_manager:            
-            if hasattr(self, 'generated_image') and self.generated_image and not isinstance(self.generated_image, str):
+            if getattr(self, 'draft_image', None) is not None:
+                self.background_manager.set_generated(self.draft_image)
+            elif hasattr(self, 'generated_image') and self.generated_image and not isinstance(self.generated_image, str):
                 if self.flag_show_generation:
                     self.background_manager.set_generated(self.generated_image)
                 else:
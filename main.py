@@ -28,11 +28,23 @@ sys.excepthook = log_uncaught_exceptions
 from constant import DEBUG
 from PySide6.QtWidgets import QApplication
 from gui_classes.gui_manager.window_manager import WindowManager
+from comfy_classes.comfy_session import ComfySession
+from comfy_classes.comfy_scheduler import ComfyScheduler
+from comfy_classes.comfy_async import AsyncLoopThread
+from comfy_classes.comfy_warmup import WarmupManager
+from comfy_classes.style_popularity import StylePopularity
+from comfy_classes.result_cache import ResultCache
 
 def main():    
     if DEBUG:
         logger.info("[MAIN] Starting application with debug mode enabled.")
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(WarmupManager.close_instance)
+    app.aboutToQuit.connect(AsyncLoopThread.close_instance)
+    app.aboutToQuit.connect(ComfyScheduler.close_instance)
+    app.aboutToQuit.connect(ComfySession.close_all)
+    app.aboutToQuit.connect(StylePopularity.close_instance)
+    app.aboutToQuit.connect(ResultCache.close_instance)
     manager = WindowManager()
     manager.show()
     sys.exit(app.exec())